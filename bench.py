@@ -0,0 +1,725 @@
+"""
+Micro-benchmarks for `expand`. Run with
+
+    $ python3 bench.py            # every benchmark
+    $ python3 bench.py header     # only benchmarks with "header" in their name
+
+Every benchmark prints the best wall time of a few repeats, so numbers are
+comparable between runs on the same machine.
+"""
+
+import os
+import sys
+import glob
+import time
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def best_of(fn, repeat: int = 5) -> float:
+    """
+    Run `fn` `repeat` times and return the fastest wall time in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(name: str, **timings: float):
+    """
+    Print one line per timing, in microseconds.
+    """
+    print(name)
+    for label, seconds in timings.items():
+        print(f"    {label:<40} {seconds * 1e6:>12.1f} us")
+
+
+def playbook_paths() -> list[str]:
+    """
+    Every real playbook in ansible/, the same set the TUI shows.
+    """
+    return sorted(glob.glob(os.path.join(REPO_ROOT, "ansible", "*", "*.yaml")))
+
+
+# =============================================================================
+# Benchmarks
+# =============================================================================
+
+
+def bench_header_per_frame():
+    """
+    Cost of the header lookups `Choice.draw` does for one screen of rows. The
+    legacy path re-split the whole file and re-eval'd the first line per row,
+    per frame; the parsed header is just an attribute read.
+    """
+    from expand import priviledge
+    from expand.expansion_card import ExpansionCard
+
+    namespace = vars(priviledge)
+    cards = [ExpansionCard(path) for path in playbook_paths()]
+
+    def legacy_frame():
+        for card in cards:
+            first_line = card.content.split("\n")[0]
+            eval(first_line[1:].strip(), namespace)
+
+    def header_frame():
+        for card in cards:
+            card.header.priviledge
+
+    report(
+        f"header lookups per frame ({len(cards)} rows)",
+        legacy_split_and_eval=best_of(legacy_frame),
+        parsed_header=best_of(header_frame),
+    )
+
+
+def real_headers() -> list[list[str]]:
+    """
+    The first three header lines of every real playbook.
+    """
+    headers = []
+    for path in playbook_paths():
+        with open(path, encoding="UTF-8") as f:
+            headers.append([f.readline().rstrip("\n") for _ in range(3)])
+    return headers
+
+
+def synthetic_headers(count: int) -> list[list[str]]:
+    """
+    `count` header blocks sampled from the real playbooks, with a unique
+    installed probe per playbook so not every line is a repeat.
+    """
+    real = real_headers()
+
+    headers = []
+    for i in range(count):
+        priviledge, probes, _ = real[i % len(real)]
+        headers.append([priviledge, probes, f'# [AnyProbes([CommandProbe("tool{i}"), FileProbe("~/.local/bin/tool{i}")])]'])
+    return headers
+
+
+def bench_header_compile():
+    """
+    Compiling every header line with the restricted AST compiler versus the
+    old bare eval(), for the real catalog and a synthetic 5,000 playbook one.
+    """
+    from expand import probes, priviledge
+    from expand.probe_compiler import compile_expression
+
+    namespace = {**vars(probes), **vars(priviledge)}
+
+    def run_eval(headers):
+        for lines in headers:
+            for line in lines:
+                eval(line[1:].strip(), namespace)
+
+    def run_compiler(headers):
+        compile_expression.cache_clear()
+        for lines in headers:
+            for line in lines:
+                compile_expression(line[1:].strip())
+
+    real = real_headers()
+    synthetic = synthetic_headers(5000)
+
+    report(
+        f"header compile ({len(real)} real playbooks)",
+        eval=best_of(lambda: run_eval(real)),
+        ast_compiler=best_of(lambda: run_compiler(real)),
+    )
+    report(
+        f"header compile ({len(synthetic)} synthetic playbooks)",
+        eval=best_of(lambda: run_eval(synthetic), repeat=3),
+        ast_compiler=best_of(lambda: run_compiler(synthetic), repeat=3),
+    )
+
+
+def write_synthetic_catalog(directory: str, count: int):
+    """
+    Copy the real playbooks into `directory` over and over until there are
+    `count` of them, spread over the real category folders.
+    """
+    sources = playbook_paths()
+    for i in range(count):
+        source = sources[i % len(sources)]
+        category = os.path.join(directory, os.path.basename(os.path.dirname(source)))
+        os.makedirs(category, exist_ok=True)
+        with open(source, "rb") as src, open(os.path.join(category, f"{i}.yaml"), "wb") as dst:
+            dst.write(src.read())
+
+
+def bench_catalog_scan():
+    """
+    Loading the catalog on startup: reading and parsing every playbook versus
+    a stat() sweep against a warm catalog index.
+    """
+    import tempfile
+    from expand import util
+    from expand.catalog_index import CatalogIndex, read_entry
+
+    def run_read_everything(base_dir):
+        for entry in os.scandir(base_dir):
+            if not entry.is_dir():
+                continue
+            for name, path in util.get_files(entry.path).items():
+                with open(path, "rb") as file:
+                    read_entry(name, path, file.read())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic = os.path.join(tmp, "ansible")
+        write_synthetic_catalog(synthetic, 2000)
+
+        for label, base_dir in (("real", os.path.join(REPO_ROOT, "ansible")), ("2000 synthetic", synthetic)):
+            index = CatalogIndex(os.path.join(tmp, f"{len(label)}.sqlite3"))
+            index.scan(base_dir)
+            report(
+                f"catalog load ({label} playbooks)",
+                read_every_file=best_of(lambda: run_read_everything(base_dir), repeat=3),
+                warm_index=best_of(lambda: index.scan(base_dir), repeat=3),
+            )
+
+
+def bench_header_read():
+    """
+    Getting the header of large playbooks: reading the whole file versus
+    streaming just the leading comment block.
+    """
+    import tempfile
+    from expand.expansion_card import take_header
+
+    def run_read_whole(paths):
+        for path in paths:
+            with open(path, "r", encoding="UTF-8") as file:
+                take_header(file.read().split("\n"))
+
+    def run_stream_header(paths):
+        for path in paths:
+            with open(path, "r", encoding="UTF-8") as file:
+                take_header(file)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i, source in enumerate(playbook_paths()):
+            path = os.path.join(tmp, f"{i}.yaml")
+            with open(source, encoding="UTF-8") as src, open(path, "w", encoding="UTF-8") as dst:
+                dst.write(src.read())
+                dst.write("# padding to simulate a large playbook\n" * 8192)
+            paths.append(path)
+
+        report(
+            f"header read ({len(paths)} playbooks of ~300KB)",
+            read_whole_file=best_of(lambda: run_read_whole(paths)),
+            stream_header=best_of(lambda: run_stream_header(paths)),
+        )
+
+
+class NullScreen:
+    """A curses screen that draws nothing, for headless benchmarks."""
+
+    def addstr(self, *args):
+        pass
+
+
+def bench_preview_render():
+    """
+    Drawing the preview pane for every playbook, as when holding `j`, at a
+    few terminal widths: a fresh ChoicePreview per frame with no wrap cache
+    versus the pooled previews the TUI now uses.
+    """
+    from unittest.mock import patch
+    from expand.curses_cli import curses_cli
+    from expand.gui_elements import ChoicePreview
+    from expand.expansion_card import ExpansionCard, wrap_description
+
+    class FakeChoice:
+        def __init__(self, path):
+            self.name = os.path.basename(path)
+            self.file_path = path
+            self.expansion_card = ExpansionCard(path)
+
+    choices = [FakeChoice(path) for path in playbook_paths()]
+    screen = NullScreen()
+    with patch("curses.initscr"):
+        cli = curses_cli(workers=1)
+
+    def run_fresh(width):
+        with patch("expand.expansion_card.wrap_description", wrap_description.__wrapped__):
+            for choice in choices:
+                ChoicePreview(choice.name, choice.file_path).draw(screen, 0, 0, width, 50)
+
+    def run_pooled(width):
+        for choice in choices:
+            cli.get_preview(choice).draw(screen, 0, 0, width, 50)
+
+    for width in (40, 80, 160):
+        report(
+            f"preview render, width {width} ({len(choices)} frames)",
+            fresh_preview_per_frame=best_of(lambda: run_fresh(width)),
+            pooled_preview=best_of(lambda: run_pooled(width)),
+        )
+
+
+def bench_row_render():
+    """
+    Redrawing one screen of rows: rebuilding every row's layout each frame
+    versus blitting the cached render model.
+    """
+    from unittest.mock import patch
+    from expand.gui_elements import Choice
+
+    palette = {"NORMAL": 0, "RED": 1, "GREEN": 2, "YELLOW": 3}
+    with patch("expand.util.is_url_up", return_value=True):
+        choices = [Choice(os.path.basename(path), path) for path in playbook_paths()]
+        for choice in choices:
+            choice.failing_urls_task.result()
+            choice._installed_status = "Not Installed"
+
+    screen = NullScreen()
+
+    def run_rebuild():
+        for choice in choices:
+            choice._row_key = None
+            if hasattr(choice, "_priviledge_cell"):
+                del choice._priviledge_cell
+            choice.draw(screen, 0, 0, 150)
+
+    def run_cached():
+        for choice in choices:
+            choice.draw(screen, 0, 0, 150)
+
+    with patch.dict("expand.gui_elements.expand_color_palette", palette):
+        report(
+            f"row redraw ({len(choices)} rows)",
+            rebuild_every_frame=best_of(run_rebuild),
+            cached_render_model=best_of(run_cached),
+        )
+
+
+def bench_dpkg_lookup():
+    """
+    Answering 50 AptPackageProbes: one `dpkg -s` fork per package versus the
+    shared dpkg status snapshot (cold, i.e. including parsing the database,
+    and warm). Parsing is also timed on a synthetic 5,000 package database.
+    """
+    import shutil
+    import tempfile
+    import subprocess
+    from expand.inventory import DpkgStatus, dpkg_status
+
+    if shutil.which("dpkg") is None or not os.path.exists(DpkgStatus.STATUS_FILE):
+        print("dpkg lookup: skipped, no dpkg on this machine")
+        return
+
+    packages = list(dpkg_status.get())[:50]
+
+    def run_subprocess():
+        for package in packages:
+            subprocess.run(["dpkg", "-s", package], capture_output=True, check=False)
+
+    def run_snapshot_cold():
+        dpkg_status.invalidate()
+        for package in packages:
+            dpkg_status.is_installed(package)
+
+    def run_snapshot_warm():
+        for package in packages:
+            dpkg_status.is_installed(package)
+
+    report(
+        f"dpkg lookups ({len(packages)} packages, {len(dpkg_status.get())} in database)",
+        dpkg_subprocess_per_package=best_of(run_subprocess, repeat=3),
+        snapshot_cold=best_of(run_snapshot_cold),
+        snapshot_warm=best_of(run_snapshot_warm),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "status")
+        with open(path, "w") as file:
+            for i in range(5000):
+                file.write(f"Package: pkg{i}\nStatus: install ok installed\nDescription: synthetic\n\n")
+
+        original = DpkgStatus.STATUS_FILE
+        DpkgStatus.STATUS_FILE = path
+        try:
+            report("dpkg database parse (5000 synthetic packages)", parse=best_of(dpkg_status.load))
+        finally:
+            DpkgStatus.STATUS_FILE = original
+            dpkg_status.invalidate()
+
+
+def bench_path_lookup():
+    """
+    Answering 300 command probes: the old WhichProbe (`which` through
+    /bin/sh), shutil.which walking PATH per command, and the PATH index.
+    """
+    import shutil
+    import subprocess
+    from expand import inventory
+
+    commands = [f"{name}{i}" for i in range(100) for name in ("missing", "ls")][:200]
+    commands += ["ls", "sh", "python3", "git", "env"] * 20
+
+    def run_shell_which():
+        for command in commands[:30]:
+            subprocess.run(f"which {command} > /dev/null 2>&1", shell=True, check=False)
+
+    def run_shutil_which():
+        for command in commands:
+            shutil.which(command)
+
+    def run_path_index_cold():
+        inventory.new_round()
+        inventory.path_index._dirs.clear()
+        for command in commands:
+            inventory.path_index.which(command)
+
+    def run_path_index_warm():
+        for command in commands:
+            inventory.path_index.which(command)
+
+    report(
+        f"command lookups ({len(commands)} commands)",
+        shell_which_x10=best_of(run_shell_which, repeat=1) * len(commands) / 30,
+        shutil_which=best_of(run_shutil_which),
+        path_index_cold=best_of(run_path_index_cold),
+        path_index_warm=best_of(run_path_index_warm),
+    )
+
+
+def bench_file_match():
+    """
+    FileMatchProbe on a matching 8 MB config: the old full read of both files
+    per evaluation, a cold hash-cache run, and a warm one.
+    """
+    import tempfile
+    from expand import inventory
+    from expand.probes import FileMatchProbe
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.urandom(8 << 20)
+        source = os.path.join(tmp, "source.conf")
+        dest = os.path.join(tmp, "dest.conf")
+        for path in (source, dest):
+            with open(path, "wb") as file:
+                file.write(data)
+
+        probe = FileMatchProbe.__new__(FileMatchProbe)
+        probe.source, probe.dest = source, dest
+        inventory.FileHashes.CACHE_FILE = os.path.join(tmp, "file_hashes.json")
+
+        def run_full_read():
+            with open(source, "rb") as sf, open(dest, "rb") as df:
+                assert sf.read() == df.read()
+
+        def run_cold():
+            inventory.file_hashes.clear()
+            assert probe.is_installed()
+
+        def run_warm():
+            assert probe.is_installed()
+
+        assert probe.is_installed()
+        report(
+            "file match (8 MB)",
+            full_read=best_of(run_full_read),
+            hash_cache_cold=best_of(run_cold),
+            hash_cache_warm=best_of(run_warm),
+        )
+
+
+def bench_grep_batch():
+    """
+    200 GrepProbes against one 4 MB file: the old read-and-decode per probe,
+    a cold shared scan, and cached lookups.
+    """
+    import tempfile
+    from expand import inventory
+    from expand.probes import GrepProbe
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "profile")
+        with open(path, "w", encoding="UTF-8") as file:
+            for i in range(100000):
+                file.write(f"export SETTING_{i}=\"value {i * 7919 % 100003}\"\n")
+
+        patterns = [f"SETTING_{i}=" for i in range(0, 200000, 1000)]
+        probes = [GrepProbe(path, pattern) for pattern in patterns]
+
+        def run_read_per_probe():
+            for pattern in patterns:
+                with open(path, "r", encoding="UTF-8") as file:
+                    pattern in file.read()
+
+        def run_cold():
+            inventory.grep_index._files.clear()
+            for probe in probes:
+                probe.is_installed()
+
+        def run_warm():
+            for probe in probes:
+                probe.is_installed()
+
+        report(
+            f"grep probes ({len(patterns)} patterns, 4 MB file)",
+            read_per_probe=best_of(run_read_per_probe, repeat=1),
+            shared_scan_cold=best_of(run_cold),
+            shared_scan_warm=best_of(run_warm),
+        )
+
+
+def bench_refresh_after_install():
+    """
+    Statuses after installing one package into a 500 playbook catalog: the
+    old full rebuild (index scan, new Choices, every probe) versus refreshing
+    only the probes whose observed resources changed.
+    """
+    import tempfile
+    from unittest.mock import patch
+    from expand import inventory
+    from expand.catalog_index import CatalogIndex
+    from expand.evaluator import probe_evaluator
+    from expand.gui_elements import Choice
+
+    with tempfile.TemporaryDirectory() as tmp, patch("expand.util.is_url_up", return_value=True):
+        synthetic = os.path.join(tmp, "ansible")
+        write_synthetic_catalog(synthetic, 500)
+        index = CatalogIndex(os.path.join(tmp, "index.sqlite3"))
+
+        def build():
+            inventory.new_round()
+            choices = [Choice(entry.name, entry.path, entry) for _, entries in index.scan(synthetic) for entry in entries]
+            probe_evaluator.evaluate(choices)
+            return choices
+
+        choices = build()
+        report(
+            "statuses after one install (500 playbooks)",
+            full_rebuild=best_of(build, repeat=3),
+            incremental_refresh=best_of(lambda: probe_evaluator.refresh(choices)),
+        )
+
+
+def bench_probe_engine():
+    """
+    A cold probe round over 500 synthetic playbooks with `brew` and `pipx`
+    stubs that take 250 ms each (about Homebrew's start-up time): the old
+    4-thread pool against the asyncio engine.
+    """
+    import tempfile
+    from unittest.mock import patch
+    from concurrent.futures import ThreadPoolExecutor
+    from expand import inventory
+    from expand.catalog_index import CatalogIndex
+    from expand.evaluator import probe_evaluator, _leaves
+    from expand.gui_elements import Choice
+
+    def thread_pool_evaluate(choices, workers=4):
+        tasks = []
+        for choice in choices:
+            header = choice.expansion_card.header
+            tasks += [(probe_evaluator.is_compatible, probe) for probe in header.probes]
+            tasks += [(probe_evaluator.is_installed, probe) for probe in _leaves(header.installed_probes)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda task: task[0](task[1]), dict.fromkeys(tasks)))
+
+    with tempfile.TemporaryDirectory() as tmp, patch("expand.util.is_url_up", return_value=True):
+        bin_dir = os.path.join(tmp, "bin")
+        os.makedirs(bin_dir)
+        for name in ("brew", "pipx"):
+            with open(os.path.join(bin_dir, name), "w", encoding="UTF-8") as file:
+                file.write("#!/bin/sh\nsleep 0.25\necho mtmr\n")
+            os.chmod(os.path.join(bin_dir, name), 0o755)
+
+        old_environ = dict(os.environ)
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+        os.environ["PIPX_HOME"] = os.path.join(tmp, "no-pipx")
+        os.environ["HOME"] = os.path.join(tmp, "home")
+
+        synthetic = os.path.join(tmp, "ansible")
+        write_synthetic_catalog(synthetic, 500)
+        index = CatalogIndex(os.path.join(tmp, "index.sqlite3"))
+        choices = [Choice(entry.name, entry.path, entry) for _, entries in index.scan(synthetic) for entry in entries]
+
+        def cold(evaluate):
+            def run():
+                inventory.new_round()
+                inventory.brew_inventory.invalidate()
+                inventory.pipx_inventory.invalidate()
+                evaluate(choices, 4)
+            return run
+
+        try:
+            report(
+                "cold probe round (500 playbooks, slow brew/pipx)",
+                thread_pool=best_of(cold(thread_pool_evaluate), repeat=3),
+                asyncio_engine=best_of(cold(probe_evaluator.evaluate), repeat=3),
+            )
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+
+
+def url_test_servers(count: int, certificate: str = None) -> list:
+    """
+    `count` local HTTP servers, HTTPS if given a `certificate`, that answer
+    every HEAD with 200 and count the connections they accept.
+    """
+    import ssl
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with self.server.lock:
+                self.server.connections += 1
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    servers = []
+    for _ in range(count):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        server.lock = threading.Lock()
+        server.connections = 0
+        server.scheme = "http"
+        if certificate:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate)
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+            server.scheme = "https"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def self_signed_certificate(directory: str):
+    """
+    A key and self-signed certificate for 127.0.0.1 in one PEM file, or None
+    if `openssl` isn't available.
+    """
+    import shutil
+    import subprocess
+
+    if not shutil.which("openssl"):
+        return None
+    path = os.path.join(directory, "localhost.pem")
+    result = subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            "-keyout", path, "-out", path + ".crt",
+        ],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        return None
+    with open(path, "a", encoding="UTF-8") as key, open(path + ".crt", encoding="UTF-8") as cert:
+        key.write(cert.read())
+    return path
+
+
+def bench_url_checks():
+    """
+    Checking 400 URLs spread over 4 local hosts on the URL checker's pool:
+    a fresh connection per check (the old module-level `requests.head`)
+    against each worker's keep-alive session. Prints the connections each
+    approach opened. HTTPS is only measured if `openssl` can make a
+    certificate.
+    """
+    import tempfile
+    import requests
+    from unittest.mock import patch
+    from expand import util
+    from expand.url_checker import UrlChecker
+
+    def legacy_is_url_up(url, session=None):
+        try:
+            return requests.head(url, allow_redirects=True, timeout=5).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def check_all(urls, is_url_up):
+        def run():
+            util._moved_urls.clear()
+            with patch("expand.util.is_url_up", side_effect=is_url_up):
+                checker = UrlChecker()
+                assert checker.submit(urls).result() == []
+        return run
+
+    with tempfile.TemporaryDirectory() as tmp:
+        certificate = self_signed_certificate(tmp)
+        old_bundle = os.environ.get("REQUESTS_CA_BUNDLE")
+
+        for label, cert in (("http", None), ("https", certificate)):
+            if label == "https" and not cert:
+                print("url checks (https): skipped, openssl is not available")
+                continue
+            if cert:
+                os.environ["REQUESTS_CA_BUNDLE"] = cert
+
+            servers = url_test_servers(4, cert)
+            urls = [
+                f"{server.scheme}://127.0.0.1:{server.server_port}/page{i}"
+                for i in range(100) for server in servers
+            ]
+
+            connections = {}
+            timings = {}
+            try:
+                for name, is_url_up in (("new_connection_per_url", legacy_is_url_up), ("worker_sessions", util.is_url_up)):
+                    before = sum(server.connections for server in servers)
+                    timings[name] = best_of(check_all(urls, is_url_up), repeat=3)
+                    connections[name] = (sum(server.connections for server in servers) - before) // 3
+            finally:
+                for server in servers:
+                    server.shutdown()
+                    server.server_close()
+                if old_bundle is None:
+                    os.environ.pop("REQUESTS_CA_BUNDLE", None)
+                else:
+                    os.environ["REQUESTS_CA_BUNDLE"] = old_bundle
+
+            report(f"url checks ({len(urls)} URLs on {len(servers)} {label} hosts)", **timings)
+            for name, count in connections.items():
+                print(f"    {name + ' connections':<40} {count:>12}")
+
+
+BENCHMARKS = [
+    bench_header_per_frame,
+    bench_header_compile,
+    bench_catalog_scan,
+    bench_header_read,
+    bench_preview_render,
+    bench_row_render,
+    bench_dpkg_lookup,
+    bench_path_lookup,
+    bench_file_match,
+    bench_grep_batch,
+    bench_refresh_after_install,
+    bench_probe_engine,
+    bench_url_checks,
+]
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(REPO_ROOT)
+
+    patterns = sys.argv[1:]
+    for benchmark in BENCHMARKS:
+        if patterns and not any(p in benchmark.__name__ for p in patterns):
+            continue
+        benchmark()
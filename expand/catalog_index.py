@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import hashlib
+import logging
+from typing import NamedTuple
+from expand import util
+from expand.expansion_card import take_header
+
+
+class CatalogEntry(NamedTuple):
+    """
+    What `expand` needs from one playbook without opening it: its header
+    comment block (privilege, probes and description lines), every URL in
+    the file and the (mtime_ns, size) they were read at, if known.
+    """
+
+    name: str
+    path: str
+    comments: tuple
+    urls: frozenset
+    stamp: tuple = None
+
+
+def read_entry(name: str, path: str, data: bytes) -> CatalogEntry:
+    """
+    Build a CatalogEntry from the raw bytes of a playbook.
+    """
+    text = data.decode("UTF-8")
+    comments = take_header(text.split("\n"))
+
+    return CatalogEntry(name, path, tuple(comments), frozenset(util.filter_str_for_urls(text)))
+
+
+def _split_lines(text: str) -> tuple:
+    return tuple(text.split("\n")) if text else ()
+
+
+class CatalogIndex:
+    """
+    Persistent index of every playbook in ansible/, so that starting `expand`
+    is a stat() sweep plus one index load instead of reading every file.
+
+    Rows are keyed by path and validated by (mtime, size). When those change
+    the file is read and hashed; if the hash still matches only the stat
+    columns are updated, otherwise the header and URLs are re-extracted.
+
+    The index stores the raw header lines, not parsed headers: those are
+    compiled when a Choice is built, each distinct line once per process
+    (see `compile_expression`), and shared through `load_header`'s cache by
+    every card for the same (path, mtime, size).
+
+    The index is a single SQLite file; header lines and URLs are stored
+    newline-separated since neither can contain a newline. Its schema version is stored in
+    `PRAGMA user_version` and a mismatch simply rebuilds the index. If the
+    index can't be opened or written, `expand` carries on without it.
+    """
+
+    INDEX_FILE = "catalog.sqlite3"
+    VERSION = 1
+
+    def __init__(self, index_file: str = None):
+        self.index_file = index_file or CatalogIndex.INDEX_FILE
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.index_file)
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CatalogIndex.VERSION:
+            connection.execute("DROP TABLE IF EXISTS playbooks")
+            connection.execute(
+                """
+                CREATE TABLE playbooks (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    comments TEXT NOT NULL,
+                    urls TEXT NOT NULL
+                )
+                """
+            )
+            connection.execute(f"PRAGMA user_version = {CatalogIndex.VERSION}")
+            connection.commit()
+        return connection
+
+    def _load_rows(self, connection) -> dict[str, tuple]:
+        rows = connection.execute(
+            "SELECT path, mtime_ns, size, sha256, comments, urls FROM playbooks"
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    def scan(self, base_dir: str) -> list[tuple[str, list[CatalogEntry]]]:
+        """
+        Return every category folder in `base_dir` with its playbooks, sorted
+        by name:
+
+            [ ("config", [CatalogEntry, ...]), ("heavy", [...]), ... ]
+
+        Only playbooks that changed since the last scan are read from disk.
+        """
+        try:
+            connection = self._connect()
+            rows = self._load_rows(connection)
+        except sqlite3.Error as e:
+            logging.warning(f"Catalog index {self.index_file} unusable: {e}")
+            connection = None
+            rows = {}
+
+        categories = []
+        updates = []
+        seen = set()
+
+        for entry in sorted(os.scandir(base_dir), key=lambda e: e.name):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+
+            entries = []
+            for file_entry in sorted(os.scandir(entry.path), key=lambda e: e.name):
+                if not file_entry.is_file():
+                    continue
+
+                name, path = file_entry.name, file_entry.path
+                stat = file_entry.stat()
+                seen.add(path)
+                row = rows.get(path)
+
+                if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+                    entries.append(CatalogEntry(
+                        name, path, _split_lines(row[3]), frozenset(_split_lines(row[4])),
+                        (stat.st_mtime_ns, stat.st_size),
+                    ))
+                    continue
+
+                with open(path, "rb") as file:
+                    data = file.read()
+                digest = hashlib.sha256(data).hexdigest()
+
+                if row is not None and row[2] == digest:
+                    catalog_entry = CatalogEntry(name, path, _split_lines(row[3]), frozenset(_split_lines(row[4])))
+                else:
+                    catalog_entry = read_entry(name, path, data)
+                catalog_entry = catalog_entry._replace(stamp=(stat.st_mtime_ns, stat.st_size))
+
+                entries.append(catalog_entry)
+                updates.append((
+                    path, stat.st_mtime_ns, stat.st_size, digest,
+                    "\n".join(catalog_entry.comments),
+                    "\n".join(sorted(catalog_entry.urls)),
+                ))
+
+            categories.append((entry.name, entries))
+
+        logging.debug(f"Catalog index: {len(seen)} playbooks, {len(updates)} re-read")
+
+        if connection is not None:
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO playbooks VALUES (?, ?, ?, ?, ?, ?)", updates
+                    )
+                    prefix = os.path.join(base_dir, "")
+                    connection.executemany(
+                        "DELETE FROM playbooks WHERE path = ?",
+                        [(path,) for path in rows if path.startswith(prefix) and path not in seen],
+                    )
+            except sqlite3.Error as e:
+                logging.warning(f"Could not update catalog index {self.index_file}: {e}")
+            finally:
+                connection.close()
+
+        return categories
@@ -6,17 +6,21 @@ This file is in charge of drawing the UI to the screen.
 import curses
 import subprocess
 import os
-import platform
 import pwd
 import shutil
+import logging
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from expand import util
+import traceback
+from expand.evaluator import probe_evaluator
+from expand import util, inventory
 from expand.failure_cache import FailureCache
+from expand.status_cache import StatusCache
+from expand.url_checker import url_checker
+from expand import watcher
+from expand.catalog_index import CatalogIndex
 from expand.gui_elements import ChoicePreview, Choice, OutputPanel
 from expand.colors import init_colors
 from expand.priviledge import AnyUserNoEscalation, OnlyRoot, AnyUserNoEscalationOnDarwin
-from expand.expansion_card import ExpansionCard
 
 class package_select:
     def __init__(self, category: int, selection: int):
@@ -41,21 +45,39 @@ class curses_cli:
         self.filter_mode = False
         self.filter_query = ""
         self.filter_active = False
+        self.previews = {}
+        # Background check of statuses restored from the StatusCache, or of
+        # rows whose watched files changed
+        self.revalidation = None
+        self.watcher = None
+
+    def get_preview(self, choice: 'Choice') -> ChoicePreview:
+        """
+        Return the pooled ChoicePreview for `choice`, creating it on first
+        use. Previews share the Choice's ExpansionCard, so moving the cursor
+        never touches the disk.
+        """
+        preview = self.previews.get(choice.file_path)
+        if preview is None or preview.expansion_card is not choice.expansion_card:
+            preview = ChoicePreview(choice.name, choice.file_path, choice.expansion_card)
+            self.previews[choice.file_path] = preview
+        return preview
 
     def should_hide(self, choice: 'Choice') -> bool:
         """Check if a choice should be hidden based on privilege, probes, and install status."""
         privilege = choice.expansion_card.get_priviledge_level()
+        host = inventory.host_facts()
 
         # Hide OnlyRoot items if user is not root
-        if isinstance(privilege, OnlyRoot) and os.getuid() != 0:
+        if isinstance(privilege, OnlyRoot) and host.uid != 0:
             return True
 
         # AnyUserNoEscalationOnDarwin: on Linux acts like OnlyRoot;
         # on macOS, hide from root (brew refuses to run as root)
         if isinstance(privilege, AnyUserNoEscalationOnDarwin):
-            if platform.system() == "Darwin" and os.getuid() == 0:
+            if host.system == "Darwin" and host.uid == 0:
                 return True
-            if platform.system() != "Darwin" and os.getuid() != 0:
+            if host.system != "Darwin" and host.uid != 0:
                 return True
 
         # Hide items with failing probes
@@ -373,34 +395,116 @@ class curses_cli:
     def create_ansible_data_structure(self):
         # `categories` defines the possible pages available to `expand`:
         # [ ("packages", list[Choice]), ("config", list[Choice]), ... ]
+        #
+        # Every folder in ansible/ is added dynamically. The catalog index
+        # means only playbooks that changed since last time are read.
+        #
+        # Building the catalog starts a new probe round, so shared snapshots
+        # (PATH, pipx...) pick up whatever the last install batch changed.
+        inventory.new_round()
         categories = []
-
-        def get_choices_from_folder(folder) -> list[Choice]:
-            files = util.get_files(folder)
-            display = map(lambda name: Choice(name, files[name]), files)
-            return list(display)
-
-        # Add every folder in ansible/ dynamically
-        base_dir = "ansible/"
-        categories = []
-        for entry in os.scandir(base_dir):
-            if entry.is_dir() and not entry.name.startswith('.'):
-                dir_path = os.path.join(base_dir, entry.name)
-                categories.append((entry.name, get_choices_from_folder(dir_path)))
+        for category, entries in CatalogIndex().scan("ansible/"):
+            choices = [Choice(entry.name, entry.path, entry) for entry in entries]
+            categories.append((category, choices))
 
         return categories
 
     def precompute_installed_statuses(self, categories):
-        """Precompute all installed statuses in parallel using thread pool."""
+        """
+        Precompute all installed statuses in parallel, evaluating each
+        distinct probe once.
+        """
         all_choices = [choice for _, choices in categories for choice in choices]
-        with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            executor.map(lambda c: c.installed_status(), all_choices)
+        probe_evaluator.evaluate(all_choices, self.workers)
+
+    def load_installed_statuses(self, categories):
+        """
+        Show the statuses remembered from the last run right away and check
+        them again in the background, so the first frame never waits on
+        probes. Rows with nothing remembered (new playbooks, or whose last
+        check failed or timed out, or all of them on the first run) show as
+        being checked until then.
+        """
+        all_choices = [choice for _, choices in categories for choice in choices]
+        StatusCache.restore(all_choices)
+        for choice in all_choices:
+            if not choice.stale:
+                choice.mark_stale()
+
+        def revalidate():
+            try:
+                probe_evaluator.evaluate(all_choices, self.workers)
+                changed = sum(choice.finish_revalidation() for choice in all_choices)
+                logging.debug(f"Status cache: {changed} of {len(all_choices)} rows changed")
+                StatusCache.save(all_choices)
+            except:
+                logging.error(traceback.format_exc())
+
+        self.revalidation = threading.Thread(target=revalidate, daemon=True)
+        self.revalidation.start()
+
+    def is_revalidating(self) -> bool:
+        return self.revalidation is not None and self.revalidation.is_alive()
+
+    def watch_installed_statuses(self, categories):
+        """Start watching everything the probes of `categories` observe."""
+        all_choices = [choice for _, choices in categories for choice in choices]
+        self.watcher = watcher.watch(
+            resource for choice in all_choices for resource in choice.observed_resources()
+        )
+
+    def check_watched_resources(self, categories):
+        """
+        If anything watched changed (e.g. from another terminal), re-probe
+        just the rows that observe it, in the background.
+        """
+        if self.watcher is None or self.is_revalidating():
+            return
+
+        changed = self.watcher.changed()
+        if not changed:
+            return
+
+        dirty = [
+            choice for _, choices in categories for choice in choices
+            if not changed.isdisjoint(choice.observed_resources())
+        ]
+        logging.debug(f"Watcher: {len(changed)} resources changed, {len(dirty)} rows dirty")
+        if not dirty:
+            return
+
+        def refresh():
+            try:
+                probe_evaluator.refresh(dirty, self.workers)
+                StatusCache.save(dirty)
+            except:
+                logging.error(traceback.format_exc())
+
+        self.revalidation = threading.Thread(target=refresh, daemon=True)
+        self.revalidation.start()
+
+    def refresh_installed_statuses(self, categories):
+        """
+        Update installed statuses after installs, re-evaluating only the
+        probes whose observed resources changed.
+        """
+        all_choices = [choice for _, choices in categories for choice in choices]
+        if self.revalidation is not None:
+            self.revalidation.join()
+
+        # An install may have added a package manager or desktop session
+        inventory.set_host_facts(None)
+        probe_evaluator.refresh(all_choices, self.workers)
+        StatusCache.save(all_choices)
 
     def loop(self):
         categories = self.create_ansible_data_structure()
+        url_checker.log_dedup()
 
-        # Precompute all installed statuses in parallel to avoid lag when switching tabs
-        self.precompute_installed_statuses(categories)
+        # Statuses are known (or remembered) before the first frame, so
+        # switching tabs never lags
+        self.load_installed_statuses(categories)
+        self.watch_installed_statuses(categories)
 
         # Index of Current Category
         current_category = 0
@@ -410,6 +514,12 @@ class curses_cli:
         selections = self.apply_preset(categories)
 
         while True:
+            # Redraw every 100ms while statuses are being checked, so rows
+            # update as soon as they are, and look for watched changes
+            # twice a second otherwise
+            self.check_watched_resources(categories)
+            self.stdscr.timeout(100 if self.is_revalidating() else 500)
+
             current_display = categories[current_category][1]
             visible_choices = self.get_visible_choices(current_display)
             rows, cols = self.stdscr.getmaxyx()
@@ -466,8 +576,7 @@ class curses_cli:
             # 5 from offset of `Choice`, 3 for offset
             x = round(cols - (cols / 3))
             if x + 3 > Choice.get_min_width() + 5 and len(visible_choices) > 0:
-                hovered_choice = visible_choices[hover][1]
-                preview = ChoicePreview(hovered_choice.name, hovered_choice.file_path)
+                preview = self.get_preview(visible_choices[hover][1])
                 preview.draw(self.stdscr, 0, x, cols - x, rows)
 
             c = self.stdscr.getch()
@@ -559,8 +668,8 @@ class curses_cli:
                     file_path = os.path.abspath(current_display[i.selection].file_path)
                     package_name = current_display[i.selection].name
 
-                    card = ExpansionCard(file_path)
-                    priviledge = card.get_priviledge_level()
+                    card = current_display[i.selection].expansion_card
+                    priviledge = card.header.priviledge
 
                     # Check if this playbook needs a passphrase (e.g. EncryptedProbe)
                     env_extra = None
@@ -589,7 +698,7 @@ class curses_cli:
                     tmp = "root"
                     if isinstance(priviledge, AnyUserNoEscalation):
                         tmp = pwd.getpwuid(os.getuid()).pw_name
-                    elif isinstance(priviledge, AnyUserNoEscalationOnDarwin) and platform.system() == "Darwin":
+                    elif isinstance(priviledge, AnyUserNoEscalationOnDarwin) and inventory.host_facts().system == "Darwin":
                         tmp = pwd.getpwuid(os.getuid()).pw_name
 
                     panel = OutputPanel(format_install_title(counter, total, package_name))
@@ -611,6 +720,9 @@ class curses_cli:
 
                     # Clear cached status so it gets re-evaluated
                     current_display[i.selection].clear_installed_status()
+                    inventory.brew_inventory.invalidate()
+                    if "pipx" in card.content:
+                        inventory.pipx_inventory.invalidate()
 
                     # AnyUserEscalation does weird things with permissions that
                     # I will not get into here that interferes with most
@@ -625,9 +737,9 @@ class curses_cli:
                 if failed_panels:
                     self.show_error_review(failed_panels, succeeded, total)
 
-                # Rebuild data structure and resume
-                categories = self.create_ansible_data_structure()
-                self.precompute_installed_statuses(categories)
+                # Only re-evaluate probes whose files, commands or package
+                # databases were touched by the installs, then resume
+                self.refresh_installed_statuses(categories)
                 selections.clear()
 
             current_category %= len(categories)
@@ -640,6 +752,12 @@ class curses_cli:
             self.stdscr.refresh()
 
     def end(self):
+        # Don't leave a wedged status check running after we quit
+        probe_evaluator.cancel()
+        url_checker.cancel()
+        if self.watcher is not None:
+            self.watcher.close()
+
         curses.nocbreak()
         self.stdscr.keypad(False)
         curses.echo()
@@ -0,0 +1,351 @@
+"""
+Evaluates probes once per probe round.
+
+The same probes show up in many headers (`LinuxProbe()`, `CommandProbe("git")`,
+`AptProbe()`...). Since probes compare by value, every distinct probe is
+evaluated once per round and its result is shared by every Choice that uses
+it. Results are dropped when a new round starts (see `expand.inventory`).
+
+After an install, `refresh` starts a new round but keeps every result whose
+observed resources (see `CompatibilityProbe.observes`) are unchanged, so only
+probes that could have been affected are evaluated again.
+
+`evaluate` is an asyncio engine. Installed probes are evaluated cheapest
+first (see `expand.probes.by_cost`), like composites and Choices do, so a
+probe whose result can no longer matter is never evaluated. Probes answered
+from memory, stat() or small reads run inline on the event loop. The package
+inventories that run commands (brew, pipx) are only loaded if some probe
+still needs them, concurrently with `create_subprocess_exec` and at most
+`workers` commands at a time. Probes of unknown cost run in threads.
+
+Every command has a timeout (`inventory.COMMAND_TIMEOUT`) and the whole round
+a deadline. A probe that didn't finish in time raises
+`inventory.ProbeTimeout`, shown as "Timed out", until the next refresh.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, InvalidStateError
+from expand import inventory
+from expand.probes import AllProbes, AnyProbes, by_cost
+
+
+# Returned by `_peek` for a probe that hasn't been evaluated yet
+_UNKNOWN = object()
+
+# Observed resources whose snapshot is loaded by running commands
+COMMAND_SNAPSHOTS = {
+    "brew": inventory.brew_inventory,
+    "pipx": inventory.pipx_inventory,
+}
+
+
+class ProbeEvaluator:
+    """
+    Memoizes probe results for the current probe round. Safe to use from
+    many threads: a probe being evaluated by one thread is waited on, not
+    evaluated again, by the others.
+    """
+
+    # Seconds `evaluate` waits for a whole round before giving up on the
+    # probes that are still running
+    ROUND_DEADLINE = 60.0
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._round = None
+        # The round whose deadline passed; its unevaluated probes time out
+        self._expired = None
+        # (kind, probe) -> (Future, {resource: fingerprint when evaluated})
+        self._results = {}
+        # A `expand.probe_profile.ProbeProfile` while --profile-probes is on
+        self.profile = None
+
+    def _memoize(self, key: tuple, function) -> bool:
+        with self._lock:
+            if self._round != inventory.current_round():
+                self._round = inventory.current_round()
+                self._results = {}
+
+            cached = self._results.get(key)
+            owner = cached is None
+            if owner:
+                # Fingerprints are taken before evaluating, so a change that
+                # races with the probe is still seen by the next refresh.
+                probe = key[1]
+                observed = {resource: inventory.fingerprint(resource) for resource in probe.observes()}
+                cached = (Future(), observed)
+                self._results[key] = cached
+
+        future = cached[0]
+        profile = self.profile
+        if owner:
+            try:
+                if self._expired == self._round:
+                    raise inventory.ProbeTimeout(f"{key[1]!r} not evaluated before the deadline")
+                result = function() if profile is None else profile.timed(key, function)
+                future.set_result(result)
+            except InvalidStateError:
+                # Timed out by `_expire` while it was running
+                pass
+            except Exception as e:
+                future.set_exception(e)
+        elif profile is not None:
+            profile.hit(key)
+
+        return future.result()
+
+    def _expire(self):
+        """
+        Give up on the current round: probes still running and probes not
+        evaluated yet time out instead of being waited for.
+        """
+        with self._lock:
+            self._expired = self._round
+            pending = [future for future, _ in self._results.values() if not future.done()]
+        for future in pending:
+            try:
+                future.set_exception(inventory.ProbeTimeout("probe round deadline passed"))
+            except InvalidStateError:
+                pass
+
+    def cancel(self):
+        """Stop evaluating probes, e.g. because the user quit."""
+        self._expire()
+        inventory.kill_commands()
+
+    def is_compatible(self, probe) -> bool:
+        return self._memoize(("compatible", probe), probe.is_compatible)
+
+    def is_installed(self, probe) -> bool:
+        # Composites are resolved here so that their children are shared too
+        if isinstance(probe, AllProbes):
+            return all(self.is_installed(child) for child in by_cost(probe.probes))
+        if isinstance(probe, AnyProbes):
+            return any(self.is_installed(child) for child in by_cost(probe.probes))
+        return self._memoize(("installed", probe), probe.is_installed)
+
+    def revalidate(self) -> set:
+        """
+        Start a new probe round, carrying over every finished result whose
+        observed resources haven't changed. Returns the probes that were
+        dropped and will be evaluated again.
+        """
+        with self._lock:
+            results = self._results if self._round == inventory.current_round() else {}
+            inventory.new_round()
+
+            fingerprints = {}
+            kept = {}
+            stale = set()
+            for key, (future, observed) in results.items():
+                unchanged = future.done() and future.exception() is None
+                for resource, value in observed.items():
+                    if not unchanged:
+                        break
+                    if resource not in fingerprints:
+                        fingerprints[resource] = inventory.fingerprint(resource)
+                    unchanged = fingerprints[resource] == value
+
+                if unchanged:
+                    kept[key] = (future, observed)
+                else:
+                    stale.add(key[1])
+
+            self._round = inventory.current_round()
+            self._results = kept
+
+        logging.debug(f"Probe round {self._round}: kept {len(kept)} results, {len(stale)} stale")
+        return stale
+
+    def failing_probes(self, probes) -> list:
+        """Every probe in `probes` that isn't compatible."""
+        failing = []
+        for probe in probes:
+            try:
+                compatible = self.is_compatible(probe)
+            except inventory.ProbeTimeout:
+                compatible = False
+            if not compatible:
+                failing.append(probe)
+        return failing
+
+    def _peek(self, key: tuple):
+        """The memoized result for `key`, or _UNKNOWN if there isn't one yet."""
+        with self._lock:
+            cached = self._results.get(key) if self._round == inventory.current_round() else None
+        if cached is None or not cached[0].done():
+            return _UNKNOWN
+        # A probe that raised counts as decided; is_installed re-raises it
+        return cached[0].exception() is None and cached[0].result()
+
+    def _needed(self, probes, require_all: bool, needed: dict):
+        """
+        Walk `probes` cheapest first the way `all()`/`any()` would. Returns
+        the result if it's already decided, otherwise adds the next probe to
+        evaluate to `needed` and returns _UNKNOWN.
+        """
+        for probe in by_cost(probes):
+            if isinstance(probe, (AllProbes, AnyProbes)):
+                result = self._needed(probe.probes, isinstance(probe, AllProbes), needed)
+            else:
+                result = self._peek(("installed", probe))
+                if result is _UNKNOWN:
+                    needed[probe] = None
+
+            if result is _UNKNOWN:
+                return _UNKNOWN
+            if result != require_all:
+                return result
+        return require_all
+
+    def _unevaluated(self, kind: str, probes) -> list:
+        with self._lock:
+            if self._round != inventory.current_round():
+                return list(probes)
+            return [probe for probe in probes if (kind, probe) not in self._results]
+
+    async def _evaluate_async(self, tasks: list, workers: int):
+        semaphore = asyncio.Semaphore(workers)
+        observed = {resource for _, probe in tasks for resource in probe.observes()}
+
+        # Start the commands first so they run while everything else does
+        profile = self.profile
+        snapshots = {kind: snapshot for kind, snapshot in COMMAND_SNAPSHOTS.items() if (kind,) in observed}
+        loads = [
+            asyncio.create_task(
+                snapshot.get_async(semaphore) if profile is None
+                else profile.timed_load(kind, snapshot.get_async(semaphore))
+            )
+            for kind, snapshot in snapshots.items()
+        ]
+        await asyncio.sleep(0)
+
+        def run(check, probe):
+            # A timed out probe is remembered like any other result
+            try:
+                check(probe)
+            except inventory.ProbeTimeout:
+                pass
+
+        async def in_thread(check, probe):
+            async with semaphore:
+                await asyncio.to_thread(run, check, probe)
+
+        waiting = []
+        threads = []
+        for check, probe in tasks:
+            kinds = {resource[0] for resource in probe.observes()}
+            if not kinds.isdisjoint(COMMAND_SNAPSHOTS):
+                waiting.append((check, probe))
+            elif "volatile" in kinds:
+                threads.append(asyncio.create_task(in_thread(check, probe)))
+            else:
+                run(check, probe)
+
+        # The waiting probes read what was just loaded, even if brew changed
+        # meanwhile: reloading with `get()` would block the event loop. A load
+        # that timed out makes them time out too.
+        outcomes = await asyncio.gather(*loads, return_exceptions=True)
+        with inventory.pinned(dict(zip(snapshots.values(), outcomes))):
+            for check, probe in waiting:
+                run(check, probe)
+        await asyncio.gather(*threads)
+
+    async def _evaluate_round_async(self, compatibility: list, roots: list, workers: int) -> int:
+        tasks = [(self.is_compatible, probe) for probe in self._unevaluated("compatible", compatibility)]
+        evaluated = len(tasks)
+        if tasks:
+            await self._evaluate_async(tasks, workers)
+
+        # Each pass evaluates the next undecided probe of every Choice. With
+        # probes sorted by cost, this is usually one pass per cost tier.
+        while True:
+            needed = {}
+            for installed_probes in roots:
+                self._needed(installed_probes, True, needed)
+            if not needed:
+                return evaluated
+
+            evaluated += len(needed)
+            await self._evaluate_async([(self.is_installed, probe) for probe in needed], workers)
+
+    def evaluate(self, choices, workers: int = 4, deadline: float = None):
+        """
+        Evaluate every probe used by `choices`, each distinct probe once (see
+        the module docstring for how), then fill in each Choice's cached
+        compatibility and installed status from the shared results.
+
+        Probes still running after `deadline` (ROUND_DEADLINE by default)
+        seconds are cancelled and time out, as do the ones not started yet.
+        """
+        compatibility = []
+        installed = []
+        roots = []
+        if self.profile is not None:
+            self.profile.add_choices(choices)
+        for choice in choices:
+            header = choice.expansion_card.header
+            compatibility.extend(header.probes)
+            installed.extend(_leaves(header.installed_probes))
+            roots.append(header.installed_probes)
+
+        distinct = len(dict.fromkeys(compatibility)) + len(dict.fromkeys(installed))
+        commands_before = sum(inventory.command_counts.values())
+        deadline = self.ROUND_DEADLINE if deadline is None else deadline
+        try:
+            evaluated = asyncio.run(asyncio.wait_for(
+                self._evaluate_round_async(list(dict.fromkeys(compatibility)), roots, workers), deadline
+            ))
+        except asyncio.TimeoutError:
+            logging.warning(f"Probe round {inventory.current_round()} passed its {deadline:g}s deadline")
+            self._expire()
+            evaluated = "not all"
+
+        total = len(compatibility) + len(installed)
+        if distinct:
+            logging.debug(
+                f"Probe round {inventory.current_round()}: {total} probe uses, "
+                f"{distinct} distinct ({total / distinct:.1f}x dedup), {evaluated} evaluated, "
+                f"{sum(inventory.command_counts.values()) - commands_before} commands run"
+            )
+
+        for choice in choices:
+            choice.failing_probes()
+            choice.installed_status()
+
+        inventory.file_hashes.flush()
+
+    def refresh(self, choices, workers: int = 4, deadline: float = None):
+        """
+        Bring `choices` up to date after installs: only Choices using a probe
+        whose observed resources changed are re-evaluated. They keep showing
+        their old results, marked stale, until the new ones are in, so a
+        refresh in the background never makes drawing a row wait on probes.
+        """
+        self.revalidate()
+        affected = []
+        for choice in choices:
+            # Not only the probes dropped just now: one dropped by an earlier
+            # refresh of other Choices is still missing, and so is theirs.
+            header = choice.expansion_card.header
+            if self._unevaluated("compatible", header.probes) or self._needed(header.installed_probes, True, {}) is _UNKNOWN:
+                choice.mark_stale()
+                affected.append(choice)
+
+        self.evaluate(choices, workers, deadline)
+        for choice in affected:
+            choice.finish_revalidation()
+
+
+def _leaves(probes):
+    """Yield every non-composite probe in `probes`, recursively."""
+    for probe in probes:
+        if isinstance(probe, (AllProbes, AnyProbes)):
+            yield from _leaves(probe.probes)
+        else:
+            yield probe
+
+
+probe_evaluator = ProbeEvaluator()
@@ -7,9 +7,10 @@ Options:
   -h --help                Show this screen.
   -v --verbose             Write debug output to `expand.log`
   --user=<name>            Install packages for specified user [default: root]
-  --workers=<n>            Number of parallel workers for status checks [default: 4]
+  --workers=<n>            Max commands run at once for status checks [default: 4]
   --preset=<name>          Pre-select packages from a named preset (e.g. basic, all, mac)
   --export-preset=<name>   Export installed packages as a preset file to presets/<name>.json
+  --profile-probes=<file>  Time every probe and write a report to <file> as JSON, or print it with "-"
 """
 
 import os
@@ -46,10 +47,20 @@ def main():
     # Parse workers option
     workers = int(args["--workers"])
 
+    # Probe profiling: the report is written once the statuses are known, or
+    # after the TUI exits since stdout belongs to curses until then.
+    profile = None
+    if args["--profile-probes"]:
+        from expand.evaluator import probe_evaluator
+        from expand.probe_profile import ProbeProfile, write_report
+        profile = probe_evaluator.profile = ProbeProfile()
+
     # Export preset mode: scan installed packages and write a preset file, then exit.
     if args["--export-preset"]:
         from expand.presets import export_installed_preset
         export_installed_preset(args["--export-preset"], workers)
+        if profile is not None:
+            write_report(profile, args["--profile-probes"])
         sys.exit(0)
 
     # Curses is initialized first because it doesn't like changing user in this
@@ -89,3 +100,5 @@ def main():
 
     finally:
         cli.end()
+        if profile is not None:
+            write_report(profile, args["--profile-probes"])
@@ -1,5 +1,146 @@
-from expand.probes import *
-from expand.priviledge import *
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from expand.probes import CompatibilityProbe, InstalledProbe
+from expand.priviledge import PriviledgeLevel
+from expand.probe_compiler import compile_expression
+
+
+class CardHeader(NamedTuple):
+    """
+    Everything `expand` needs from the comment block at the top of an ansible
+    file. It is parsed exactly once per ExpansionCard, so reading it is free.
+
+    `description` is None when the file has no description block at all, which
+    is drawn as "N/A".
+    """
+
+    priviledge: PriviledgeLevel
+    probes: tuple
+    installed_probes: tuple
+    tags: frozenset
+    description: Optional[tuple]
+
+
+def take_header(lines) -> list[str]:
+    """
+    Take the leading block of `#` lines from an iterable of lines, stopping at
+    the first line that isn't a comment. Given an open file, only the header is
+    ever read from disk.
+    """
+    comments = []
+    for line in lines:
+        if not line.startswith("#"):
+            break
+        comments.append(line.rstrip("\n"))
+    return comments
+
+
+def parse_header(comments: list[str], file_path: str) -> CardHeader:
+    """
+    Parse the consecutive `#` lines at the top of an ansible file into a
+    CardHeader. Raises if the priviledge level or compatibility probes are
+    missing or malformed, and ValueError if a line isn't valid probe syntax
+    (see `expand.probe_compiler`).
+    """
+
+    if len(comments) < 1:
+        raise LookupError(f"Priviledge level not found in {file_path}")
+
+    priviledge = compile_expression(comments[0][1:].strip())
+    if not isinstance(priviledge, PriviledgeLevel):
+        raise RuntimeError(f"{priviledge} is not a PriviledgeLevel.")
+
+    if len(comments) < 2:
+        raise LookupError(f"Probes not found in {file_path}")
+
+    probes = compile_expression(comments[1][1:].strip())
+    if not isinstance(probes, list):
+        raise RuntimeError(f"{probes} is not a list.")
+
+    # The installed probes line is optional; anything that isn't a list is
+    # treated as no probes.
+    installed_probes = []
+    if len(comments) >= 3:
+        third_line = comments[2][1:].strip()
+        if third_line.startswith("["):
+            result = compile_expression(third_line)
+            if isinstance(result, list):
+                installed_probes = result
+
+    tags = frozenset(re.findall(r"@(\w+)", "\n".join(comments)))
+
+    # The description starts on line 4 (after privilege, probes, and
+    # installed probes). These lines are stored without # or whitespace.
+    description = None
+    if len(comments) > 2:
+        description = tuple(line.lstrip("# \t") for line in comments[3:])
+
+    return CardHeader(
+        priviledge=priviledge,
+        probes=tuple(probes),
+        installed_probes=tuple(installed_probes),
+        tags=tags,
+        description=description,
+    )
+
+
+@lru_cache(maxsize=1024)
+def wrap_description(description: tuple, max_length: int) -> tuple:
+    """
+    Word-wrap every line of `description` to at most `max_length` characters.
+    Results are cached per (description, width), so redrawing a preview at
+    the same terminal size never re-wraps it.
+    """
+
+    if max_length <= 0:
+        return ()
+
+    result = []
+    for string in description:
+        while len(string) > max_length:
+            # Split at the closest space at or before max_length, dropping
+            # the space. With no space, hard-split without dropping anything.
+            split_index = string.rfind(" ", 1, max_length + 1)
+            if split_index > 0:
+                result.append(string[:split_index])
+                string = string[split_index + 1:]
+            else:
+                result.append(string[:max_length])
+                string = string[max_length:]
+
+        result.append(string)
+
+    return tuple(result)
+
+
+# Parsed headers by (absolute path, mtime, size), so re-opening an unchanged
+# file never parses its header twice.
+_header_cache: dict[tuple, CardHeader] = {}
+_header_cache_lock = threading.Lock()
+
+
+def load_header(file_path: str, comments: list[str], stamp: tuple = None) -> CardHeader:
+    """
+    Same as `parse_header`, but cached per (path, mtime) of `file_path`.
+    `stamp` is the file's (mtime_ns, size) if the caller already knows it,
+    e.g. from the catalog index; otherwise the file is stat()ed.
+    """
+    if stamp is None:
+        stat = os.stat(file_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    key = (os.path.abspath(file_path), *stamp)
+
+    with _header_cache_lock:
+        header = _header_cache.get(key)
+    if header is None:
+        header = parse_header(comments, file_path)
+        with _header_cache_lock:
+            _header_cache[key] = header
+
+    return header
 
 
 class ExpansionCard:
@@ -17,89 +158,70 @@ class ExpansionCard:
         #
         # As long as there are consecutive # characters, you can keep extending the description as long as you want.
 
+    The header is parsed once on construction into `self.header`; every
+    accessor below just reads from it.
     """
-    
-    def __init__(self, file_path: str):
-        self.file_path = file_path
-        self.content = open(file_path, "r", encoding="UTF-8").read()
 
-        # This throws an exception if there's an error
-        self.get_probes()
+    def __init__(self, file_path: str, comments: list[str] = None, stamp: tuple = None):
+        self.file_path = file_path
 
-    def get_priviledge_level(self):
-        """
-        Get the privilege level of a expansion card by parsing the first line.
-        If first line isn't a priviledge level, raise an Exception.
-        """
-        first_line = self.content.split("\n")[0]
-        if first_line.startswith("#"):
-            # Literally run it as python code
-            first_line = first_line[1:].strip()
-            result = eval(first_line)
+        # A caller that already has the header block (e.g. from the catalog
+        # index) doesn't make us touch the file at all. With its (mtime_ns,
+        # size) `stamp` too, the parsed header is shared through the cache.
+        if comments is not None:
+            if stamp is None:
+                self.header = parse_header(list(comments), file_path)
+            else:
+                self.header = load_header(file_path, list(comments), stamp)
+            return
 
-            if not isinstance(result, PriviledgeLevel):
-                raise RuntimeError(f"{result} is not a PriviledgeLevel.")
+        # Only the header is streamed in here; the rest of the file is
+        # read by `content` if and when something needs it.
+        with open(file_path, "r", encoding="UTF-8") as file:
+            comments = take_header(file)
 
-            return result
+        # This throws an exception if there's an error
+        self.header = load_header(file_path, comments)
 
-        raise LookupError(f"Priviledge level not found in {self.file_path}")
+    @property
+    def content(self) -> str:
+        """The whole ansible file, read once on first use."""
+        if not hasattr(self, "_content"):
+            with open(self.file_path, "r", encoding="UTF-8") as file:
+                self._content = file.read()
+        return self._content
 
-    def get_probes(self):
+    def get_priviledge_level(self) -> PriviledgeLevel:
         """
-        Given an ansible file, return the list of probes by parsing the second line.
-        If the ansible file doesn't have a list, raise Exception.
+        Get the privilege level of a expansion card, parsed from the first line.
         """
+        return self.header.priviledge
 
-        second_line = self.content.split("\n")[1]
-        if second_line.startswith("#"):
-            # Literally run it as python code
-            second_line = second_line[1:].strip()
-            result = eval(second_line)
-
-            if not isinstance(result, list):
-                raise RuntimeError(f"{result} is not a list.")
-
-            return result
-
-        raise LookupError(f"Probes not found in {self.file_path}")
-
-    def get_installed_probes(self):
+    def get_probes(self) -> list[CompatibilityProbe]:
         """
-        Given an ansible file, return the list of installed probes by parsing the third line.
-        If the ansible file doesn't have a list on line 3, return an empty list.
+        Get the list of compatibility probes, parsed from the second line.
         """
+        return list(self.header.probes)
 
-        lines = self.content.split("\n")
-        if len(lines) < 3:
-            return []
-
-        third_line = lines[2]
-        if third_line.startswith("#"):
-            third_line = third_line[1:].strip()
-            # If it looks like a list, eval it
-            if third_line.startswith("["):
-                result = eval(third_line)
-                if isinstance(result, list):
-                    return result
-        return []
+    def get_installed_probes(self) -> list[InstalledProbe]:
+        """
+        Get the list of installed probes, parsed from the third line. If the
+        ansible file doesn't have a list on line 3, return an empty list.
+        """
+        return list(self.header.installed_probes)
 
     def requires_passphrase(self) -> bool:
         """Check if the header contains a @passphrase tag."""
-        for line in self.content.split("\n"):
-            if not line.startswith("#"):
-                break
-            if "@passphrase" in line:
-                return True
-        return False
+        return "passphrase" in self.header.tags
 
     def get_ansible_description(self, max_length: int) -> list[str]:
         """
-        Given the CONTENT (string form) of a ansible file specifically made for
-        `expand`, extract its description. This is defined as all the consecutive
-        comments after the probe comment.
+        Get the description of this ansible file, defined as all the
+        consecutive comments after the installed probes comment.
 
-        E.x. 
+        E.x.
         # [probe1(), probe2(), ...]
+        # [installed1(), ...]
         # This is the first line.
         # This is the second line.
 
@@ -113,47 +235,7 @@ class ExpansionCard:
         If the file does not contain any description, return "N/A"
         """
 
-        lines = self.content.split("\n")
-        comments = []
-        for line in lines:
-            if line.startswith("#"):
-                comments.append(line)
-            else:
-                break
-        
-        if len(comments) <= 2:
+        if self.header.description is None:
             return ["N/A"]
 
-        # This starts on Line 4 (after privilege, probes, and installed probes)
-        # These lines are all descriptions without # or whitespace
-        comments = list(map(lambda a: a.lstrip("# \t"), comments[3:]))
-
-        if max_length <= 0:
-            return []
-
-        def split_sentence(sentence, index):
-            # Find the closest space before the index to split the sentence
-            split_index = index
-            while split_index > 0 and sentence[split_index] != ' ':
-                split_index -= 1
-
-            # If a space was found, split there (dropping the space)
-            if split_index > 0:
-                return [sentence[:split_index], sentence[split_index+1:]]
-
-            # No space found — hard-split at the index without dropping a character
-            return [sentence[:index], sentence[index:]]
-
-
-        result = []
-        for string in comments:
-            while len(string) > max_length:
-                split = split_sentence(string, max_length)
-                result.append(split[0])
-                string = split[1]
-
-            result.append(string)
-
-        return result
-
-
+        return list(wrap_description(self.header.description, max_length))
@@ -1,24 +1,23 @@
-import os
 import curses
-import threading
-from expand import util
-from expand.probes import CompatibilityProbe
+from expand import util, inventory
+from expand.probes import CompatibilityProbe, by_cost
+from expand.evaluator import probe_evaluator
+from expand.url_checker import url_checker
 from expand.failure_cache import FailureCache
 from expand.colors import expand_color_palette
 from expand.expansion_card import ExpansionCard
 from expand.line_buffer import LineBuffer
 from expand.priviledge import OnlyRoot, AnyUserEscalation, AnyUserNoEscalation, AnyUserNoEscalationOnDarwin
-import platform
 
 class ChoicePreview:
     """
     Shows a box that displays the description of a ansible file.
     """
 
-    def __init__(self, name, file_path):
+    def __init__(self, name, file_path, expansion_card=None):
         self.name = name
         self.file_path = file_path
-        self.expansion_card = ExpansionCard(file_path)
+        self.expansion_card = expansion_card or ExpansionCard(file_path)
 
     def draw(self, stdscr, y, x, width, height):
         # Draw divider on left edge 
@@ -56,18 +55,25 @@ class Choice:
         ("compatibility", 35)
     ]
 
-    def __init__(self, name, file_path):
+    def __init__(self, name, file_path, entry=None):
+        """
+        `entry` is an optional CatalogEntry for this file; when given, the
+        header and URLs come from it and the file isn't read.
+        """
         self.name = name
         self.file_path = file_path
-        self.expansion_card = ExpansionCard(file_path)
+        if entry is not None:
+            self.expansion_card = ExpansionCard(file_path, entry.comments, entry.stamp)
+            self._urls = set(entry.urls)
+        else:
+            self.expansion_card = ExpansionCard(file_path)
         self.chosen = False
         self.hover = False
+        # Showing results remembered from the last run (see StatusCache)
+        self.stale = False
 
         # Load cache
-        self.has_urls()
-        self.failing_probes()
-        self.failing_urls_task = threading.Thread(target=self.failing_urls)
-        self.failing_urls_task.start()
+        self.failing_urls_task = url_checker.submit(self.get_urls())
 
     @staticmethod
     def get_min_width() -> int:
@@ -75,72 +81,125 @@ class Choice:
         return sum(filter(lambda w: w > -1, widths))
 
 
-    def has_urls(self) -> bool:
+    def get_urls(self) -> set[str]:
         """
-        Does this ansible file have any URL's in it?
+        Every URL in this ansible file.
         """
-        if hasattr(self, "_has_urls"):
-            return self._has_urls
+        if not hasattr(self, "_urls"):
+            self._urls = util.filter_str_for_urls(self.expansion_card.content)
 
-        with open(self.file_path, "r", encoding="UTF-8") as file:
-            links = util.filter_str_for_urls(file.read())
-            self._has_urls = len(links) > 0
+        return self._urls
 
-        return self._has_urls
+    def has_urls(self) -> bool:
+        """
+        Does this ansible file have any URL's in it?
+        """
+        return len(self.get_urls()) > 0
 
     def failing_urls(self) -> list[str]:
         """
         If there are urls in this ansible file, get a list of URLs that aren't
-        working. If no files exist, return [].
+        working. If no files exist, return []. Waits for the URL check
+        queued on construction.
         """
-        if hasattr(self, "_broken_urls"):
-            return self._broken_urls
+        return self.failing_urls_task.result()
 
-        self._broken_urls = []
+    # Installed status of a row whose results are still being checked in
+    # the background (see `mark_stale`)
+    CHECKING = "Checking…"
 
-        with open(self.file_path, "r", encoding="UTF-8") as file:
-            links = util.filter_str_for_urls(file.read())
-            for link in links:
-                if not util.is_url_up(link):
-                    self._broken_urls.append(link)
-
-        return self._broken_urls
+    # Results are read into a local once and never deleted: a background
+    # thread may swap in fresh ones while the UI thread is drawing.
 
     def failing_probes(self) -> list[CompatibilityProbe]:
-        if hasattr(self, "_failing_probes"):
-            return self._failing_probes
-
-        self.probes = self.expansion_card.get_probes()
-        self._failing_probes = util.get_failing_probes(self.probes)
+        failing = getattr(self, "_failing_probes", None)
+        if failing is None:
+            failing = self._failing_probes = util.get_failing_probes(self.expansion_card.header.probes)
 
-        return self._failing_probes
+        return failing
 
     def installed_status(self) -> str:
-        if hasattr(self, "_installed_status"):
-            return self._installed_status
+        status = getattr(self, "_installed_status", None)
+        if status is None:
+            status = self._installed_status = self._check_installed_status()
+
+        return status
 
+    def _check_installed_status(self) -> str:
         # First check failure cache - if failed, return "Failure"
         if FailureCache.has_failed(self.name):
-            self._installed_status = "Failure"
-            return self._installed_status
+            return "Failure"
 
         # Then run installed probes
-        installed_probes = self.expansion_card.get_installed_probes()
+        installed_probes = self.expansion_card.header.installed_probes
         if len(installed_probes) == 0:
             # No probes defined, status is unknown
-            self._installed_status = "Unknown"
-        elif all(probe.is_installed() for probe in installed_probes):
-            self._installed_status = "Installed"
-        else:
-            self._installed_status = "Not Installed"
+            return "Unknown"
 
-        return self._installed_status
+        try:
+            installed = all(probe_evaluator.is_installed(probe) for probe in by_cost(installed_probes))
+            return "Installed" if installed else "Not Installed"
+        except inventory.ProbeTimeout:
+            return "Timed out"
 
     def clear_installed_status(self):
         """Clear cached installed status to force re-evaluation."""
-        if hasattr(self, "_installed_status"):
-            delattr(self, "_installed_status")
+        self._installed_status = None
+
+    def clear_probe_results(self):
+        """Clear cached installed status and compatibility to force re-evaluation."""
+        self._installed_status = None
+        self._failing_probes = None
+        self._row_key = None
+
+    def observed_resources(self) -> frozenset:
+        """Everything this row's probes observe (see `CompatibilityProbe.observes`)."""
+        if not hasattr(self, "_observed_resources"):
+            header = self.expansion_card.header
+            self._observed_resources = frozenset(
+                resource for probe in header.probes + header.installed_probes for resource in probe.observes()
+            )
+        return self._observed_resources
+
+    def mark_stale(self):
+        """
+        Keep showing the current results, dimmed, while they are checked
+        again in the background, until `finish_revalidation` replaces them.
+        A row without results yet shows CHECKING and no failing probes, so
+        drawing it never runs a probe and it isn't hidden in the meantime.
+        """
+        if getattr(self, "_failing_probes", None) is None:
+            self._failing_probes = []
+        if getattr(self, "_installed_status", None) is None:
+            self._installed_status = Choice.CHECKING
+        self.stale = True
+        self._row_key = None
+
+    def restore_probe_results(self, installed_status, failing_probes):
+        """
+        Show results remembered from a previous run until
+        `finish_revalidation` replaces them. `installed_status` may be None
+        if it wasn't remembered.
+        """
+        self._failing_probes = failing_probes
+        if installed_status is not None and not FailureCache.has_failed(self.name):
+            self._installed_status = installed_status
+        self.mark_stale()
 
+    def finish_revalidation(self) -> bool:
+        """
+        Replace stale results with freshly evaluated ones. Returns True if
+        what the row shows changed.
+        """
+        if not self.stale:
+            return False
+
+        fresh = (self._check_installed_status(), util.get_failing_probes(self.expansion_card.header.probes))
+        old = (self._installed_status, self._failing_probes)
+        self._installed_status, self._failing_probes = fresh
+        self.stale = False
+        self._row_key = None
+        return fresh != old
 
     def set_chosen(self, chosen: bool):
         self.chosen = chosen
@@ -148,61 +207,98 @@ class Choice:
     def set_hover(self, hover: bool):
         self.hover = hover
 
-    def draw(self, stdscr, y, x, width):
-        data = {}
-
-        data["select"] = ("■ " if self.chosen else "☐ "), "NORMAL"
-            
-        data["name"] = self.name, "NORMAL"
-
-        # Add URL Indictor
+    def get_url_cell(self) -> tuple[str, str]:
+        """
+        Text and color of the URL column.
+        """
         if not self.has_urls():
-            data["URL"] = "", "NORMAL"
-        elif self.failing_urls_task.is_alive():
-            data["URL"] = "-", "YELLOW"
+            return "", "NORMAL"
+        elif not self.failing_urls_task.done():
+            return "-", "YELLOW"
         elif len(self.failing_urls()) != 0:
-            data["URL"] = "✘", "RED"
+            return "✘", "RED"
         else:
-            data["URL"] = "✔", "GREEN"
+            return "✔", "GREEN"
 
+    def get_installed_cell(self) -> tuple[str, str]:
+        """
+        Text and color of the installed column.
+        """
         # If package was able to be installed or not
         status = self.installed_status()
         if status == "Failure":
-            data["installed"] = status, "RED"
+            return status, "RED"
         elif status == "Installed":
-            data["installed"] = status, "GREEN"
+            return status, "GREEN"
         elif status == "Unknown":
-            data["installed"] = status, "NORMAL"
+            return status, "NORMAL"
+        elif status == "Timed out":
+            return status, "MAGENTA"
+        elif status == Choice.CHECKING:
+            return status, "NORMAL"
         else:
-            data["installed"] = status, "YELLOW"
+            return status, "YELLOW"
+
+    def get_priviledge_cell(self) -> tuple[str, str]:
+        """
+        Text and color of the priviledge column. This only depends on who is
+        running `expand`, so it is computed once.
+        """
+        if hasattr(self, "_priviledge_cell"):
+            return self._priviledge_cell
 
-        level = self.expansion_card.get_priviledge_level()
+        level = self.expansion_card.header.priviledge
+        host = inventory.host_facts()
         if isinstance(level, OnlyRoot):
-            if os.getuid() != 0:
-                data["priviledge"] = "OnlyRoot", "RED"
+            if host.uid != 0:
+                cell = "OnlyRoot", "RED"
             else:
-                data["priviledge"] = "OnlyRoot", "GREEN"
+                cell = "OnlyRoot", "GREEN"
         elif isinstance(level, AnyUserNoEscalation):
-            data["priviledge"] = "AnyUserNoEscalation", "GREEN"
+            cell = "AnyUserNoEscalation", "GREEN"
         elif isinstance(level, AnyUserEscalation):
-            if os.geteuid() != 0:
-                data["priviledge"] = "AnyUserEscalation", "RED"
+            if host.euid != 0:
+                cell = "AnyUserEscalation", "RED"
             else:
-                data["priviledge"] = "AnyUserEscalation", "YELLOW"
+                cell = "AnyUserEscalation", "YELLOW"
         elif isinstance(level, AnyUserNoEscalationOnDarwin):
-            if platform.system() == "Darwin":
-                if os.getuid() == 0:
-                    data["priviledge"] = "AnyUserNoEscalation", "RED"
+            if host.system == "Darwin":
+                if host.uid == 0:
+                    cell = "AnyUserNoEscalation", "RED"
                 else:
-                    data["priviledge"] = "AnyUserNoEscalation", "GREEN"
+                    cell = "AnyUserNoEscalation", "GREEN"
             else:
-                if os.getuid() != 0:
-                    data["priviledge"] = "OnlyRoot", "RED"
+                if host.uid != 0:
+                    cell = "OnlyRoot", "RED"
                 else:
-                    data["priviledge"] = "OnlyRoot", "GREEN"
+                    cell = "OnlyRoot", "GREEN"
         else:
             raise Exception(f"Unknown Priviledge: {level}")
 
+        self._priviledge_cell = cell
+        return cell
+
+    def render(self, width) -> list[tuple[str, int, int]]:
+        """
+        Lay out this row as a list of (text, x offset, curses attributes).
+
+        The layout is cached and only rebuilt when something it depends on
+        changes: installed status, URL check state, staleness, hover/chosen
+        or width.
+        """
+        url_cell = self.get_url_cell()
+        installed_cell = self.get_installed_cell()
+        key = (installed_cell, url_cell, self.stale, self.chosen, self.hover, width)
+        if getattr(self, "_row_key", None) == key:
+            return self._row
+
+        data = {}
+        data["select"] = ("■ " if self.chosen else "☐ "), "NORMAL"
+        data["name"] = self.name, "NORMAL"
+        data["URL"] = url_cell
+        data["installed"] = installed_cell
+        data["priviledge"] = self.get_priviledge_cell()
+
         # Add Message of Any Failing Probes
         data["compatibility"] = "", "GREEN"
         if len(self.failing_probes()) > 0:
@@ -213,6 +309,7 @@ class Choice:
         widths = map(lambda c: c[1], Choice.ORDER)
         columns = util.get_formatted_columns(columns, width, list(widths))
 
+        row = []
         for i, c in enumerate(columns):
             column_name = Choice.ORDER[i][0]
             column_color = data[column_name][1]
@@ -220,9 +317,19 @@ class Choice:
 
             if self.hover:
                 attrs |= curses.A_REVERSE
+            if self.stale and column_name in ("installed", "compatibility"):
+                attrs |= curses.A_DIM
+
+            row.append((c[0], c[1], attrs))
 
+        self._row_key = key
+        self._row = row
+        return row
+
+    def draw(self, stdscr, y, x, width):
+        for text, offset, attrs in self.render(width):
             try:
-                stdscr.addstr(y, x + c[1], c[0], attrs)
+                stdscr.addstr(y, x + offset, text, attrs)
             except curses.error:
                 pass
 
@@ -0,0 +1,897 @@
+"""
+Process-wide snapshots of system state that probes answer from.
+
+Many probes ask the same expensive question (is this apt package installed?)
+with different arguments. Instead of forking once per probe, each kind of
+state is read once into memory and shared, and re-read only when its
+fingerprint changes or it is explicitly invalidated (e.g. after an install).
+"""
+
+import os
+import glob
+import atexit
+import asyncio
+import json
+import mmap
+import codecs
+import shutil
+import signal
+import fnmatch
+import hashlib
+import platform
+import threading
+import subprocess
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+
+# A probe round is one pass of evaluating probes over the catalog (startup,
+# after an install batch, --export-preset). Snapshots without a cheap
+# fingerprint use it to be loaded at most once per round.
+_round = 0
+
+
+def new_round():
+    """Start a new probe round."""
+    global _round
+    _round += 1
+
+
+def current_round() -> int:
+    return _round
+
+
+# How many commands snapshots have run, by program name. Probes exist to
+# avoid forking, so this is what the probe engine reports and tests check.
+command_counts = Counter()
+_command_counts_lock = threading.Lock()
+
+
+def _count_command(args: list[str]):
+    with _command_counts_lock:
+        command_counts[args[0]] += 1
+
+
+# How often each snapshot was served from memory ("hits") or (re)loaded
+# ("loads"), by (snapshot class name, outcome). Reported by --profile-probes.
+snapshot_counts = Counter()
+
+
+# Seconds a single command may run before it is killed. A wedged `brew` or a
+# locked pipx venv then costs a "Timed out" row instead of a frozen TUI.
+COMMAND_TIMEOUT = 20.0
+
+
+class ProbeTimeout(Exception):
+    """A command a probe depends on, or the whole probe round, ran out of time."""
+    pass
+
+
+# Commands the probe engine is running, so `kill_commands()` can stop them on quit
+_running = set()
+_running_lock = threading.Lock()
+
+
+def _kill(process):
+    # Commands run in their own session, so anything they spawned (and that
+    # still holds their stdout open) is killed with them.
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def kill_commands():
+    """Kill every command started by `run_command` or `run_command_async` that is still running."""
+    with _running_lock:
+        running = list(_running)
+    for process in running:
+        _kill(process)
+
+
+def run_command(args: list[str], timeout: float = None) -> Optional[str]:
+    """
+    Run a command and return its stdout, or None if it couldn't be run or
+    exited with an error. Raises ProbeTimeout if it runs for longer than
+    `timeout` (COMMAND_TIMEOUT by default) seconds. A command that times out,
+    or is stopped by `kill_commands()`, is killed with anything it started.
+    """
+    timeout = COMMAND_TIMEOUT if timeout is None else timeout
+    _count_command(args)
+    try:
+        process = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            start_new_session=True,
+        )
+    except OSError:
+        return None
+
+    with _running_lock:
+        _running.add(process)
+    try:
+        stdout, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(process)
+        process.communicate()
+        raise ProbeTimeout(f"{' '.join(args)} timed out after {timeout:g}s")
+    except BaseException:
+        _kill(process)
+        process.wait()
+        raise
+    finally:
+        with _running_lock:
+            _running.discard(process)
+
+    return stdout if process.returncode == 0 else None
+
+
+async def run_command_async(args: list[str], semaphore: asyncio.Semaphore, timeout: float = None) -> Optional[str]:
+    """
+    Same as `run_command`, without blocking the event loop. At most as many
+    commands as `semaphore` allows run at once. Cancelling it, or
+    `kill_commands()`, kills the command and anything it started.
+    """
+    timeout = COMMAND_TIMEOUT if timeout is None else timeout
+    async with semaphore:
+        _count_command(args)
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError:
+            return None
+
+        with _running_lock:
+            _running.add(process)
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            _kill(process)
+            await process.communicate()
+            raise ProbeTimeout(f"{' '.join(args)} timed out after {timeout:g}s")
+        except asyncio.CancelledError:
+            # Reap it before the event loop goes away
+            _kill(process)
+            await process.communicate()
+            raise
+        finally:
+            with _running_lock:
+                _running.discard(process)
+
+    if process.returncode != 0:
+        return None
+    return stdout.decode("UTF-8", errors="replace")
+
+
+# Snapshot -> what `get()` returns (or raises) on this thread, see `pinned`
+_pinned = threading.local()
+
+
+@contextmanager
+def pinned(outcomes: dict):
+    """
+    Within the block, `get()` on this thread returns what was just loaded for
+    each snapshot in `outcomes` (raising it, if it's an exception) instead of
+    checking the stamp again, so it never runs commands itself.
+    """
+    previous = getattr(_pinned, "outcomes", {})
+    _pinned.outcomes = {**previous, **outcomes}
+    try:
+        yield
+    finally:
+        _pinned.outcomes = previous
+
+
+class Snapshot(ABC):
+    """
+    A lazily loaded, thread-safe copy of some piece of system state.
+
+    `get()` returns the cached data, reloading it first if `stamp()` (a cheap
+    fingerprint such as an mtime) changed since the last load. Snapshots that
+    run commands to load also implement `load_async()`, so the probe engine
+    can refresh them with `get_async()` without blocking.
+
+    A load that times out raises ProbeTimeout, and keeps raising it for the
+    rest of the probe round instead of running the command again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data = None
+        self._stamp = None
+        # (round, stamp, ProbeTimeout) of the last load that timed out
+        self._timeout = None
+
+    @abstractmethod
+    def stamp(self):
+        """Return a cheap fingerprint of the underlying state."""
+        pass
+
+    @abstractmethod
+    def load(self):
+        """Read the underlying state. Only called when the stamp changes."""
+        pass
+
+    def _check_timeout(self, stamp):
+        if self._timeout is not None and self._timeout[:2] == (_round, stamp):
+            raise self._timeout[2]
+
+    def get(self):
+        outcomes = getattr(_pinned, "outcomes", {})
+        if self in outcomes:
+            if isinstance(outcomes[self], BaseException):
+                raise outcomes[self]
+            with self._lock:
+                snapshot_counts[type(self).__name__, "hits"] += 1
+            return outcomes[self]
+
+        with self._lock:
+            stamp = self.stamp()
+            if self._data is None or stamp != self._stamp:
+                self._check_timeout(stamp)
+                snapshot_counts[type(self).__name__, "loads"] += 1
+                try:
+                    self._data = self.load()
+                except ProbeTimeout as e:
+                    self._timeout = (_round, stamp, e)
+                    raise
+                self._stamp = stamp
+            else:
+                snapshot_counts[type(self).__name__, "hits"] += 1
+            return self._data
+
+    async def load_async(self, semaphore: asyncio.Semaphore):
+        """Same as `load()`; override if loading runs commands."""
+        return self.load()
+
+    async def get_async(self, semaphore: asyncio.Semaphore):
+        """Same as `get()`, loading with `load_async()`."""
+        with self._lock:
+            stamp = self.stamp()
+            if self._data is not None and stamp == self._stamp:
+                snapshot_counts[type(self).__name__, "hits"] += 1
+                return self._data
+            self._check_timeout(stamp)
+            snapshot_counts[type(self).__name__, "loads"] += 1
+
+        try:
+            data = await self.load_async(semaphore)
+        except ProbeTimeout as e:
+            with self._lock:
+                self._timeout = (_round, stamp, e)
+            raise
+        with self._lock:
+            self._data = data
+            self._stamp = stamp
+        return data
+
+    def invalidate(self):
+        """Force a reload on the next `get()`."""
+        with self._lock:
+            self._data = None
+            self._timeout = None
+
+
+class DpkgStatus(Snapshot):
+    """
+    Every package in the dpkg database and its status, parsed from
+    /var/lib/dpkg/status. Only the Package and Status fields are kept, and
+    the file is re-read only when its mtime or size changes.
+    """
+
+    STATUS_FILE = "/var/lib/dpkg/status"
+
+    def stamp(self):
+        try:
+            stat = os.stat(DpkgStatus.STATUS_FILE)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self) -> dict[str, str]:
+        packages = {}
+        package = None
+
+        try:
+            with open(DpkgStatus.STATUS_FILE, "r", encoding="UTF-8", errors="replace") as file:
+                for line in file:
+                    if line.startswith("Package: "):
+                        package = line[9:].strip()
+                    elif line.startswith("Status: ") and package is not None:
+                        status = line[8:].strip()
+                        # Multi-arch packages appear once per architecture;
+                        # an installed one wins.
+                        if packages.get(package, "").endswith(" installed"):
+                            continue
+                        packages[package] = status
+                    elif line == "\n":
+                        package = None
+        except OSError:
+            pass
+
+        return packages
+
+    def is_installed(self, package: str) -> bool:
+        """
+        Is `package` (optionally suffixed with `:arch`) installed?
+        """
+        package = package.split(":")[0]
+        return self.get().get(package, "").endswith(" installed")
+
+
+dpkg_status = DpkgStatus()
+
+
+class BrewInventory(Snapshot):
+    """
+    Every installed Homebrew formula and cask, from a single `brew list` of
+    each kind. Homebrew is slow to start, so this is only reloaded when one of
+    Homebrew's Cellar or Caskroom directories changes, or after `invalidate()`.
+    """
+
+    PREFIXES = ["/opt/homebrew", "/usr/local", "/home/linuxbrew/.linuxbrew"]
+
+    def stamp(self):
+        stamps = []
+        for prefix in BrewInventory.PREFIXES:
+            for name in ("Cellar", "Caskroom"):
+                try:
+                    stamps.append(os.stat(os.path.join(prefix, name)).st_mtime_ns)
+                except OSError:
+                    stamps.append(None)
+        return tuple(stamps)
+
+    COMMANDS = [["brew", "list", "--formula", "-1"], ["brew", "list", "--cask", "-1"]]
+
+    def _parse(self, outputs) -> frozenset[str]:
+        installed = set()
+        for output in outputs:
+            # None if brew isn't installed or failed
+            if output is not None:
+                installed.update(line.strip() for line in output.splitlines() if line.strip())
+        return frozenset(installed)
+
+    def load(self) -> frozenset[str]:
+        return self._parse(run_command(command) for command in BrewInventory.COMMANDS)
+
+    async def load_async(self, semaphore: asyncio.Semaphore) -> frozenset[str]:
+        outputs = await asyncio.gather(
+            *(run_command_async(command, semaphore) for command in BrewInventory.COMMANDS)
+        )
+        return self._parse(outputs)
+
+    def is_installed(self, package: str) -> bool:
+        """
+        Is the formula or cask `package` (optionally tap-qualified) installed?
+        """
+        return package.split("/")[-1] in self.get()
+
+
+brew_inventory = BrewInventory()
+
+
+class PipxInventory(Snapshot):
+    """
+    Every package installed with pipx.
+
+    If pipx's venvs directory can be found, it is listed directly (each venv
+    is named after its package) and re-listed when its mtime changes.
+    Otherwise `pipx list --short` is run, at most once per probe round.
+    """
+
+    def get_venvs_dir(self):
+        """Return pipx's venvs directory, or None if it can't be found."""
+        candidates = [
+            os.environ.get("PIPX_HOME"),
+            "~/.local/pipx",
+            "~/.local/share/pipx",
+            "~/Library/Application Support/pipx",
+        ]
+        for candidate in candidates:
+            if candidate:
+                venvs = os.path.join(os.path.expanduser(candidate), "venvs")
+                if os.path.isdir(venvs):
+                    return venvs
+        return None
+
+    def stamp(self):
+        venvs = self.get_venvs_dir()
+        if venvs is None:
+            return ("round", current_round())
+        return (venvs, os.stat(venvs).st_mtime_ns)
+
+    COMMAND = ["pipx", "list", "--short"]
+
+    def _parse(self, output: Optional[str]) -> frozenset[str]:
+        if output is None:
+            return frozenset()
+
+        # pipx list --short outputs "package version" per line
+        installed = set()
+        for line in output.splitlines():
+            parts = line.split()
+            if parts:
+                installed.add(parts[0])
+        return frozenset(installed)
+
+    def load(self) -> frozenset[str]:
+        venvs = self.get_venvs_dir()
+        if venvs is not None:
+            return frozenset(os.listdir(venvs))
+        return self._parse(run_command(PipxInventory.COMMAND))
+
+    async def load_async(self, semaphore: asyncio.Semaphore) -> frozenset[str]:
+        if self.get_venvs_dir() is not None:
+            return self.load()
+        return self._parse(await run_command_async(PipxInventory.COMMAND, semaphore))
+
+    def is_installed(self, package: str) -> bool:
+        return package in self.get()
+
+
+pipx_inventory = PipxInventory()
+
+
+class PathIndex:
+    """
+    Where every command in PATH lives, so looking a command up is a dict
+    access instead of probing every PATH directory (or forking `which`).
+
+    Each directory is listed once and re-listed only when its mtime changes.
+    Mtimes are re-checked once per probe round, or when PATH itself changes.
+    Executable bits are checked on first lookup of a name and remembered.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # directory -> (mtime_ns, {name: is_executable or None if unchecked})
+        self._dirs = {}
+        self._path = None
+        self._round = None
+
+    def _list_dir(self, directory: str) -> dict:
+        try:
+            return dict.fromkeys(entry.name for entry in os.scandir(directory))
+        except OSError:
+            return {}
+
+    def _refresh(self) -> list[str]:
+        path = os.environ.get("PATH", os.defpath)
+        directories = [d for d in path.split(os.pathsep) if d]
+        if path == self._path and self._round == current_round():
+            return directories
+
+        for directory in dict.fromkeys(directories):
+            cached = self._dirs.get(directory)
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = None
+            if cached is None or cached[0] != mtime:
+                self._dirs[directory] = (mtime, self._list_dir(directory) if mtime is not None else {})
+
+        self._path = path
+        self._round = current_round()
+        return directories
+
+    def which(self, command: str) -> Optional[str]:
+        """
+        Same as `shutil.which(command)`, answered from the index.
+        """
+        if os.path.dirname(command):
+            return shutil.which(command)
+
+        with self._lock:
+            for directory in self._refresh():
+                names = self._dirs[directory][1]
+                if command not in names:
+                    continue
+
+                full_path = os.path.join(directory, command)
+                if names[command] is None:
+                    names[command] = os.access(full_path, os.X_OK) and not os.path.isdir(full_path)
+                if names[command]:
+                    return full_path
+
+        return None
+
+
+path_index = PathIndex()
+
+
+class FileHashes:
+    """
+    SHA-256 digests of files, keyed by (device, inode, size, mtime_ns), so a
+    file that hasn't changed is never read again, in this run or the next.
+
+    The cache file (file_hashes.json) maps "device:inode:size:mtime_ns" to a
+    hex digest. It is loaded on first use; new digests are only kept in
+    memory until `flush()`, which the probe evaluator calls once per probe
+    round (and which also runs at exit). At most MAX_ENTRIES are kept,
+    oldest dropped first.
+    """
+
+    CACHE_FILE = "file_hashes.json"
+    MAX_ENTRIES = 4096
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._hashes = None
+        # Digests were added since the cache file was last written
+        self._dirty = False
+
+    @staticmethod
+    def key(stat: os.stat_result) -> str:
+        return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _load(self) -> dict[str, str]:
+        if self._hashes is None:
+            try:
+                with open(FileHashes.CACHE_FILE, "r", encoding="UTF-8") as file:
+                    data = json.load(file)
+                self._hashes = data if isinstance(data, dict) else {}
+            except (OSError, ValueError):
+                self._hashes = {}
+        return self._hashes
+
+    def _save(self, hashes: dict[str, str]):
+        try:
+            temp_file = f"{FileHashes.CACHE_FILE}.tmp"
+            with open(temp_file, "w", encoding="UTF-8") as file:
+                json.dump(hashes, file)
+            os.replace(temp_file, FileHashes.CACHE_FILE)
+        except OSError:
+            pass
+
+    def lookup(self, stat: os.stat_result) -> Optional[str]:
+        """Return the cached digest of the file with this stat, if any."""
+        with self._lock:
+            return self._load().get(FileHashes.key(stat))
+
+    def record(self, *pairs: tuple):
+        """Remember (stat, digest) pairs; `flush()` persists them."""
+        with self._lock:
+            hashes = self._load()
+            for stat, digest in pairs:
+                hashes[FileHashes.key(stat)] = digest
+            self._dirty = True
+
+    def flush(self):
+        """Write the cache file if digests were added since it was last written."""
+        with self._lock:
+            if not self._dirty:
+                return
+            hashes = self._hashes
+            while len(hashes) > FileHashes.MAX_ENTRIES:
+                del hashes[next(iter(hashes))]
+            hashes = dict(hashes)
+            self._dirty = False
+        # Written outside the lock, so probes aren't held up by the disk
+        self._save(hashes)
+
+    def clear(self):
+        """Forget the in-memory copy; the cache file is re-read on next use."""
+        with self._lock:
+            self._hashes = None
+            self._dirty = False
+
+    def files_match(self, path_a: str, path_b: str) -> bool:
+        """
+        Do the regular files `path_a` and `path_b` have identical contents?
+
+        Different sizes never match. If both digests are cached they are
+        compared without opening either file. Otherwise both files are read in
+        lockstep, CHUNK_SIZE bytes at a time, stopping at the first differing
+        chunk; if they match, both digests are cached.
+        """
+        stat_a = os.stat(path_a)
+        stat_b = os.stat(path_b)
+        if stat_a.st_size != stat_b.st_size:
+            return False
+
+        digest_a = self.lookup(stat_a)
+        digest_b = self.lookup(stat_b)
+        if digest_a is not None and digest_b is not None:
+            return digest_a == digest_b
+
+        sha256 = hashlib.sha256()
+        with open(path_a, "rb") as file_a, open(path_b, "rb") as file_b:
+            while True:
+                chunk_a = file_a.read(FileHashes.CHUNK_SIZE)
+                chunk_b = file_b.read(FileHashes.CHUNK_SIZE)
+                if chunk_a != chunk_b:
+                    return False
+                if not chunk_a:
+                    break
+                sha256.update(chunk_a)
+
+        digest = sha256.hexdigest()
+        self.record((stat_a, digest), (stat_b, digest))
+        return True
+
+
+file_hashes = FileHashes()
+atexit.register(file_hashes.flush)
+
+
+class GrepIndex:
+    """
+    Which GrepProbe patterns occur in which files.
+
+    Every GrepProbe registers its (path, pattern) on construction. The first
+    lookup of a file maps it once and answers every pattern registered for
+    it in that one pass; later lookups are dict accesses until the file's
+    (mtime, size, inode) changes.
+
+    Like `str in str`, a file that isn't valid UTF-8 contains no patterns.
+    That is only checked for files with a match, CHUNK_SIZE bytes at a time.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._patterns = {}
+        # path -> (stamp, {pattern: found})
+        self._files = {}
+
+    def register(self, path: str, pattern: str):
+        with self._lock:
+            self._patterns.setdefault(path, set()).add(pattern)
+
+    @staticmethod
+    def _is_utf8(data) -> bool:
+        # Decoded in chunks, so a mapped file is never copied whole
+        decoder = codecs.getincrementaldecoder("UTF-8")()
+        with memoryview(data) as view:
+            try:
+                for offset in range(0, len(view), GrepIndex.CHUNK_SIZE):
+                    decoder.decode(view[offset:offset + GrepIndex.CHUNK_SIZE])
+                decoder.decode(b"", final=True)
+            except UnicodeDecodeError:
+                return False
+        return True
+
+    def _scan(self, path: str, patterns) -> dict[str, bool]:
+        with open(path, "rb") as file:
+            try:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # Empty files can't be mapped, and files in /proc report a
+                # size of 0; just read those.
+                data = file.read()
+
+            try:
+                results = {pattern: data.find(pattern.encode("UTF-8")) != -1 for pattern in patterns}
+                if any(results.values()) and not GrepIndex._is_utf8(data):
+                    results = dict.fromkeys(results, False)
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+
+        return results
+
+    def contains(self, path: str, pattern: str) -> bool:
+        """Does the file at `path` contain `pattern`?"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, {})
+                self._files[path] = cached
+
+            results = cached[1]
+            if pattern not in results:
+                pending = (self._patterns.get(path, set()) | {pattern}) - results.keys()
+                try:
+                    results.update(self._scan(path, pending))
+                except OSError:
+                    return False
+
+            return results[pattern]
+
+
+grep_index = GrepIndex()
+
+
+class DirectoryListings:
+    """
+    Directory entries for resolving FileProbe globs without re-listing the
+    same directory (~/.local/bin, /Applications...) for every probe.
+
+    A directory is listed once and re-listed only if its mtime changed;
+    mtimes are re-checked once per probe round. Globs follow `glob.glob`'s
+    rules (hidden files only match patterns starting with "."), and paths
+    without wildcards are a single lstat().
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # directory -> (round, mtime_ns, names)
+        self._dirs = {}
+
+    def list_dir(self, directory: str) -> tuple:
+        with self._lock:
+            cached = self._dirs.get(directory)
+            if cached is not None and cached[0] == current_round():
+                return cached[2]
+
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self._dirs.pop(directory, None)
+                return ()
+
+            if cached is not None and cached[1] == mtime:
+                names = cached[2]
+            else:
+                try:
+                    names = tuple(entry.name for entry in os.scandir(directory))
+                except OSError:
+                    names = ()
+
+            self._dirs[directory] = (current_round(), mtime, names)
+            return names
+
+    def iglob(self, pattern: str):
+        """Same as `glob.iglob(pattern)`, resolved from cached listings."""
+        if not glob.has_magic(pattern):
+            if os.path.lexists(pattern):
+                yield pattern
+            return
+
+        dirname, basename = os.path.split(pattern)
+        if dirname and glob.has_magic(dirname):
+            directories = self.iglob(dirname)
+        else:
+            directories = [dirname]
+
+        for directory in directories:
+            if glob.has_magic(basename):
+                for name in fnmatch.filter(self.list_dir(directory or os.curdir), basename):
+                    if name.startswith(".") and not basename.startswith("."):
+                        continue
+                    yield os.path.join(directory, name)
+            elif basename:
+                if os.path.lexists(os.path.join(directory, basename)):
+                    yield os.path.join(directory, basename)
+            elif os.path.isdir(directory):
+                yield os.path.join(directory, basename)
+
+    def exists(self, pattern: str) -> bool:
+        """Does anything match `pattern`?"""
+        return next(self.iglob(pattern), None) is not None
+
+
+dir_listings = DirectoryListings()
+
+
+def fingerprint(resource: tuple):
+    """
+    A cheap value that changes whenever `resource` (something a probe
+    observes, see `CompatibilityProbe.observes`) might have changed:
+
+        ("host",)           the machine itself (see `HostFacts`)
+        ("path", path)      a file or directory, by lstat()
+        ("dir", path)       the entries of a directory, by its mtime
+        ("command", name)   PATH lookups, by PATH and its directories' mtimes
+        ("dpkg",) ("brew",) ("pipx",)
+                            a package manager's database
+        ("group", name)     a group's members
+        ("volatile",)       anything else; always considered changed
+    """
+    kind = resource[0]
+
+    if kind == "host":
+        return host_facts()
+
+    if kind == "path":
+        try:
+            stat = os.lstat(resource[1])
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    if kind == "dir":
+        try:
+            return os.stat(resource[1]).st_mtime_ns
+        except OSError:
+            return None
+
+    if kind == "command":
+        path = os.environ.get("PATH", os.defpath)
+        return (path, tuple(fingerprint(("dir", d)) for d in path.split(os.pathsep) if d))
+
+    if kind == "dpkg":
+        return dpkg_status.stamp()
+
+    if kind == "brew":
+        return brew_inventory.stamp()
+
+    if kind == "pipx":
+        return pipx_inventory.stamp()
+
+    if kind == "group":
+        import grp
+        try:
+            group = grp.getgrnam(resource[1])
+        except KeyError:
+            return None
+        return (group.gr_gid, tuple(group.gr_mem))
+
+    return object()
+
+
+class HostFacts(NamedTuple):
+    """
+    What kind of machine `expand` is running on. Detected once per process
+    (see `host_facts()`), so compatibility probes and privilege checks are
+    plain lookups. Tests inject their own with `set_host_facts()`.
+    """
+
+    system: str                  # platform.system(), e.g. "Linux" or "Darwin"
+    machine: str                 # platform.machine(), lowercased
+    package_managers: frozenset  # which of apt and brew are in PATH
+    has_display: bool            # a graphical session is running or installed
+    uid: int
+    euid: int
+
+    SESSION_DIRS = ["/usr/share/xsessions", "/usr/share/wayland-sessions"]
+
+    @staticmethod
+    def detect() -> "HostFacts":
+        system = platform.system()
+
+        # macOS always has a display. Otherwise look for a graphical session,
+        # then for desktop sessions being installed at all.
+        has_display = (
+            system == "Darwin"
+            or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+            or any(os.path.isdir(d) and os.listdir(d) for d in HostFacts.SESSION_DIRS)
+        )
+
+        return HostFacts(
+            system=system,
+            machine=platform.machine().lower(),
+            package_managers=frozenset(pm for pm in ("apt", "brew") if path_index.which(pm)),
+            has_display=has_display,
+            uid=os.getuid(),
+            euid=os.geteuid(),
+        )
+
+
+_host_facts = None
+_host_facts_lock = threading.Lock()
+
+
+def host_facts() -> HostFacts:
+    """The facts about this machine, detected on first use."""
+    global _host_facts
+    with _host_facts_lock:
+        if _host_facts is None:
+            _host_facts = HostFacts.detect()
+        return _host_facts
+
+
+def set_host_facts(facts: Optional[HostFacts]):
+    """
+    Use `facts` instead of detecting them, or pass None to detect them again
+    on next use (e.g. after changing user or installing a package manager).
+    """
+    global _host_facts
+    with _host_facts_lock:
+        _host_facts = facts
@@ -70,32 +70,34 @@ def export_installed_preset(preset_name, workers=4):
     Writes to presets/<preset_name>.json with all packages whose installed probes
     report "Installed".
     """
-    from concurrent.futures import ThreadPoolExecutor
     from expand.gui_elements import Choice
-    from expand import util
+    from expand.evaluator import probe_evaluator
+    from expand.catalog_index import CatalogIndex
+    from expand import inventory
 
     base_dir = "ansible/"
     presets_dir = "presets"
 
     # Build the same data structure the TUI uses
+    inventory.new_round()
     all_choices = []
-    for entry in sorted(os.scandir(base_dir), key=lambda e: e.name):
-        if entry.is_dir() and not entry.name.startswith('.'):
-            dir_path = os.path.join(base_dir, entry.name)
-            files = util.get_files(dir_path)
-            for name, file_path in files.items():
-                all_choices.append(Choice(name, file_path))
+    for _, entries in CatalogIndex().scan(base_dir):
+        for entry in entries:
+            all_choices.append(Choice(entry.name, entry.path, entry))
 
     # Precompute installed statuses in parallel
     print(f"Checking installed status of {len(all_choices)} packages...")
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        executor.map(lambda c: c.installed_status(), all_choices)
+    probe_evaluator.evaluate(all_choices, workers)
 
     # Collect packages that are detected as installed
     installed = sorted(
         c.name for c in all_choices if c.installed_status() == "Installed"
     )
 
+    timed_out = sorted(c.name for c in all_choices if c.installed_status() == "Timed out")
+    if timed_out:
+        print(f"Left out {len(timed_out)} packages whose status check timed out: {', '.join(timed_out)}")
+
     # Write preset file
     os.makedirs(presets_dir, exist_ok=True)
     out_path = os.path.join(presets_dir, preset_name + ".json")
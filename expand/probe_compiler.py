@@ -0,0 +1,86 @@
+"""
+Compiles the python-like expressions in ansible file headers without eval().
+
+Only a tiny subset of python is accepted:
+
+    - calls to the probe classes in `expand.probes` and the priviledge levels
+      in `expand.priviledge`, e.g. CommandProbe("git") or OnlyRoot()
+    - list literals, e.g. [LinuxProbe(), AnyProbes([...])]
+    - str, int, float, bool and None literals as arguments
+
+Anything else (attribute access, unknown names, operators, comprehensions...)
+is rejected with a ValueError before a single object is created.
+"""
+
+import ast
+import inspect
+from functools import lru_cache
+from expand import probes, priviledge
+
+
+def _get_allowed_classes() -> dict[str, type]:
+    """
+    Every concrete probe and priviledge class, by name.
+    """
+    bases = (probes.CompatibilityProbe, probes.InstalledProbe, priviledge.PriviledgeLevel)
+
+    allowed = {}
+    for module in (probes, priviledge):
+        for name, obj in vars(module).items():
+            if not inspect.isclass(obj) or obj.__module__ != module.__name__:
+                continue
+            if obj in bases or inspect.isabstract(obj) or not issubclass(obj, bases):
+                continue
+            allowed[name] = obj
+
+    return allowed
+
+
+ALLOWED_CLASSES = _get_allowed_classes()
+
+CONSTANT_TYPES = (str, int, float, bool, type(None))
+
+
+def _build(node: ast.AST, source: str):
+    """
+    Turn a validated AST node into the object it describes.
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, CONSTANT_TYPES):
+        return node.value
+
+    if isinstance(node, ast.List):
+        return [_build(elt, source) for elt in node.elts]
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in ALLOWED_CLASSES:
+            name = ast.unparse(node.func)
+            raise ValueError(f"'{name}' is not a probe or priviledge level in: {source}")
+
+        args = [_build(arg, source) for arg in node.args]
+        kwargs = {}
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise ValueError(f"**kwargs are not allowed in: {source}")
+            kwargs[keyword.arg] = _build(keyword.value, source)
+
+        return ALLOWED_CLASSES[node.func.id](*args, **kwargs)
+
+    raise ValueError(f"'{ast.unparse(node)}' is not allowed in: {source}")
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(source: str):
+    """
+    Compile one header expression, e.g. '[CommandProbe("git")]', into the
+    probe tree (or priviledge level) it describes.
+
+    Results are cached by source text, so the many identical lines across
+    playbooks (`[]`, `OnlyRoot()`, `[LinuxProbe()]`...) are compiled once and
+    share their objects. Treat the returned objects as read-only.
+    """
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid header expression: {source}") from e
+
+    return _build(tree.body, source)
@@ -0,0 +1,191 @@
+"""
+Per-probe timing for `--profile-probes`.
+
+When `probe_evaluator.profile` is a ProbeProfile, every probe the evaluator
+runs is timed and every result it hands out from memory is counted as a hit.
+With no profile set the evaluator only pays for one attribute check, so the
+hook can stay in place permanently.
+
+The report lists the slowest probes, the total probe time of each playbook
+(a probe shared by several playbooks counts in full for each of them), how
+many commands were run and how often the probe and snapshot caches were hit.
+
+The engine loads the brew and pipx inventories before evaluating the probes
+that read them, so those probes take no time of their own. Each load is
+timed separately, and charged to every probe that observes the snapshot and
+to every playbook using one of those probes.
+"""
+
+import json
+import time
+import threading
+from expand import inventory
+from expand.evaluator import _leaves
+
+
+class ProbeProfile:
+    """
+    Collects timings from the probe evaluator. Safe to use from many threads.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (kind, probe) -> [evaluations, cache hits, seconds spent evaluating]
+        self.stats = {}
+        # Playbook path -> (name, {(kind, probe), ...}) for every Choice evaluated
+        self.playbooks = {}
+        # Snapshot kind ("brew", "pipx") -> seconds spent waiting for it to load
+        self.loads = {}
+        self.commands_before = inventory.command_counts.copy()
+        self.snapshots_before = inventory.snapshot_counts.copy()
+
+    def _entry(self, key: tuple) -> list:
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = self.stats[key] = [0, 0, 0.0]
+        return entry
+
+    def timed(self, key: tuple, function):
+        """Call `function` and record how long it took under `key`."""
+        start = time.perf_counter()
+        try:
+            return function()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                entry = self._entry(key)
+                entry[0] += 1
+                entry[2] += elapsed
+
+    async def timed_load(self, kind: str, coroutine):
+        """Await `coroutine`, which loads the `kind` snapshot, and record how long it took."""
+        start = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.loads[kind] = self.loads.get(kind, 0.0) + elapsed
+
+    def hit(self, key: tuple):
+        """Record that the result for `key` was served from memory."""
+        with self._lock:
+            self._entry(key)[1] += 1
+
+    def add_choices(self, choices):
+        """Remember which probes each of `choices` uses."""
+        with self._lock:
+            for choice in choices:
+                header = choice.expansion_card.header
+                keys = {("compatible", probe) for probe in header.probes}
+                keys.update(("installed", probe) for probe in _leaves(header.installed_probes))
+                self.playbooks[choice.file_path] = (choice.name, keys)
+
+    def report(self, limit: int = 20) -> dict:
+        """
+        Summarize everything recorded so far as plain data, ready to be
+        dumped as JSON or formatted with `format_report`.
+        """
+        with self._lock:
+            stats = {key: tuple(entry) for key, entry in self.stats.items()}
+            playbooks = dict(self.playbooks)
+            loads = dict(self.loads)
+
+        def waited(probes) -> float:
+            kinds = {resource[0] for probe in probes for resource in probe.observes()}
+            return sum(loads[kind] for kind in kinds & loads.keys())
+
+        probes = sorted(
+            (
+                {
+                    "kind": kind, "probe": repr(probe), "evaluations": evaluations, "hits": hits,
+                    "seconds": seconds + waited([probe]),
+                }
+                for (kind, probe), (evaluations, hits, seconds) in stats.items()
+            ),
+            key=lambda row: row["seconds"],
+            reverse=True,
+        )
+
+        totals = []
+        for path, (name, keys) in playbooks.items():
+            seconds = sum(stats[key][2] for key in keys if key in stats) + waited(probe for _, probe in keys)
+            totals.append({"name": name, "path": path, "probes": len(keys), "seconds": seconds})
+        totals.sort(key=lambda row: row["seconds"], reverse=True)
+
+        commands = inventory.command_counts - self.commands_before
+        snapshots = inventory.snapshot_counts - self.snapshots_before
+
+        evaluations = sum(entry[0] for entry in stats.values())
+        hits = sum(entry[1] for entry in stats.values())
+
+        return {
+            "slowest_probes": probes[:limit],
+            "playbooks": totals[:limit],
+            "commands": dict(sorted(commands.items())),
+            "probe_cache": _hit_rate(hits, evaluations),
+            "snapshot_caches": {
+                name: _hit_rate(snapshots[name, "hits"], snapshots[name, "loads"])
+                for name in sorted({name for name, _ in snapshots})
+            },
+            "snapshot_loads": dict(sorted(loads.items())),
+            "total_seconds": sum(entry[2] for entry in stats.values()) + sum(loads.values()),
+        }
+
+
+def _hit_rate(hits: int, misses: int) -> dict:
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+def format_report(report: dict) -> str:
+    """Render a `ProbeProfile.report()` as plain-text tables."""
+    lines = [f"Probe time: {report['total_seconds'] * 1000:.1f} ms", "", "Slowest probes:"]
+    lines.append(f"    {'ms':>9}  {'evals':>5}  {'hits':>5}  probe")
+    for row in report["slowest_probes"]:
+        lines.append(
+            f"    {row['seconds'] * 1000:>9.2f}  {row['evaluations']:>5}  {row['hits']:>5}  "
+            f"{row['kind']} {row['probe']}"
+        )
+
+    lines += ["", "Playbooks by probe time:"]
+    lines.append(f"    {'ms':>9}  {'probes':>6}  playbook")
+    for row in report["playbooks"]:
+        lines.append(f"    {row['seconds'] * 1000:>9.2f}  {row['probes']:>6}  {row['name']}")
+
+    lines += ["", "Snapshot loads:"]
+    for kind, seconds in report["snapshot_loads"].items():
+        lines.append(f"    {seconds * 1000:>9.2f}  {kind}")
+    if not report["snapshot_loads"]:
+        lines.append("    none")
+
+    lines += ["", "Commands run:"]
+    for program, count in report["commands"].items():
+        lines.append(f"    {count:>5}  {program}")
+    if not report["commands"]:
+        lines.append("    none")
+
+    lines += ["", "Cache hit rates:"]
+    caches = {"probe results": report["probe_cache"], **report["snapshot_caches"]}
+    for name, cache in caches.items():
+        lines.append(
+            f"    {cache['hit_rate'] * 100:>5.1f}%  {name} "
+            f"({cache['hits']} hits, {cache['misses']} misses)"
+        )
+
+    return "\n".join(lines)
+
+
+def write_report(profile: ProbeProfile, destination: str):
+    """
+    Print the report as tables if `destination` is "-", otherwise write it
+    to `destination` as JSON.
+    """
+    report = profile.report()
+    if destination == "-":
+        print(format_report(report))
+        return
+
+    with open(destination, "w", encoding="UTF-8") as file:
+        json.dump(report, file, indent=4)
+        file.write("\n")
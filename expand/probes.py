@@ -3,13 +3,79 @@ Classes that test if the system has certain properties.
 """
 
 import os
-import platform
-import subprocess
 from abc import ABC, abstractmethod
-from shutil import which
+from typing import Optional
+from expand import inventory
 
 
-class CompatibilityProbe(ABC):
+# How expensive a probe is to evaluate, cheapest first. Composites and
+# Choices evaluate their probes in this order, so a cheap probe that decides
+# the result spares running an expensive one.
+COST_MEMORY = 0      # answered from memory (host facts)
+COST_STAT = 1        # a stat() or directory listing (PATH, files)
+COST_READ = 2        # reads a file (dpkg database, /etc/group, configs)
+COST_SUBPROCESS = 3  # may run a command (brew, pipx)
+
+
+def cost_of(probe) -> int:
+    """
+    The cost tier of `probe`. A composite costs as much as its most
+    expensive child, and a probe that doesn't say is assumed expensive.
+    """
+    if isinstance(probe, (AllProbes, AnyProbes)):
+        return max((cost_of(child) for child in probe.probes), default=COST_MEMORY)
+    return getattr(type(probe), "COST", COST_SUBPROCESS)
+
+
+def by_cost(probes) -> list:
+    """`probes` sorted cheapest first, keeping their order within a tier."""
+    return sorted(probes, key=cost_of)
+
+
+def which(command: str) -> Optional[str]:
+    """
+    Return the full path of `command` in PATH, or None. Answered from the
+    shared PATH index (see `expand.inventory.PathIndex`).
+    """
+    return inventory.path_index.which(command)
+
+
+def _freeze(value):
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class _ValueIdentity:
+    """
+    Probes are values: two probes of the same class built from the same
+    arguments are equal and hash alike, so the same probe appearing in many
+    headers can be evaluated once per probe round.
+    """
+
+    def _args(self) -> dict:
+        return {name: value for name, value in vars(self).items() if not name.startswith("_")}
+
+    def _key(self) -> tuple:
+        return (type(self), tuple((name, _freeze(value)) for name, value in sorted(self._args().items())))
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self) -> int:
+        # Probes aren't modified after construction, so the hash is kept
+        if "_hash" not in vars(self):
+            self._hash = hash(self._key())
+        return self._hash
+
+    def __repr__(self) -> str:
+        args = ", ".join(repr(value) for value in self._args().values())
+        return f"{type(self).__name__}({args})"
+
+
+class CompatibilityProbe(_ValueIdentity, ABC):
     @abstractmethod
     def get_error_message(self) -> str:
         pass
@@ -18,49 +84,83 @@ class CompatibilityProbe(ABC):
     def is_compatible(self) -> bool:
         pass
 
+    def observes(self) -> tuple:
+        """
+        The resources this probe's result depends on (see
+        `expand.inventory.fingerprint`). A result is only re-evaluated after
+        an install if one of them changed.
+        """
+        return (("volatile",),)
+
 # Used to be x86Probe
 class AmdProbe(CompatibilityProbe):
+    COST = COST_MEMORY
+
     def get_error_message(self) -> str:
         return "Not on amd64."
 
     def is_compatible(self) -> bool:
-        machine = platform.machine().lower()
-        return machine in {'x86_64', 'amd64', 'x86', 'i386'}
+        return inventory.host_facts().machine in {'x86_64', 'amd64', 'x86', 'i386'}
+
+    def observes(self) -> tuple:
+        return (("host",),)
 
 # Used to be DebianProbe
 class AptProbe(CompatibilityProbe):
+    COST = COST_MEMORY
+
     def get_error_message(self) -> str:
         return "apt doesn't exist"
 
     def is_compatible(self) -> bool:
-        return which("apt") is not None
+        return "apt" in inventory.host_facts().package_managers
+
+    def observes(self) -> tuple:
+        return (("host",),)
 
 
 class BrewProbe(CompatibilityProbe):
+    COST = COST_MEMORY
+
     def get_error_message(self) -> str:
         return "brew doesn't exist"
 
     def is_compatible(self) -> bool:
-        return which("brew") is not None
+        return "brew" in inventory.host_facts().package_managers
+
+    def observes(self) -> tuple:
+        return (("host",),)
 
 
 class DarwinProbe(CompatibilityProbe):
+    COST = COST_MEMORY
+
     def get_error_message(self) -> str:
         return "Not on macOS."
 
     def is_compatible(self) -> bool:
-        return platform.system() == "Darwin"
+        return inventory.host_facts().system == "Darwin"
+
+    def observes(self) -> tuple:
+        return (("host",),)
 
 
 class LinuxProbe(CompatibilityProbe):
+    COST = COST_MEMORY
+
     def get_error_message(self) -> str:
         return "Not on Linux."
 
     def is_compatible(self) -> bool:
-        return platform.system() == "Linux"
+        return inventory.host_facts().system == "Linux"
+
+    def observes(self) -> tuple:
+        return (("host",),)
 
 
 class WhichProbe(CompatibilityProbe):
+    COST = COST_STAT
+
     def __init__(self, command) -> None:
         self.command = command
 
@@ -68,39 +168,30 @@ class WhichProbe(CompatibilityProbe):
         return f"{self.command} is not installed."
 
     def is_compatible(self) -> bool:
-        result = subprocess.run(
-            f"which {self.command} > /dev/null 2>&1", shell=True, check=False
-        )
-        return result.returncode == 0
+        return which(self.command) is not None
+
+    def observes(self) -> tuple:
+        return (("command", self.command),)
 
 
 class DisplayProbe(CompatibilityProbe):
+    COST = COST_MEMORY
+
     def get_error_message(self) -> str:
         return "No display/GUI detected."
 
     def is_compatible(self) -> bool:
-        # macOS always has a display
-        if platform.system() == "Darwin":
-            return True
-
-        # Check if currently in a graphical session
-        if os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"):
-            return True
+        return inventory.host_facts().has_display
 
-        # Check if system has GUI capability (desktop sessions installed)
-        session_dirs = ["/usr/share/xsessions", "/usr/share/wayland-sessions"]
-        for session_dir in session_dirs:
-            if os.path.isdir(session_dir) and os.listdir(session_dir):
-                return True
-
-        return False
+    def observes(self) -> tuple:
+        return (("host",),)
 
 
 # =============================================================================
 # InstalledProbe classes - Real-time detection of installed software
 # =============================================================================
 
-class InstalledProbe(ABC):
+class InstalledProbe(_ValueIdentity, ABC):
     """Abstract base class for probes that detect if software is installed."""
 
     @abstractmethod
@@ -108,91 +199,98 @@ class InstalledProbe(ABC):
         """Return True if the software is detected as installed."""
         pass
 
+    def observes(self) -> tuple:
+        """Same as `CompatibilityProbe.observes`."""
+        return (("volatile",),)
+
 
 class CommandProbe(InstalledProbe):
     """Check if a command exists in PATH."""
 
+    COST = COST_STAT
+
     def __init__(self, command: str) -> None:
         self.command = command
 
     def is_installed(self) -> bool:
         return which(self.command) is not None
 
+    def observes(self) -> tuple:
+        return (("command", self.command),)
+
 
 class FileProbe(InstalledProbe):
     """Check if a file or directory exists. Supports glob patterns."""
 
+    COST = COST_STAT
+
     def __init__(self, path: str) -> None:
         self.path = os.path.expanduser(path)
 
     def is_installed(self) -> bool:
+        return inventory.dir_listings.exists(self.path)
+
+    def observes(self) -> tuple:
         import glob
-        return len(glob.glob(self.path)) > 0
+        if not glob.has_magic(self.path):
+            return (("path", self.path),)
+
+        dirname = os.path.dirname(self.path)
+        if glob.has_magic(dirname):
+            return (("volatile",),)
+        return (("dir", dirname or os.curdir),)
 
 
 class AptPackageProbe(InstalledProbe):
-    """Check if an apt package is installed."""
+    """Check if an apt package is installed, using the shared dpkg database snapshot."""
+
+    COST = COST_READ
 
     def __init__(self, package: str) -> None:
         self.package = package
 
     def is_installed(self) -> bool:
-        result = subprocess.run(
-            ["dpkg", "-s", self.package],
-            capture_output=True,
-            check=False
-        )
-        return result.returncode == 0
+        return inventory.dpkg_status.is_installed(self.package)
+
+    def observes(self) -> tuple:
+        return (("dpkg",),)
 
 
 class BrewPackageProbe(InstalledProbe):
-    """Check if a Homebrew package is installed (formula or cask)."""
+    """Check if a Homebrew package is installed (formula or cask), using the shared brew inventory."""
+
+    COST = COST_SUBPROCESS
 
     def __init__(self, package: str) -> None:
         self.package = package
 
     def is_installed(self) -> bool:
-        result = subprocess.run(
-            ["brew", "list", "--formula", self.package],
-            capture_output=True,
-            check=False
-        )
-        if result.returncode == 0:
-            return True
-        result = subprocess.run(
-            ["brew", "list", "--cask", self.package],
-            capture_output=True,
-            check=False
-        )
-        return result.returncode == 0
+        return inventory.brew_inventory.is_installed(self.package)
+
+    def observes(self) -> tuple:
+        return (("brew",),)
 
 
 class PipxProbe(InstalledProbe):
-    """Check if a pipx package is installed."""
+    """Check if a pipx package is installed, using the shared pipx inventory."""
+
+    COST = COST_SUBPROCESS
 
     def __init__(self, package: str) -> None:
         self.package = package
 
     def is_installed(self) -> bool:
-        result = subprocess.run(
-            ["pipx", "list", "--short"],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        if result.returncode != 0:
-            return False
-        # pipx list --short outputs "package version" per line
-        for line in result.stdout.splitlines():
-            parts = line.split()
-            if parts and parts[0] == self.package:
-                return True
-        return False
+        return inventory.pipx_inventory.is_installed(self.package)
+
+    def observes(self) -> tuple:
+        return (("pipx",),)
 
 
 class GroupMemberProbe(InstalledProbe):
     """Check if the current user is a member of a group."""
 
+    COST = COST_READ
+
     def __init__(self, group: str) -> None:
         self.group = group
 
@@ -206,6 +304,9 @@ class GroupMemberProbe(InstalledProbe):
         except KeyError:
             return False
 
+    def observes(self) -> tuple:
+        return (("group", self.group),)
+
 
 class AllProbes(InstalledProbe):
     """All probes must pass for is_installed to return True."""
@@ -214,7 +315,10 @@ class AllProbes(InstalledProbe):
         self.probes = probes
 
     def is_installed(self) -> bool:
-        return all(probe.is_installed() for probe in self.probes)
+        return all(probe.is_installed() for probe in by_cost(self.probes))
+
+    def observes(self) -> tuple:
+        return tuple(dict.fromkeys(r for probe in self.probes for r in probe.observes()))
 
 
 class AnyProbes(InstalledProbe):
@@ -224,12 +328,17 @@ class AnyProbes(InstalledProbe):
         self.probes = probes
 
     def is_installed(self) -> bool:
-        return any(probe.is_installed() for probe in self.probes)
+        return any(probe.is_installed() for probe in by_cost(self.probes))
+
+    def observes(self) -> tuple:
+        return tuple(dict.fromkeys(r for probe in self.probes for r in probe.observes()))
 
 
 class FileMatchProbe(InstalledProbe):
     """Check if a deployed file exactly matches its source in the repo."""
 
+    COST = COST_READ
+
     _project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
     def __init__(self, source: str, dest: str) -> None:
@@ -240,28 +349,31 @@ class FileMatchProbe(InstalledProbe):
         if not os.path.isfile(self.dest):
             return False
         try:
-            with open(self.source, "rb") as sf, open(self.dest, "rb") as df:
-                return sf.read() == df.read()
+            return inventory.file_hashes.files_match(self.source, self.dest)
         except (IOError, OSError):
             return False
 
+    def observes(self) -> tuple:
+        return (("path", self.source), ("path", self.dest))
+
 
 
 class GrepProbe(InstalledProbe):
     """Check if a pattern exists in a file."""
 
+    COST = COST_READ
+
     def __init__(self, path: str, pattern: str) -> None:
         self.path = os.path.expanduser(path)
         self.pattern = pattern
+        # Every pattern for the same file is answered from a single scan
+        inventory.grep_index.register(self.path, self.pattern)
 
     def is_installed(self) -> bool:
-        if not os.path.exists(self.path):
-            return False
-        try:
-            with open(self.path, "r", encoding="UTF-8") as f:
-                return self.pattern in f.read()
-        except (IOError, UnicodeDecodeError):
-            return False
+        return inventory.grep_index.contains(self.path, self.pattern)
+
+    def observes(self) -> tuple:
+        return (("path", self.path),)
 
 
 
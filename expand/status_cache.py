@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import platform
+
+
+class StatusCache:
+    """
+    Remembers the probe results of the last run, so the TUI can draw right
+    away and check them again in the background (stale-while-revalidate).
+
+    Results are kept per user and host, since both change what is installed
+    and compatible. The format for the cache file (status_cache.json) is:
+        {
+            "0@hostname": {
+                "saved": 1700000000.0,
+                "playbooks": {
+                    "ansible/tools/git.yaml": {
+                        "probes": "<hash of the header's probes>",
+                        "installed": "Installed",
+                        "failing": [0],
+                        "checked": 1700000000.0
+                    },
+                    ...
+                }
+            }
+        }
+
+    `failing` holds the indexes of the failing compatibility probes. An
+    entry is only used while the playbook's probes are unchanged and it is
+    younger than MAX_AGE. Like FailureCache, a missing or broken file is
+    treated as empty.
+    """
+
+    CACHE_FILE = "status_cache.json"
+
+    # Seconds before a remembered result is too old to show at all
+    MAX_AGE = 7 * 24 * 60 * 60
+
+    # Statuses that aren't worth remembering
+    TRANSIENT = ("Timed out", "Failure")
+
+    @staticmethod
+    def _get_json() -> dict:
+        try:
+            with open(StatusCache.CACHE_FILE, "r", encoding="UTF-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _write_json(data: dict):
+        # Written whole and renamed into place, so a crash never leaves a
+        # half-written cache behind
+        temp_file = StatusCache.CACHE_FILE + ".tmp"
+        try:
+            with open(temp_file, "w+", encoding="UTF-8") as file:
+                file.write(json.dumps(data, sort_keys=True, indent=4))
+            os.replace(temp_file, StatusCache.CACHE_FILE)
+        except OSError as e:
+            logging.warning(f"Could not write {StatusCache.CACHE_FILE}: {e}")
+
+    @staticmethod
+    def host_key() -> str:
+        """Who and where `expand` is running, e.g. "1000@laptop"."""
+        return f"{os.geteuid()}@{platform.node()}"
+
+    @staticmethod
+    def _probes_hash(choice) -> str:
+        header = choice.expansion_card.header
+        return hashlib.sha1(repr((header.probes, header.installed_probes)).encode("UTF-8")).hexdigest()
+
+    @staticmethod
+    def restore(choices) -> int:
+        """
+        Give every Choice with a usable entry its remembered results (see
+        `Choice.restore_probe_results`). Returns how many were restored.
+        """
+        playbooks = StatusCache._get_json().get(StatusCache.host_key(), {}).get("playbooks", {})
+        now = time.time()
+
+        restored = 0
+        for choice in choices:
+            entry = playbooks.get(choice.file_path)
+            if not isinstance(entry, dict) or now - entry.get("checked", 0) > StatusCache.MAX_AGE:
+                continue
+            if entry.get("probes") != StatusCache._probes_hash(choice):
+                continue
+
+            probes = choice.expansion_card.header.probes
+            try:
+                failing = [probes[i] for i in entry["failing"]]
+            except (KeyError, IndexError, TypeError):
+                continue
+
+            choice.restore_probe_results(entry.get("installed"), failing)
+            restored += 1
+
+        logging.debug(f"Status cache: restored {restored} of {len(choices)} playbooks")
+        return restored
+
+    @staticmethod
+    def save(choices):
+        """Remember the current, fully checked results of `choices`."""
+        data = StatusCache._get_json()
+        host = data.setdefault(StatusCache.host_key(), {})
+        playbooks = host.setdefault("playbooks", {})
+        now = time.time()
+
+        for choice in choices:
+            if choice.stale:
+                continue
+
+            status = choice.installed_status()
+            probes = choice.expansion_card.header.probes
+            failing = choice.failing_probes()
+            playbooks[choice.file_path] = {
+                "probes": StatusCache._probes_hash(choice),
+                "installed": None if status in StatusCache.TRANSIENT else status,
+                "failing": [i for i, probe in enumerate(probes) if probe in failing],
+                "checked": now,
+            }
+
+        host["saved"] = now
+        StatusCache._write_json(data)
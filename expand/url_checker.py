@@ -0,0 +1,130 @@
+import queue
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future
+from expand import util
+
+
+# Hosts a worker keeps connections open to, most recently used first
+POOL_HOSTS = 32
+
+
+def new_session() -> requests.Session:
+    """
+    A session for one worker: HTTP keep-alive with one pooled connection per
+    host, since a worker only makes one request at a time.
+    """
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=1)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class UrlChecker:
+    """
+    Checks the URLs of every playbook on a small, fixed pool of worker
+    threads fed from one job queue, so the number of threads and sockets
+    doesn't grow with the catalog.
+
+    The same URLs (release pages, get.docker.com...) show up in many
+    playbooks, so results are shared process-wide: every URL is normalized
+    (see `util.normalize_url`) and each distinct one is checked once, its
+    result fanned out to every playbook that uses it.
+
+    `submit` returns a Future of a playbook's URLs that aren't up. Workers
+    are only started as jobs come in, and are daemon threads: quitting
+    never waits for the checks still queued.
+
+    requests doesn't document Session as thread-safe, so every worker has a
+    session of its own (see `new_session`) and keeps its connections alive
+    between checks: at most `workers` connections per host in total.
+    """
+
+    WORKERS = 8
+
+    def __init__(self, workers: int = None) -> None:
+        self.workers = workers or UrlChecker.WORKERS
+        self._jobs = queue.SimpleQueue()
+        self._threads = []
+        self._lock = threading.Lock()
+        # Normalized URL -> Future of whether it is up
+        self._checks = {}
+        # URLs submitted in total, for the dedup ratio
+        self._uses = 0
+
+    def _work(self):
+        session = new_session()
+        while True:
+            future, url = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(util.is_url_up(url, session))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _check(self, url: str) -> Future:
+        """The shared check of `url`, queued if it's the first use. Call with the lock held."""
+        url = util.normalize_url(url)
+        self._uses += 1
+        check = self._checks.get(url)
+        if check is None or check.cancelled():
+            check = self._checks[url] = Future()
+            self._jobs.put((check, url))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name="url-check", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return check
+
+    def submit(self, urls) -> Future:
+        """Check `urls`; the Future resolves to the broken ones."""
+        future = Future()
+        with self._lock:
+            checks = {url: self._check(url) for url in sorted(urls)}
+        if not checks:
+            future.set_result([])
+            return future
+
+        remaining = len(checks)
+        remaining_lock = threading.Lock()
+
+        def check_done(_):
+            nonlocal remaining
+            with remaining_lock:
+                remaining -= 1
+                if remaining != 0:
+                    return
+            if any(check.cancelled() for check in checks.values()):
+                future.cancel()
+                return
+            try:
+                future.set_result([url for url, check in checks.items() if not check.result()])
+            except Exception as e:
+                future.set_exception(e)
+
+        for check in checks.values():
+            check.add_done_callback(check_done)
+        return future
+
+    def log_dedup(self):
+        """Log how many URL uses were shared, e.g. after loading the catalog."""
+        with self._lock:
+            uses, distinct = self._uses, len(self._checks)
+        if distinct:
+            logging.debug(f"URL checks: {uses} URL uses, {distinct} distinct ({uses / distinct:.1f}x dedup)")
+
+    def cancel(self):
+        """Drop every check that hasn't started yet."""
+        while True:
+            try:
+                check, _ = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            check.cancel()
+
+
+url_checker = UrlChecker()
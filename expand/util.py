@@ -7,6 +7,8 @@ import re
 import pwd
 import requests
 from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+from expand import inventory
 from expand.probes import *
 
 
@@ -15,7 +17,8 @@ def get_failing_probes(probes: list[CompatibilityProbe]) -> list[CompatibilityPr
     Run every probe in a list of `probes` and return the failing probes.
     """
 
-    return list(filter(lambda probe: not probe.is_compatible(), probes))
+    from expand.evaluator import probe_evaluator
+    return probe_evaluator.failing_probes(probes)
 
 
 def filter_str_for_urls(string) -> set[str]:
@@ -31,16 +34,67 @@ def filter_str_for_urls(string) -> set[str]:
     return set(links)
 
 
-def is_url_up(url) -> bool:
+def normalize_url(url: str) -> str:
     """
-    Returns true if url returns 200 HTTP Status Code on HEAD.
+    The canonical spelling of `url`, so the same address written differently
+    across playbooks is checked once: scheme and host lowercased, default
+    port, fragment and an empty path dropped.
+
+    E.x. "HTTPS://Get.Docker.com:443#install" -> "https://get.docker.com/"
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+
+    netloc = (parts.hostname or "").lower()
+    if ":" in netloc:
+        netloc = f"[{netloc}]"
+    if parts.username is not None:
+        netloc = parts.username + (f":{parts.password}" if parts.password is not None else "") + "@" + netloc
+    if port is not None and port != {"http": 80, "https": 443}.get(parts.scheme.lower()):
+        netloc += f":{port}"
+
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or "/", parts.query, ""))
+
+
+# Permanent redirects seen so far: URL -> where it moved
+_moved_urls = {}
+
+
+def _resolve_moved_url(url: str) -> str:
+    seen = {url}
+    while url in _moved_urls:
+        url = _moved_urls[url]
+        if url in seen:
+            break
+        seen.add(url)
+    return url
+
+
+def is_url_up(url, session: Optional[requests.Session] = None) -> bool:
+    """
+    Returns true if url returns 200 HTTP Status Code on HEAD. Checks made
+    with the same `session` reuse its kept-alive connections (see
+    `UrlChecker`).
+
+    Permanent redirects (301 and 308) are remembered, so checking a URL that
+    moved again goes straight to its new location.
     """
+    http = requests if session is None else session
     try:
-        response = requests.head(url, allow_redirects=True, timeout=5)
-        return response.status_code == 200
-    except requests.ConnectionError:
+        response = http.head(_resolve_moved_url(url), allow_redirects=True, timeout=5)
+    except requests.RequestException:
         return False
 
+    locations = [hop.url for hop in response.history[1:]] + [response.url]
+    for hop, location in zip(response.history, locations):
+        if hop.status_code in (301, 308):
+            _moved_urls[hop.url] = location
+
+    return response.status_code == 200
+
 
 def get_files(directory: str):
     """
@@ -165,3 +219,6 @@ def change_user(username, euid=0):
     os.environ['LOGNAME'] = user_name
     os.environ['SHELL'] = user_info.pw_shell
 
+    # Host facts include the uid/euid that just changed
+    inventory.set_host_facts(None)
+
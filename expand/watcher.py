@@ -0,0 +1,196 @@
+"""
+Notices changes to what probes observe, so the TUI can re-probe just the
+rows they affect (e.g. after something is installed from another terminal).
+
+Every observed resource (see `CompatibilityProbe.observes`) is mapped to the
+directory entries it depends on. On Linux those directories are watched with
+inotify through ctypes; anywhere else, or if inotify can't be used, the
+resources' fingerprints (`inventory.fingerprint`) are polled instead. Either
+way `changed()` returns the resources that may have changed since the last
+call, without blocking.
+"""
+
+import os
+import time
+import ctypes
+import ctypes.util
+import struct
+import logging
+from expand import inventory
+
+
+def watch_targets(resource: tuple) -> list[tuple[str, str]]:
+    """
+    The (directory, entry name) pairs `resource` depends on. A name of None
+    means any change in the directory. Resources that can't be watched
+    ("host", "volatile") have none.
+    """
+    kind = resource[0]
+
+    if kind == "path":
+        path = os.path.abspath(resource[1])
+        return [(os.path.dirname(path), os.path.basename(path))]
+
+    if kind == "dir":
+        return [(os.path.abspath(resource[1]), None)]
+
+    if kind == "command":
+        path = os.environ.get("PATH", os.defpath)
+        return [(os.path.abspath(d), resource[1]) for d in path.split(os.pathsep) if d]
+
+    if kind == "dpkg":
+        status = inventory.DpkgStatus.STATUS_FILE
+        return [(os.path.dirname(status), os.path.basename(status))]
+
+    if kind == "brew":
+        return [
+            (os.path.join(prefix, name), None)
+            for prefix in inventory.BrewInventory.PREFIXES for name in ("Cellar", "Caskroom")
+        ]
+
+    if kind == "pipx":
+        venvs = inventory.pipx_inventory.get_venvs_dir()
+        return [(venvs, None)] if venvs else []
+
+    if kind == "group":
+        return [("/etc", "group")]
+
+    return []
+
+
+class PollingWatcher:
+    """
+    Compares the fingerprint of every resource at most once per INTERVAL
+    seconds. Works everywhere, at the cost of a few stat() calls per poll.
+    """
+
+    INTERVAL = 2.0
+
+    def __init__(self, resources) -> None:
+        self.resources = [r for r in set(resources) if watch_targets(r)]
+        self.fingerprints = {r: inventory.fingerprint(r) for r in self.resources}
+        self.last_poll = time.monotonic()
+
+    def changed(self) -> set:
+        now = time.monotonic()
+        if now - self.last_poll < PollingWatcher.INTERVAL:
+            return set()
+        self.last_poll = now
+
+        changed = set()
+        for resource in self.resources:
+            fingerprint = inventory.fingerprint(resource)
+            if fingerprint != self.fingerprints[resource]:
+                self.fingerprints[resource] = fingerprint
+                changed.add(resource)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Watches the directories of every resource with inotify. A directory that
+    doesn't exist yet is watched through its closest existing parent, and
+    watches are added again whenever something changes.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ONLYDIR = 0x01000000
+
+    MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    )
+
+    # struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, resources) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.resources = set(resources)
+        # Watch descriptor -> [(entry name or None, resource), ...]
+        self.watches = {}
+        self._add_watches()
+
+    def _add_watch(self, directory: str) -> tuple[int, str]:
+        # Climb to the closest directory that exists
+        while True:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), InotifyWatcher.MASK)
+            if wd >= 0:
+                return wd, directory
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return -1, directory
+            directory = parent
+
+    def _add_watches(self):
+        watches = {}
+        for resource in self.resources:
+            for directory, name in watch_targets(resource):
+                wd, watched = self._add_watch(directory)
+                if wd < 0:
+                    continue
+                # A parent stands in for a missing directory: anything in it counts
+                watches.setdefault(wd, []).append((name if watched == directory else None, resource))
+        self.watches = watches
+
+    def changed(self) -> set:
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = InotifyWatcher.EVENT.unpack_from(data, offset)
+                offset += InotifyWatcher.EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & InotifyWatcher.IN_Q_OVERFLOW:
+                    changed.update(self.resources)
+                    continue
+                for watched_name, resource in self.watches.get(wd, ()):
+                    if watched_name is None or watched_name == name or not name:
+                        changed.add(resource)
+
+        if changed:
+            # Directories may have appeared or been replaced
+            self._add_watches()
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def watch(resources):
+    """
+    Start watching `resources`, with inotify if possible and by polling
+    otherwise.
+    """
+    try:
+        return InotifyWatcher(resources)
+    except (OSError, AttributeError, TypeError) as e:
+        logging.debug(f"inotify unavailable ({e}), polling for changes instead")
+        return PollingWatcher(resources)
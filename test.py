@@ -3,132 +3,264 @@ import pytest
 import expand
 
 
+def _fake_host(**changes):
+    """
+    Pretend to run on another host (a Linux desktop with apt by default).
+    The fresh_probe_round fixture goes back to the real host after each test.
+    """
+    from expand.inventory import HostFacts, set_host_facts
+
+    facts = HostFacts(
+        system="Linux", machine="x86_64", package_managers=frozenset({"apt"}),
+        has_display=True, uid=1000, euid=1000,
+    )._replace(**changes)
+    set_host_facts(facts)
+    return facts
+
+
 def test_brew_probe():
-    from unittest.mock import patch
     from expand.probes import BrewProbe
 
     probe = BrewProbe()
 
     # brew exists → compatible
-    with patch("expand.probes.which", return_value="/opt/homebrew/bin/brew"):
-        assert probe.is_compatible() is True
+    _fake_host(package_managers=frozenset({"brew"}))
+    assert probe.is_compatible() is True
 
     # brew doesn't exist → not compatible
-    with patch("expand.probes.which", return_value=None):
-        assert probe.is_compatible() is False
+    _fake_host(package_managers=frozenset({"apt"}))
+    assert probe.is_compatible() is False
 
 
 def test_darwin_probe():
-    from unittest.mock import patch
     from expand.probes import DarwinProbe
 
     probe = DarwinProbe()
 
-    with patch("expand.probes.platform") as mock_platform:
-        mock_platform.system.return_value = "Darwin"
-        assert probe.is_compatible() is True
+    _fake_host(system="Darwin")
+    assert probe.is_compatible() is True
 
-    with patch("expand.probes.platform") as mock_platform:
-        mock_platform.system.return_value = "Linux"
-        assert probe.is_compatible() is False
+    _fake_host(system="Linux")
+    assert probe.is_compatible() is False
 
 
 def test_linux_probe():
-    from unittest.mock import patch
     from expand.probes import LinuxProbe
 
     probe = LinuxProbe()
 
-    with patch("expand.probes.platform") as mock_platform:
-        mock_platform.system.return_value = "Linux"
-        assert probe.is_compatible() is True
+    _fake_host(system="Linux")
+    assert probe.is_compatible() is True
 
-    with patch("expand.probes.platform") as mock_platform:
-        mock_platform.system.return_value = "Darwin"
-        assert probe.is_compatible() is False
+    _fake_host(system="Darwin")
+    assert probe.is_compatible() is False
 
 
-def test_brew_package_probe():
-    from unittest.mock import patch, MagicMock
+def _write_stub_command(bin_dir, name, script):
+    """Helper that writes an executable shell script `name` into `bin_dir`."""
+    bin_dir.mkdir(exist_ok=True)
+    path = bin_dir / name
+    path.write_text("#!/bin/sh\n" + script)
+    path.chmod(0o755)
+    return path
+
+
+@pytest.fixture
+def stub_brew(tmp_path, monkeypatch):
+    """A fake `brew` on PATH that logs every invocation to brew.log."""
+    from expand.inventory import brew_inventory
+
+    log = tmp_path / "brew.log"
+    _write_stub_command(tmp_path / "bin", "brew", f"""
+echo "$@" >> {log}
+case "$2" in
+    --formula) printf 'wget\\ngit\\n' ;;
+    --cask) printf 'docker\\n' ;;
+esac
+""")
+    monkeypatch.setenv("PATH", str(tmp_path / "bin") + os.pathsep + os.environ["PATH"])
+    brew_inventory.invalidate()
+    yield log
+    brew_inventory.invalidate()
+
+
+def test_brew_package_probe(stub_brew):
     from expand.probes import BrewPackageProbe
+    from expand.inventory import brew_inventory
 
-    probe = BrewPackageProbe("wget")
+    # Formula, cask, tap-qualified and missing packages
+    assert BrewPackageProbe("wget").is_installed() is True
+    assert BrewPackageProbe("docker").is_installed() is True
+    assert BrewPackageProbe("homebrew/core/git").is_installed() is True
+    assert BrewPackageProbe("mtmr").is_installed() is False
 
-    # Formula found → True (cask not checked)
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=0)
-        assert probe.is_installed() is True
-        mock_run.assert_called_once_with(
-            ["brew", "list", "--formula", "wget"],
-            capture_output=True, check=False
-        )
+    # brew ran exactly once per kind for all of those probes
+    assert stub_brew.read_text().splitlines() == ["list --formula -1", "list --cask -1"]
 
-    # Formula not found, cask found → True
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.side_effect = [
-            MagicMock(returncode=1),  # formula fails
-            MagicMock(returncode=0),  # cask succeeds
-        ]
-        assert probe.is_installed() is True
-        assert mock_run.call_count == 2
+    # After an install the inventory is reloaded
+    brew_inventory.invalidate()
+    assert BrewPackageProbe("wget").is_installed() is True
+    assert len(stub_brew.read_text().splitlines()) == 4
 
-    # Neither formula nor cask found → False
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=1)
-        assert probe.is_installed() is False
-        assert mock_run.call_count == 2
 
+def test_brew_package_probe_no_brew(tmp_path, monkeypatch):
+    from expand.probes import BrewPackageProbe
+    from expand.inventory import brew_inventory
 
-def test_pipx_probe():
-    from unittest.mock import patch, MagicMock
+    monkeypatch.setenv("PATH", str(tmp_path))
+    brew_inventory.invalidate()
+    assert BrewPackageProbe("wget").is_installed() is False
+    brew_inventory.invalidate()
+
+
+@pytest.fixture
+def no_pipx_home(tmp_path, monkeypatch):
+    """Point HOME and PIPX_HOME somewhere without a pipx venvs directory."""
+    from expand.inventory import pipx_inventory
+
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.setenv("PIPX_HOME", str(tmp_path / "pipx"))
+    pipx_inventory.invalidate()
+    yield tmp_path
+    pipx_inventory.invalidate()
+
+
+def test_pipx_probe(no_pipx_home):
+    from unittest.mock import patch
     from expand.probes import PipxProbe
+    from expand.inventory import pipx_inventory
 
     probe = PipxProbe("cowsay")
 
     # Package found in output
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=0, stdout="cowsay 1.0\nother 2.0\n")
+    with patch("expand.inventory.run_command") as mock_run:
+        pipx_inventory.invalidate()
+        mock_run.return_value = "cowsay 1.0\nother 2.0\n"
         assert probe.is_installed() is True
 
     # Package not found in output
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=0, stdout="other 2.0\n")
+    with patch("expand.inventory.run_command") as mock_run:
+        pipx_inventory.invalidate()
+        mock_run.return_value = "other 2.0\n"
         assert probe.is_installed() is False
 
     # pipx command fails
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=1, stdout="")
+    with patch("expand.inventory.run_command") as mock_run:
+        pipx_inventory.invalidate()
+        mock_run.return_value = None
         assert probe.is_installed() is False
 
     # Empty lines in output — previously crashed with IndexError
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=0, stdout="cowsay 1.0\n\n")
+    with patch("expand.inventory.run_command") as mock_run:
+        pipx_inventory.invalidate()
+        mock_run.return_value = "cowsay 1.0\n\n"
         assert probe.is_installed() is True
 
     # Only empty lines
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=0, stdout="\n\n")
+    with patch("expand.inventory.run_command") as mock_run:
+        pipx_inventory.invalidate()
+        mock_run.return_value = "\n\n"
         assert probe.is_installed() is False
 
 
+def test_pipx_inventory_one_listing_per_round(no_pipx_home, monkeypatch):
+    from expand.probes import PipxProbe
+    from expand.inventory import pipx_inventory, new_round
+
+    tmp_path = no_pipx_home
+    count = tmp_path / "pipx.count"
+    _write_stub_command(tmp_path / "bin", "pipx", f"""
+echo x >> {count}
+printf 'posting 1.0\\ncopyparty 1.2\\n'
+""")
+    monkeypatch.setenv("PATH", str(tmp_path / "bin") + os.pathsep + os.environ["PATH"])
+
+    def invocations():
+        return len(count.read_text().splitlines()) if count.exists() else 0
+
+    probes = [PipxProbe(name) for name in ("posting", "copyparty", "asciinema", "magic-wormhole")] * 5
+    new_round()
+    assert [p.is_installed() for p in probes[:4]] == [True, True, False, False]
+    assert all(p.is_installed() is not None for p in probes)
+    assert invocations() == 1
+
+    # Next round lists again; a playbook touching pipx also invalidates it
+    new_round()
+    PipxProbe("posting").is_installed()
+    assert invocations() == 2
+    pipx_inventory.invalidate()
+    PipxProbe("posting").is_installed()
+    assert invocations() == 3
+
+
+def test_pipx_inventory_reads_venvs_without_spawning(tmp_path, monkeypatch):
+    from unittest.mock import patch
+    from expand.probes import PipxProbe
+    from expand.inventory import pipx_inventory
+
+    venvs = tmp_path / "pipx" / "venvs"
+    (venvs / "posting").mkdir(parents=True)
+    monkeypatch.setenv("PIPX_HOME", str(tmp_path / "pipx"))
+    pipx_inventory.invalidate()
+
+    with patch("expand.inventory.subprocess.Popen", side_effect=AssertionError("spawned pipx")):
+        assert PipxProbe("posting").is_installed() is True
+        assert PipxProbe("copyparty").is_installed() is False
+
+        # A new venv changes the directory's mtime
+        (venvs / "copyparty").mkdir()
+        os.utime(venvs, ns=(0, os.stat(venvs).st_mtime_ns + 10**9))
+        assert PipxProbe("copyparty").is_installed() is True
+
+    pipx_inventory.invalidate()
+
+
 def test_display_probe_darwin():
     from unittest.mock import patch
+    from expand.inventory import HostFacts
     from expand.probes import DisplayProbe
 
-    probe = DisplayProbe()
-
-    # On macOS, always return True even with no DISPLAY env var
-    with patch("expand.probes.platform") as mock_platform, \
+    # On macOS, always a display even with no DISPLAY env var
+    with patch("expand.inventory.platform") as mock_platform, \
          patch.dict("os.environ", {}, clear=True):
         mock_platform.system.return_value = "Darwin"
-        assert probe.is_compatible() is True
+        mock_platform.machine.return_value = "arm64"
+        assert HostFacts.detect().has_display is True
 
-    # On Linux with no display env vars and no session dirs, return False
-    with patch("expand.probes.platform") as mock_platform, \
+    # On Linux with no display env vars and no session dirs, no display
+    with patch("expand.inventory.platform") as mock_platform, \
          patch.dict("os.environ", {}, clear=True), \
-         patch("expand.probes.os.path.isdir", return_value=False):
+         patch("expand.inventory.os.path.isdir", return_value=False):
         mock_platform.system.return_value = "Linux"
-        assert probe.is_compatible() is False
+        mock_platform.machine.return_value = "x86_64"
+        assert HostFacts.detect().has_display is False
+
+    _fake_host(system="Darwin", has_display=True)
+    assert DisplayProbe().is_compatible() is True
+    _fake_host(system="Linux", has_display=False)
+    assert DisplayProbe().is_compatible() is False
+
+
+def test_host_facts_detected_once(monkeypatch):
+    from unittest.mock import patch
+    from expand import inventory
+    from expand.probes import AmdProbe, AptProbe, LinuxProbe
+
+    inventory.set_host_facts(None)
+    with patch.object(inventory.HostFacts, "detect", wraps=inventory.HostFacts.detect) as mock_detect:
+        for _ in range(100):
+            LinuxProbe().is_compatible()
+            AptProbe().is_compatible()
+            AmdProbe().is_compatible()
+        assert mock_detect.call_count == 1
+
+    facts = inventory.host_facts()
+    assert facts.uid == os.getuid() and facts.euid == os.geteuid()
+
+    _fake_host(system="Darwin", machine="arm64", package_managers=frozenset({"brew"}))
+    assert LinuxProbe().is_compatible() is False
+    assert AptProbe().is_compatible() is False
+    assert AmdProbe().is_compatible() is False
 
 
 def test_ansible():
@@ -491,6 +623,199 @@ def test_failure_cache_missing_key(tmp_path, monkeypatch):
     assert FailureCache.has_failed("pkg") is False
 
 
+@pytest.fixture
+def status_cache_catalog(tmp_path, monkeypatch):
+    """
+    An isolated StatusCache and a catalog of three playbooks whose installed
+    probes are CommandProbes on a private PATH. Returns a function that
+    builds fresh Choices for it, like a new run of `expand` would.
+    """
+    from expand.status_cache import StatusCache
+
+    monkeypatch.setattr(StatusCache, "CACHE_FILE", str(tmp_path / "status_cache.json"))
+    (tmp_path / "bin").mkdir()
+    monkeypatch.setenv("PATH", str(tmp_path / "bin"))
+
+    base = tmp_path / "ansible"
+    (base / "tools").mkdir(parents=True)
+    for name, probes in (("git", "[]"), ("tmux", "[]"), ("mac", "[DarwinProbe()]")):
+        _write_expansion_yaml(
+            base / "tools", f"{name}.yaml", privilege="AnyUserNoEscalation()",
+            probes=probes, installed_probes=f'[CommandProbe("{name}")]',
+        )
+
+    def build_choices():
+        expand.inventory.new_round()
+        return _choices_from(base, tmp_path)
+
+    return build_choices
+
+
+def test_status_cache_round_trip(status_cache_catalog, tmp_path, monkeypatch):
+    import json
+    from unittest.mock import patch
+    from expand.evaluator import probe_evaluator
+    from expand.probes import CommandProbe, DarwinProbe
+    from expand.status_cache import StatusCache
+
+    _fake_host(system="Linux")
+    _write_stub_command(tmp_path / "bin", "git", "true\n")
+    choices = status_cache_catalog()
+    probe_evaluator.evaluate(list(choices.values()))
+    StatusCache.save(choices.values())
+
+    entry = json.loads((tmp_path / "status_cache.json").read_text())[StatusCache.host_key()]["playbooks"]
+    assert entry[choices["mac.yaml"].file_path]["failing"] == [0]
+
+    # The next run shows the remembered results without probing anything
+    choices = status_cache_catalog()
+    with patch.object(CommandProbe, "is_installed", side_effect=AssertionError("probed")), \
+         patch.object(DarwinProbe, "is_compatible", side_effect=AssertionError("probed")):
+        assert StatusCache.restore(choices.values()) == 3
+        assert {name: c.installed_status() for name, c in choices.items()} == {
+            "git.yaml": "Installed", "mac.yaml": "Not Installed", "tmux.yaml": "Not Installed",
+        }
+        assert choices["mac.yaml"].failing_probes() == [DarwinProbe()]
+        assert all(c.stale for c in choices.values())
+
+    # Changed probes, another user or an old entry aren't used
+    _write_expansion_yaml(
+        tmp_path / "ansible" / "tools", "tmux.yaml", privilege="AnyUserNoEscalation()",
+        probes="[LinuxProbe()]", installed_probes='[CommandProbe("tmux")]',
+    )
+    assert StatusCache.restore(status_cache_catalog().values()) == 2
+    with patch.object(StatusCache, "host_key", return_value="1234@elsewhere"):
+        assert StatusCache.restore(status_cache_catalog().values()) == 0
+    monkeypatch.setattr(StatusCache, "MAX_AGE", -1)
+    assert StatusCache.restore(status_cache_catalog().values()) == 0
+
+    # A broken cache file is treated as empty
+    (tmp_path / "status_cache.json").write_text("{not json")
+    assert StatusCache.restore(status_cache_catalog().values()) == 0
+
+
+def test_stale_statuses_revalidate_in_background(status_cache_catalog, tmp_path):
+    import time
+    import curses
+    from types import SimpleNamespace
+    from unittest.mock import patch
+    from expand.curses_cli import curses_cli
+    from expand.probes import CommandProbe
+    from expand.status_cache import StatusCache
+
+    _fake_host(system="Linux")
+    choices = status_cache_catalog()
+    StatusCache.save(choices.values())
+
+    # tmux got installed since, and probing is slow this time
+    _write_stub_command(tmp_path / "bin", "tmux", "true\n")
+    is_installed = CommandProbe.is_installed
+
+    def slow_is_installed(probe):
+        time.sleep(0.3)
+        return is_installed(probe)
+
+    choices = status_cache_catalog()
+    cli = SimpleNamespace(workers=4, revalidation=None)
+    with patch.object(CommandProbe, "is_installed", autospec=True, side_effect=slow_is_installed):
+        start = time.monotonic()
+        curses_cli.load_installed_statuses(cli, [("tools", list(choices.values()))])
+        assert time.monotonic() - start < 0.2
+
+        # The first frame shows what the last run saw, dimmed
+        assert choices["tmux.yaml"].installed_status() == "Not Installed"
+        palette = {"NORMAL": 0, "RED": 1, "GREEN": 2, "YELLOW": 3}
+        with patch.dict("expand.gui_elements.expand_color_palette", palette):
+            row = choices["tmux.yaml"].render(120)
+        assert ("Not Installed", 47, 3 | curses.A_DIM) in row
+
+        cli.revalidation.join()
+
+    assert choices["tmux.yaml"].installed_status() == "Installed"
+    assert not any(c.stale for c in choices.values())
+    choices = status_cache_catalog()
+    assert StatusCache.restore(choices.values()) == 3
+    assert choices["tmux.yaml"].installed_status() == "Installed"
+
+
+def test_unremembered_rows_are_checked_in_background(status_cache_catalog, tmp_path):
+    import threading
+    from unittest.mock import patch
+    from expand.curses_cli import curses_cli
+    from expand.gui_elements import Choice
+    from expand.probes import CommandProbe
+    from expand.status_cache import StatusCache
+
+    _fake_host(system="Linux")
+    StatusCache.save(status_cache_catalog().values())
+
+    # A playbook added since the last run
+    _write_expansion_yaml(
+        tmp_path / "ansible" / "tools", "htop.yaml", privilege="AnyUserNoEscalation()",
+        probes="[]", installed_probes='[CommandProbe("htop")]',
+    )
+    _write_stub_command(tmp_path / "bin", "htop", "true\n")
+    is_installed = CommandProbe.is_installed
+    gate = threading.Event()
+
+    def background_is_installed(probe):
+        assert threading.current_thread() is not threading.main_thread(), "probed while drawing"
+        gate.wait(5)
+        return is_installed(probe)
+
+    choices = status_cache_catalog()
+    cli = object.__new__(curses_cli)
+    cli.workers = 4
+    cli.revalidation = None
+    cli.show_hidden = cli.filter_mode = cli.filter_active = False
+    with patch.object(CommandProbe, "is_installed", autospec=True, side_effect=background_is_installed):
+        curses_cli.load_installed_statuses(cli, [("tools", list(choices.values()))])
+
+        # The new row is drawn as being checked, not hidden or probed
+        visible = [choice.name for _, choice in cli.get_visible_choices(list(choices.values()))]
+        assert "htop.yaml" in visible
+        assert choices["htop.yaml"].installed_status() == Choice.CHECKING
+        assert choices["htop.yaml"].stale
+
+        gate.set()
+        cli.revalidation.join()
+
+    assert choices["htop.yaml"].installed_status() == "Installed"
+    assert not any(c.stale for c in choices.values())
+
+
+def test_first_run_is_checked_in_background(status_cache_catalog):
+    import threading
+    from types import SimpleNamespace
+    from unittest.mock import patch
+    from expand.curses_cli import curses_cli
+    from expand.gui_elements import Choice
+    from expand.probes import CommandProbe
+    from expand.status_cache import StatusCache
+
+    _fake_host(system="Linux")
+    is_installed = CommandProbe.is_installed
+    gate = threading.Event()
+
+    def background_is_installed(probe):
+        assert threading.current_thread() is not threading.main_thread(), "probed while drawing"
+        gate.wait(5)
+        return is_installed(probe)
+
+    # Nothing remembered at all: every row is drawn as being checked
+    choices = status_cache_catalog()
+    cli = SimpleNamespace(workers=4, revalidation=None)
+    with patch.object(CommandProbe, "is_installed", autospec=True, side_effect=background_is_installed):
+        curses_cli.load_installed_statuses(cli, [("tools", list(choices.values()))])
+        assert all(c.installed_status() == Choice.CHECKING for c in choices.values())
+
+        gate.set()
+        cli.revalidation.join()
+
+    assert not any(c.stale for c in choices.values())
+    assert StatusCache.restore(status_cache_catalog().values()) == 3
+
+
 # =============================================================================
 # 3B: ExpansionCard Parsing Tests
 # =============================================================================
@@ -514,6 +839,34 @@ def _write_expansion_yaml(tmp_path, filename, privilege, probes, installed_probe
     return str(path)
 
 
+def _write_playbooks(directory, installed_probes: dict, probes="[]"):
+    """
+    Write one AnyUserNoEscalation() playbook into `directory` for each entry
+    of `installed_probes`, which maps a name to its installed probes line.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, line in installed_probes.items():
+        _write_expansion_yaml(
+            directory, f"{name}.yaml",
+            privilege="AnyUserNoEscalation()", probes=probes, installed_probes=line,
+        )
+
+
+def _choices_from(base, tmp_path) -> dict:
+    """
+    A Choice for every playbook under `base`, by file name, built from a
+    catalog index in `tmp_path` the way the TUI builds them.
+    """
+    from expand.catalog_index import CatalogIndex
+    from expand.gui_elements import Choice
+
+    return {
+        entry.name: Choice(entry.name, entry.path, entry)
+        for _, entries in CatalogIndex(str(tmp_path / "index.sqlite3")).scan(str(base))
+        for entry in entries
+    }
+
+
 def test_expansion_card_privilege(tmp_path):
     from expand.expansion_card import ExpansionCard
     from expand.priviledge import OnlyRoot, AnyUserEscalation, AnyUserNoEscalation
@@ -716,6 +1069,1157 @@ def test_expansion_card_with_new_probes(tmp_path):
     assert installed[0].package == "wget"
 
 
+def test_expansion_card_header_parsed_once(tmp_path):
+    from unittest.mock import patch
+    from expand.expansion_card import ExpansionCard, CardHeader
+    from expand.priviledge import AnyUserNoEscalation
+
+    path = _write_expansion_yaml(
+        tmp_path, "header.yaml",
+        privilege="AnyUserNoEscalation()", probes="[LinuxProbe()]",
+        installed_probes='[CommandProbe("git")]',
+        description_lines=["@passphrase First paragraph", "", "Second"],
+        body="- name: test",
+    )
+    card = ExpansionCard(path)
+
+    assert isinstance(card.header, CardHeader)
+    assert isinstance(card.header.priviledge, AnyUserNoEscalation)
+    assert card.header.tags == frozenset({"passphrase"})
+    assert card.header.description == ("@passphrase First paragraph", "", "Second")
+
+    # The header is immutable
+    with pytest.raises(AttributeError):
+        card.header.priviledge = None
+
+    # Accessors never re-evaluate the header
+    with patch("builtins.eval", side_effect=AssertionError("re-evaluated")):
+        assert card.get_priviledge_level() is card.header.priviledge
+        assert card.get_probes()[0] is card.get_probes()[0]
+        assert card.get_installed_probes()[0].command == "git"
+        assert card.requires_passphrase() is True
+        assert card.get_ansible_description(80)[0] == "@passphrase First paragraph"
+
+
+def test_expansion_card_header_errors(tmp_path):
+    from expand.expansion_card import ExpansionCard
+
+    # No header at all
+    no_header = tmp_path / "no_header.yaml"
+    no_header.write_text("- name: test\n")
+    with pytest.raises(LookupError):
+        ExpansionCard(str(no_header))
+
+    # Only a priviledge line
+    one_line = tmp_path / "one_line.yaml"
+    one_line.write_text("# OnlyRoot()\n- name: test\n")
+    with pytest.raises(LookupError):
+        ExpansionCard(str(one_line))
+
+    # First line isn't a priviledge level
+    bad_priv = tmp_path / "bad_priv.yaml"
+    bad_priv.write_text("# []\n# []\n")
+    with pytest.raises(RuntimeError):
+        ExpansionCard(str(bad_priv))
+
+
+def test_probe_compiler_builds_probe_trees():
+    from expand.probe_compiler import compile_expression
+    from expand.probes import AnyProbes, CommandProbe, FileProbe
+    from expand.priviledge import AnyUserNoEscalationOnDarwin
+
+    assert isinstance(compile_expression("AnyUserNoEscalationOnDarwin()"), AnyUserNoEscalationOnDarwin)
+    assert compile_expression("[]") == []
+
+    result = compile_expression('[AnyProbes([CommandProbe("meld"), FileProbe("/Applications/Meld.app")])]')
+    assert isinstance(result[0], AnyProbes)
+    assert isinstance(result[0].probes[0], CommandProbe)
+    assert isinstance(result[0].probes[1], FileProbe)
+    assert result[0].probes[0].command == "meld"
+
+    # Keyword arguments are fine too
+    result = compile_expression('[GrepProbe("/etc/hosts", pattern="lh")]')
+    assert result[0].pattern == "lh"
+
+    # Identical source is compiled once
+    assert compile_expression('[CommandProbe("git")]') is compile_expression('[CommandProbe("git")]')
+
+
+def test_probe_compiler_rejects_non_dsl():
+    from expand.probe_compiler import compile_expression
+
+    rejected = [
+        '__import__("os").system("true")',
+        'os.system("true")',
+        'open("/etc/passwd")',
+        '[CommandProbe("git").__class__]',
+        '[CommandProbe("a" + "b")]',
+        '[CommandProbe(x) for x in "ab"]',
+        'CompatibilityProbe()',
+        'PriviledgeLevel()',
+        '[CommandProbe(**{"command": "git"})]',
+        'OnlyRoot() | AnyUserEscalation()',
+        '[CommandProbe("git")',
+    ]
+    for source in rejected:
+        with pytest.raises(ValueError):
+            compile_expression(source)
+
+
+def test_expansion_card_rejects_code_in_header(tmp_path):
+    from expand.expansion_card import ExpansionCard
+
+    path = _write_expansion_yaml(
+        tmp_path, "evil.yaml",
+        privilege="OnlyRoot()", probes='[__import__("os").system("touch pwned")]',
+        installed_probes="[]",
+    )
+    with pytest.raises(ValueError):
+        ExpansionCard(path)
+    assert not os.path.exists("pwned")
+
+
+def test_expansion_card_header_cached_per_mtime(tmp_path):
+    from expand.expansion_card import ExpansionCard
+
+    path = _write_expansion_yaml(
+        tmp_path, "cached.yaml",
+        privilege="OnlyRoot()", probes="[]", installed_probes='[CommandProbe("git")]',
+    )
+    first = ExpansionCard(path)
+    assert ExpansionCard(path).header is first.header
+
+    # Changing the file (and its mtime) re-parses it
+    _write_expansion_yaml(
+        tmp_path, "cached.yaml",
+        privilege="OnlyRoot()", probes="[]", installed_probes='[CommandProbe("fish")]',
+    )
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    second = ExpansionCard(path)
+    assert second.header is not first.header
+    assert second.get_installed_probes()[0].command == "fish"
+
+
+def test_expansion_card_reads_only_header(tmp_path):
+    from unittest.mock import patch
+    from expand.expansion_card import ExpansionCard
+    from expand.gui_elements import Choice
+
+    path = _write_expansion_yaml(
+        tmp_path, "big.yaml",
+        privilege="OnlyRoot()", probes="[]", installed_probes="[]",
+        description_lines=["desc"],
+        body='- get_url: url="https://example.com"\n' + "# filler\n" * 100000,
+    )
+
+    class CountingFile:
+        """Wraps a file and counts how many characters are read from it."""
+        read_chars = 0
+
+        def __init__(self, file):
+            self.file = file
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.file.close()
+
+        def __iter__(self):
+            for line in self.file:
+                CountingFile.read_chars += len(line)
+                yield line
+
+        def read(self):
+            data = self.file.read()
+            CountingFile.read_chars += len(data)
+            return data
+
+    real_open = open
+    with patch("builtins.open", lambda *a, **kw: CountingFile(real_open(*a, **kw))):
+        card = ExpansionCard(path)
+        assert card.get_ansible_description(80) == ["desc"]
+        assert CountingFile.read_chars < 100
+
+        # The body is read once, when the URLs are needed
+        with patch("expand.util.is_url_up", return_value=True):
+            choice = Choice("big.yaml", path)
+            choice.failing_urls_task.result()
+        assert choice.get_urls() == {"https://example.com"}
+        body_reads = CountingFile.read_chars
+        assert body_reads > 900000
+        choice.has_urls()
+        choice.failing_urls()
+        assert CountingFile.read_chars == body_reads
+
+
+def test_preview_pooled_and_wrap_cached(tmp_path):
+    from unittest.mock import patch, MagicMock
+    from expand.curses_cli import curses_cli
+    from expand.expansion_card import ExpansionCard, wrap_description
+
+    path = _write_expansion_yaml(
+        tmp_path, "preview.yaml",
+        privilege="OnlyRoot()", probes="[]", installed_probes="[]",
+        description_lines=["A description long enough to need wrapping " * 4],
+    )
+    choice = MagicMock()
+    choice.name = "preview.yaml"
+    choice.file_path = path
+    choice.expansion_card = ExpansionCard(path)
+
+    with patch("curses.initscr"):
+        cli = curses_cli(workers=1)
+
+    preview = cli.get_preview(choice)
+    assert cli.get_preview(choice) is preview
+    assert preview.expansion_card is choice.expansion_card
+
+    # A rebuilt Choice gets a fresh preview
+    choice.expansion_card = ExpansionCard(path)
+    assert cli.get_preview(choice) is not preview
+
+    stdscr = MagicMock()
+    wrap_description.cache_clear()
+    with patch("builtins.open", side_effect=AssertionError("file was read")):
+        for _ in range(10):
+            for width in (40, 60, 80):
+                cli.get_preview(choice).draw(stdscr, 0, 0, width, 24)
+
+    # One wrap per width, every other frame is a cache hit
+    info = wrap_description.cache_info()
+    assert info.misses == 3
+    assert info.hits == 27
+
+
+def test_choice_row_render_cached(tmp_path):
+    from unittest.mock import patch, MagicMock
+    from expand.gui_elements import Choice
+
+    path = _write_expansion_yaml(
+        tmp_path, "row.yaml",
+        privilege="OnlyRoot()", probes="[]", installed_probes="[]",
+        description_lines=["desc"],
+    )
+    palette = {"NORMAL": 0, "RED": 1, "GREEN": 2, "YELLOW": 3}
+
+    _fake_host(uid=0, euid=0)
+    with patch.dict("expand.gui_elements.expand_color_palette", palette), \
+         patch("expand.inventory.host_facts", wraps=expand.inventory.host_facts) as mock_host_facts:
+        choice = Choice("row.yaml", path)
+        choice.failing_urls_task.result()
+
+        row = choice.render(100)
+        assert [text for text, _, _ in row][:2] == ["☐ ", "row.yaml"]
+        assert ("OnlyRoot", 26, 2) in row
+
+        # Nothing changed → the very same row, nothing recomputed
+        with patch.object(choice, "failing_probes", side_effect=AssertionError("recomputed")):
+            assert choice.render(100) is row
+        assert mock_host_facts.call_count == 1
+
+        # Hover, width and status changes rebuild it
+        choice.set_hover(True)
+        hovered = choice.render(100)
+        assert hovered is not row
+        assert choice.render(120) is not hovered
+        choice.set_hover(False)
+        choice._installed_status = "Installed"
+        assert ("Installed", 47, 2) in choice.render(120)
+        assert mock_host_facts.call_count == 1
+
+    # draw just blits the cached row
+    stdscr = MagicMock()
+    choice.draw(stdscr, 3, 5, 120)
+    assert stdscr.addstr.call_count == len(Choice.ORDER)
+    stdscr.addstr.assert_any_call(3, 5 + 2, "row.yaml", choice.render(120)[1][2])
+
+
+def _write_catalog(tmp_path):
+    """Helper that writes a small ansible/ tree with two categories."""
+    base = tmp_path / "ansible"
+    (base / "heavy").mkdir(parents=True)
+    (base / "trinkets").mkdir()
+    (base / ".hidden").mkdir()
+    _write_expansion_yaml(
+        base / "heavy", "docker.yaml",
+        privilege="OnlyRoot()", probes="[]", installed_probes='[CommandProbe("docker")]',
+        description_lines=["Docker"], body='- get_url: url="https://get.docker.com"',
+    )
+    _write_expansion_yaml(
+        base / "trinkets", "bat.yaml",
+        privilege="AnyUserNoEscalation()", probes="[]", installed_probes='[CommandProbe("bat")]',
+        description_lines=["bat"],
+    )
+    _write_expansion_yaml(
+        base / "trinkets", "age.yaml",
+        privilege="AnyUserNoEscalation()", probes="[]", installed_probes="[]",
+    )
+    return base
+
+
+def test_catalog_index_scan(tmp_path):
+    from expand.catalog_index import CatalogIndex
+
+    base = _write_catalog(tmp_path)
+    categories = CatalogIndex(str(tmp_path / "index.sqlite3")).scan(str(base))
+
+    assert [name for name, _ in categories] == ["heavy", "trinkets"]
+    heavy, trinkets = categories[0][1], categories[1][1]
+    assert [e.name for e in trinkets] == ["age.yaml", "bat.yaml"]
+    assert heavy[0].comments[0] == "# OnlyRoot()"
+    assert heavy[0].urls == frozenset({"https://get.docker.com"})
+    assert trinkets[1].urls == frozenset()
+
+
+def test_catalog_index_only_rereads_changed_files(tmp_path):
+    from unittest.mock import patch
+    from expand import catalog_index
+    from expand.catalog_index import CatalogIndex
+
+    base = _write_catalog(tmp_path)
+    index = CatalogIndex(str(tmp_path / "index.sqlite3"))
+    first = index.scan(str(base))
+
+    # Nothing changed → no file is opened at all
+    with patch("builtins.open", side_effect=AssertionError("file was read")):
+        assert index.scan(str(base)) == first
+
+    # Touched but identical → read and hashed, but not re-parsed
+    bat = base / "trinkets" / "bat.yaml"
+    os.utime(bat, ns=(0, os.stat(bat).st_mtime_ns + 10**9))
+    with patch.object(catalog_index, "read_entry", wraps=catalog_index.read_entry) as mock_read:
+        categories = index.scan(str(base))
+        mock_read.assert_not_called()
+    assert categories[1][1][1].stamp == (os.stat(bat).st_mtime_ns, os.stat(bat).st_size)
+    assert categories[1][1][1]._replace(stamp=None) == first[1][1][1]._replace(stamp=None)
+
+    # Real change → only that file is re-parsed
+    bat.write_text(bat.read_text().replace('"bat"', '"batcat"'))
+    os.utime(bat, ns=(0, os.stat(bat).st_mtime_ns + 2 * 10**9))
+    with patch.object(catalog_index, "read_entry", wraps=catalog_index.read_entry) as mock_read:
+        categories = index.scan(str(base))
+        assert mock_read.call_count == 1
+    assert 'CommandProbe("batcat")' in categories[1][1][1].comments[2]
+
+    # Deleted files drop out of the catalog
+    (base / "heavy" / "docker.yaml").unlink()
+    assert index.scan(str(base))[0] == ("heavy", [])
+
+
+def test_catalog_index_survives_bad_index_file(tmp_path):
+    import sqlite3
+    from expand.catalog_index import CatalogIndex
+
+    base = _write_catalog(tmp_path)
+
+    # Garbage index file → catalog still loads
+    bad = tmp_path / "bad.sqlite3"
+    bad.write_bytes(b"not a database" * 100)
+    categories = CatalogIndex(str(bad)).scan(str(base))
+    assert len(categories[1][1]) == 2
+
+    # Old schema version → rebuilt
+    old = tmp_path / "old.sqlite3"
+    connection = sqlite3.connect(str(old))
+    connection.execute("CREATE TABLE playbooks (path TEXT)")
+    connection.execute("PRAGMA user_version = 0")
+    connection.commit()
+    connection.close()
+    index = CatalogIndex(str(old))
+    assert index.scan(str(base)) == index.scan(str(base))
+
+
+def test_url_checks_share_a_bounded_pool(tmp_path):
+    import threading
+    from unittest.mock import patch
+    from expand.gui_elements import Choice
+    from expand.url_checker import UrlChecker
+
+    paths = [
+        _write_expansion_yaml(
+            tmp_path, f"tool{i}.yaml", privilege="OnlyRoot()", probes="[]", installed_probes="[]",
+            body=f"- get_url: url=https://example.com/tool{i}\n- get_url: url=https://example.com/dead{i}",
+        )
+        for i in range(40)
+    ]
+
+    gate = threading.Event()
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def is_url_up(url, session=None):
+        with lock:
+            running.append(url)
+            peak.append(len(running))
+        gate.wait()
+        with lock:
+            running.remove(url)
+        return "dead" not in url
+
+    checker = UrlChecker(workers=3)
+    with patch("expand.gui_elements.url_checker", checker), \
+         patch("expand.util.is_url_up", side_effect=is_url_up):
+        choices = [Choice(os.path.basename(path), path) for path in paths]
+
+        # Nothing is done yet, and only three threads exist for 40 playbooks
+        assert all(choice.get_url_cell() == ("-", "YELLOW") for choice in choices)
+        assert sum(thread.name == "url-check" for thread in checker._threads) == 3
+
+        gate.set()
+        assert [choice.failing_urls() for choice in choices][7] == ["https://example.com/dead7"]
+        assert all(choice.get_url_cell() == ("✘", "RED") for choice in choices)
+
+    assert max(peak) <= 3
+
+    # Queued checks can be dropped, e.g. on quit
+    gate.clear()
+    with patch("expand.util.is_url_up", side_effect=is_url_up):
+        futures = [checker.submit({f"https://example.com/{i}"}) for i in range(10)]
+        checker.cancel()
+        gate.set()
+        assert sum(future.cancelled() for future in futures) >= 7
+
+
+def test_normalize_url():
+    from expand.util import normalize_url
+
+    assert normalize_url("HTTPS://Get.Docker.com:443#install") == "https://get.docker.com/"
+    assert normalize_url("https://get.docker.com") == "https://get.docker.com/"
+    assert normalize_url("http://example.com:8080/a?b=C") == "http://example.com:8080/a?b=C"
+    assert normalize_url("https://user@Example.com/Path") == "https://user@example.com/Path"
+    assert normalize_url("http://[::1]:80/") == "http://[::1]/"
+    assert normalize_url("https://example.com:port/") == "https://example.com:port/"
+
+
+def test_url_checks_shared_across_playbooks(tmp_path, caplog, fresh_url_checker):
+    import logging
+    from unittest.mock import patch
+    from expand.gui_elements import Choice
+
+    shared = ["https://get.docker.com", "https://Get.Docker.com:443/#script", "https://github.com/down"]
+    paths = [
+        _write_expansion_yaml(
+            tmp_path, f"tool{i}.yaml", privilege="OnlyRoot()", probes="[]", installed_probes="[]",
+            body="\n".join(f"- get_url: url={url}" for url in shared + [f"https://example.com/tool{i}"]),
+        )
+        for i in range(20)
+    ]
+
+    with patch("expand.util.is_url_up", side_effect=lambda url, session=None: "down" not in url) as mock_is_url_up:
+        choices = [Choice(os.path.basename(path), path) for path in paths]
+        assert choices[3].failing_urls() == ["https://github.com/down"]
+        assert all(choice.failing_urls() == ["https://github.com/down"] for choice in choices)
+
+    # get.docker.com and github.com once, plus one example.com URL per playbook
+    assert mock_is_url_up.call_count == 22
+    checked = [call.args[0] for call in mock_is_url_up.call_args_list]
+    assert sorted(url for url in checked if "example.com" not in url) == [
+        "https://get.docker.com/", "https://github.com/down",
+    ]
+
+    with caplog.at_level(logging.DEBUG):
+        fresh_url_checker.log_dedup()
+    assert "80 URL uses, 22 distinct (3.6x dedup)" in caplog.text
+
+
+def test_url_checks_reuse_connections(monkeypatch):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from expand import util
+    from expand.url_checker import UrlChecker, new_session
+
+    connections = []
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_HEAD(self):
+            requests_seen.append(self.path)
+            if self.path == "/old":
+                self.send_response(301)
+                self.send_header("Location", "/new")
+            else:
+                self.send_response(200 if self.path != "/missing" else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(util, "_moved_urls", {})
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    try:
+        # Each worker keeps one connection alive per host
+        checker = UrlChecker(workers=3)
+        urls = [f"{base}/tool{i}" for i in range(30)] + [f"{base}/missing"]
+        assert checker.submit(urls).result() == [f"{base}/missing"]
+        assert 1 <= len(connections) <= 3
+
+        session = new_session()
+        connections.clear()
+        assert util.is_url_up(f"{base}/old", session)
+        assert util.is_url_up(f"{base}/old", session)
+        session.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # The permanent redirect is only followed once, on one connection
+    assert len(connections) == 1
+    assert requests_seen[-3:] == ["/old", "/new", "/new"]
+
+
+def test_choice_from_catalog_entry_does_not_read_file(tmp_path):
+    from unittest.mock import patch
+    from expand.catalog_index import CatalogIndex
+    from expand.gui_elements import Choice
+
+    base = _write_catalog(tmp_path)
+    entry = CatalogIndex(str(tmp_path / "index.sqlite3")).scan(str(base))[0][1][0]
+
+    with patch("builtins.open", side_effect=AssertionError("file was read")), \
+         patch("expand.util.is_url_up", return_value=True):
+        choice = Choice(entry.name, entry.path, entry)
+        choice.failing_urls_task.result()
+        assert choice.has_urls() is True
+        assert choice.failing_urls() == []
+        assert choice.expansion_card.get_installed_probes()[0].command == "docker"
+
+
+def test_indexed_headers_share_the_header_cache(tmp_path):
+    from unittest.mock import patch
+    from expand.catalog_index import CatalogIndex
+    from expand.expansion_card import ExpansionCard
+    from expand.gui_elements import Choice
+
+    base = _write_catalog(tmp_path)
+    index = CatalogIndex(str(tmp_path / "index.sqlite3"))
+    entry = index.scan(str(base))[0][1][0]
+    first = Choice(entry.name, entry.path, entry)
+
+    # Unchanged playbooks aren't parsed again, from the index or the file
+    with patch("expand.expansion_card.parse_header", side_effect=AssertionError("parsed again")):
+        entry = index.scan(str(base))[0][1][0]
+        assert Choice(entry.name, entry.path, entry).expansion_card.header is first.expansion_card.header
+        assert ExpansionCard(entry.path).header is first.expansion_card.header
+
+
+def test_probes_compare_by_value():
+    from expand.probes import AllProbes, AnyProbes, CommandProbe, FileProbe, LinuxProbe, GrepProbe
+
+    assert CommandProbe("git") == CommandProbe("git")
+    assert CommandProbe("git") != CommandProbe("tmux")
+    assert LinuxProbe() == LinuxProbe()
+    assert len({CommandProbe("git"), CommandProbe("git"), LinuxProbe(), LinuxProbe()}) == 2
+    assert GrepProbe("/etc/hosts", "lh") == GrepProbe("/etc/hosts", pattern="lh")
+
+    nested = AnyProbes([CommandProbe("meld"), FileProbe("/Applications/Meld.app")])
+    assert nested == AnyProbes([CommandProbe("meld"), FileProbe("/Applications/Meld.app")])
+    assert hash(nested) == hash(AnyProbes([CommandProbe("meld"), FileProbe("/Applications/Meld.app")]))
+    assert nested != AllProbes([CommandProbe("meld"), FileProbe("/Applications/Meld.app")])
+    assert repr(CommandProbe("git")) == "CommandProbe('git')"
+
+
+def test_probe_evaluator_evaluates_each_distinct_probe_once(tmp_path, caplog):
+    import logging
+    from unittest.mock import patch
+    from expand.evaluator import probe_evaluator
+    from expand.probes import CommandProbe, LinuxProbe
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {
+        f"tool{i}": f'[CommandProbe("sh"), AnyProbes([CommandProbe("tool{i % 3}"), CommandProbe("sh")])]'
+        for i in range(30)
+    }, probes="[LinuxProbe()]")
+
+    with patch.object(LinuxProbe, "is_compatible", autospec=True, return_value=True) as mock_compatible, \
+         patch.object(CommandProbe, "is_installed", autospec=True, side_effect=lambda p: p.command == "sh") as mock_installed:
+        choices = list(_choices_from(base, tmp_path).values())
+        with caplog.at_level(logging.DEBUG):
+            probe_evaluator.evaluate(choices, workers=4)
+
+        assert mock_compatible.call_count == 1
+        # CommandProbe("sh") plus tool0..tool2
+        assert mock_installed.call_count == 4
+        assert all(choice.installed_status() == "Installed" for choice in choices)
+        assert all(choice.failing_probes() == [] for choice in choices)
+
+    assert "120 probe uses, 5 distinct (24.0x dedup)" in caplog.text
+
+
+def test_probes_declare_observed_resources():
+    from expand.probes import (
+        AnyProbes, AptPackageProbe, CommandProbe, FileProbe, GrepProbe, LinuxProbe, WhichProbe,
+    )
+
+    assert LinuxProbe().observes() == (("host",),)
+    assert WhichProbe("git").observes() == (("command", "git"),)
+    assert AptPackageProbe("git").observes() == (("dpkg",),)
+    assert FileProbe("/etc/hosts").observes() == (("path", "/etc/hosts"),)
+    assert FileProbe("/Applications/*.app").observes() == (("dir", "/Applications"),)
+    assert FileProbe("/*/bin/*").observes() == (("volatile",),)
+    assert GrepProbe("/etc/hosts", "lh").observes() == (("path", "/etc/hosts"),)
+    assert AnyProbes([CommandProbe("meld"), CommandProbe("meld"), FileProbe("/x")]).observes() == (
+        ("command", "meld"), ("path", "/x"),
+    )
+
+
+def test_probe_evaluator_refresh_only_reevaluates_affected_probes(tmp_path, monkeypatch):
+    from unittest.mock import patch
+    from expand.evaluator import probe_evaluator
+    from expand.probes import CommandProbe, FileProbe
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", str(bin_dir))
+    config = tmp_path / "config"
+    config.mkdir()
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {
+        **{f"dotfile{i}": f'[FileProbe("{config}/dotfile{i}")]' for i in range(20)},
+        "tool": '[CommandProbe("tool")]',
+    })
+
+    by_name = _choices_from(base, tmp_path)
+    choices = list(by_name.values())
+    probe_evaluator.evaluate(choices)
+    assert all(choice.installed_status() == "Not Installed" for choice in choices)
+
+    # "Install" one dotfile: only its probe is evaluated again
+    (config / "dotfile3").write_text("")
+    file_probe = FileProbe.is_installed
+    command_probe = CommandProbe.is_installed
+    with patch.object(FileProbe, "is_installed", autospec=True, side_effect=file_probe) as mock_file, \
+         patch.object(CommandProbe, "is_installed", autospec=True, side_effect=command_probe) as mock_command:
+        probe_evaluator.refresh(choices)
+        assert mock_file.call_count == 1
+        assert mock_command.call_count == 0
+        assert by_name["dotfile3.yaml"].installed_status() == "Installed"
+        assert by_name["dotfile4.yaml"].installed_status() == "Not Installed"
+
+        # "Install" a command: only command probes are evaluated again
+        _write_stub_command(bin_dir, "tool", "true\n")
+        os.utime(bin_dir, ns=(0, os.stat(bin_dir).st_mtime_ns + 10**9))
+        probe_evaluator.refresh(choices)
+        assert mock_file.call_count == 1
+        assert mock_command.call_count == 1
+        assert by_name["tool.yaml"].installed_status() == "Installed"
+
+
+def test_refreshing_some_rows_keeps_others_refreshable(tmp_path, monkeypatch):
+    from expand.evaluator import probe_evaluator
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", str(bin_dir))
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {"foo": '[CommandProbe("foo")]', "bar": '[CommandProbe("bar")]'})
+    choices = _choices_from(base, tmp_path)
+    probe_evaluator.evaluate(list(choices.values()))
+
+    def install(name, seconds):
+        _write_stub_command(bin_dir, name, "true\n")
+        os.utime(bin_dir, ns=(0, os.stat(bin_dir).st_mtime_ns + seconds * 10**9))
+
+    # Each change to PATH drops both command probes, but only the row the
+    # watcher found dirty is refreshed
+    install("bar", 1)
+    probe_evaluator.refresh([choices["bar.yaml"]])
+    assert choices["bar.yaml"].installed_status() == "Installed"
+
+    install("foo", 2)
+    probe_evaluator.refresh([choices["foo.yaml"]])
+    assert choices["foo.yaml"].installed_status() == "Installed"
+    assert not choices["foo.yaml"].stale
+
+
+def test_probe_engine_runs_package_manager_commands_concurrently(tmp_path, monkeypatch, no_pipx_home):
+    from expand import inventory
+    from expand.evaluator import probe_evaluator
+
+    # Every command logs when it starts (+) and ends (-)
+    log = tmp_path / "commands.log"
+    bin_dir = tmp_path / "bin"
+    _write_stub_command(
+        bin_dir, "brew", f"echo + >> {log}\nsleep 0.3\necho - >> {log}\n[ \"$2\" = --formula ] && echo wget\nexit 0\n",
+    )
+    _write_stub_command(bin_dir, "pipx", f"echo + >> {log}\nsleep 0.3\necho - >> {log}\necho 'posting 1.0'\n")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {
+        "wget": '[BrewPackageProbe("wget")]',
+        "docker": '[BrewPackageProbe("docker")]',
+        "posting": '[PipxProbe("posting")]',
+        "hosts": '[FileProbe("/etc/hosts"), CommandProbe("sh")]',
+    })
+    choices = list(_choices_from(base, tmp_path).values())
+
+    def peak_commands(workers):
+        inventory.new_round()
+        inventory.brew_inventory.invalidate()
+        inventory.pipx_inventory.invalidate()
+        for choice in choices:
+            choice.clear_probe_results()
+        log.write_text("")
+        probe_evaluator.evaluate(choices, workers)
+
+        running = peak = 0
+        for line in log.read_text().split():
+            running += 1 if line == "+" else -1
+            peak = max(peak, running)
+        return peak
+
+    # Two `brew list` and one `pipx list` at once
+    assert peak_commands(workers=3) == 3
+    statuses = {choice.name: choice.installed_status() for choice in choices}
+    assert statuses == {
+        "docker.yaml": "Not Installed",
+        "hosts.yaml": "Installed",
+        "posting.yaml": "Installed",
+        "wget.yaml": "Installed",
+    }
+
+    # One at a time
+    assert peak_commands(workers=1) == 1
+
+
+def test_composites_evaluate_cheapest_first(stub_brew, tmp_path):
+    import itertools
+    from expand import inventory
+    from expand.probes import AllProbes, AnyProbes, BrewPackageProbe, FileProbe, LinuxProbe, by_cost
+
+    present = FileProbe(str(stub_brew))
+    missing = FileProbe(str(tmp_path / "missing"))
+    brew = BrewPackageProbe("wget")
+    assert by_cost([brew, missing, LinuxProbe()]) == [LinuxProbe(), missing, brew]
+
+    before = inventory.command_counts["brew"]
+    assert AnyProbes([brew, present]).is_installed() is True
+    assert AllProbes([brew, missing]).is_installed() is False
+    assert AllProbes([brew, AnyProbes([missing, present])]).is_installed() is True
+    assert inventory.command_counts["brew"] == before + 2
+
+    # Same results as evaluating in declaration order
+    for children in itertools.permutations([brew, present, missing, BrewPackageProbe("mtmr")], 3):
+        assert AllProbes(list(children)).is_installed() is all(c.is_installed() for c in children)
+        assert AnyProbes(list(children)).is_installed() is any(c.is_installed() for c in children)
+
+
+def test_probe_engine_skips_commands_that_cannot_matter(stub_brew, tmp_path):
+    from expand import inventory
+    from expand.evaluator import probe_evaluator
+
+    base = tmp_path / "ansible"
+    missing = tmp_path / "missing"
+    _write_playbooks(base / "mac", {
+        f"app{i}": f'[BrewPackageProbe("wget"), FileProbe("{missing}{i}")]' for i in range(10)
+    })
+    choices = list(_choices_from(base, tmp_path).values())
+
+    before = inventory.command_counts.copy()
+    probe_evaluator.evaluate(choices)
+    assert all(choice.installed_status() == "Not Installed" for choice in choices)
+    assert inventory.command_counts == before
+    assert not stub_brew.exists()
+
+    # Once a cheap probe passes, brew is needed, and runs once per kind
+    (tmp_path / "missing3").write_text("")
+    probe_evaluator.refresh(choices)
+    assert {c.name: c.installed_status() for c in choices}["app3.yaml"] == "Installed"
+    assert inventory.command_counts["brew"] - before["brew"] == 2
+
+
+def test_probes_waiting_on_brew_read_what_was_just_loaded(stub_brew, tmp_path):
+    import itertools
+    from unittest.mock import patch
+    from expand import inventory
+    from expand.evaluator import probe_evaluator
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "mac", {
+        "wget": '[BrewPackageProbe("wget")]', "docker": '[BrewPackageProbe("docker")]',
+        "mtmr": '[BrewPackageProbe("mtmr")]',
+    })
+    choices = _choices_from(base, tmp_path)
+
+    # The Cellar keeps changing, e.g. brew is upgrading something: reloading
+    # in the probes would run brew again, blocking the event loop
+    stamps = itertools.count()
+    with patch.object(inventory.BrewInventory, "stamp", autospec=True, side_effect=lambda self: next(stamps)), \
+         patch.object(inventory, "run_command", side_effect=AssertionError("blocking command")):
+        probe_evaluator.evaluate(list(choices.values()))
+
+    assert {name: c.installed_status() for name, c in choices.items()} == {
+        "wget.yaml": "Installed", "docker.yaml": "Installed", "mtmr.yaml": "Not Installed",
+    }
+    assert stub_brew.read_text().splitlines() == ["list --formula -1", "list --cask -1"]
+
+
+@pytest.fixture
+def hanging_package_managers(tmp_path, monkeypatch, no_pipx_home):
+    """
+    `brew` and `pipx` stubs that never finish, and a catalog that needs
+    them plus one playbook that doesn't. Returns the Choices by name.
+    """
+    from expand import inventory
+
+    bin_dir = tmp_path / "bin"
+    _write_stub_command(bin_dir, "brew", f"echo x >> {tmp_path / 'brew.count'}\nexec sleep 1000\n")
+    # Not exec'd, so killing the command must kill its children too
+    _write_stub_command(bin_dir, "pipx", "sleep 1000\n")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    inventory.brew_inventory.invalidate()
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {
+        "wget": '[BrewPackageProbe("wget")]',
+        "posting": '[PipxProbe("posting")]',
+        "hosts": '[FileProbe("/etc/hosts")]',
+    })
+    yield _choices_from(base, tmp_path)
+    inventory.brew_inventory.invalidate()
+
+
+def test_hanging_commands_time_out(hanging_package_managers, tmp_path, monkeypatch):
+    import time
+    from expand import inventory
+    from expand.evaluator import probe_evaluator
+
+    choices = hanging_package_managers
+    monkeypatch.setattr(inventory, "COMMAND_TIMEOUT", 0.3)
+
+    start = time.monotonic()
+    probe_evaluator.evaluate(list(choices.values()))
+    assert time.monotonic() - start < 2.0
+
+    assert {name: c.installed_status() for name, c in choices.items()} == {
+        "hosts.yaml": "Installed",
+        "posting.yaml": "Timed out",
+        "wget.yaml": "Timed out",
+    }
+    assert choices["wget.yaml"].get_installed_cell() == ("Timed out", "MAGENTA")
+    assert not inventory._running
+
+    # The rest of the round doesn't wait on brew again...
+    count = tmp_path / "brew.count"
+    assert len(count.read_text().splitlines()) == 2
+    with pytest.raises(inventory.ProbeTimeout):
+        inventory.brew_inventory.get()
+    assert len(count.read_text().splitlines()) == 2
+
+    # ...but the next one retries it
+    probe_evaluator.refresh(list(choices.values()))
+    assert choices["wget.yaml"].installed_status() == "Timed out"
+    assert len(count.read_text().splitlines()) == 4
+
+
+def test_probe_round_deadline(hanging_package_managers):
+    import time
+    from expand import inventory
+    from expand.evaluator import probe_evaluator
+
+    choices = hanging_package_managers
+
+    start = time.monotonic()
+    probe_evaluator.evaluate(list(choices.values()), deadline=0.3)
+    assert time.monotonic() - start < 2.0
+
+    assert {name: c.installed_status() for name, c in choices.items()} == {
+        "hosts.yaml": "Installed",
+        "posting.yaml": "Timed out",
+        "wget.yaml": "Timed out",
+    }
+    assert not inventory._running
+
+
+def test_cancel_kills_running_probe_commands(hanging_package_managers):
+    import time
+    import threading
+    from expand import inventory
+    from expand.evaluator import probe_evaluator
+
+    choices = hanging_package_managers
+    evaluation = threading.Thread(target=probe_evaluator.evaluate, args=(list(choices.values()),))
+    evaluation.start()
+    while len(inventory._running) < 3:
+        time.sleep(0.01)
+
+    # What quitting the TUI does
+    probe_evaluator.cancel()
+    evaluation.join(timeout=2.0)
+    assert not evaluation.is_alive()
+    assert choices["wget.yaml"].installed_status() == "Timed out"
+    assert choices["hosts.yaml"].installed_status() == "Installed"
+
+
+def test_blocking_commands_are_killed_with_their_children(no_pipx_home, monkeypatch):
+    import time
+    import threading
+    from expand import inventory
+    from expand.probes import PipxProbe
+
+    tmp_path = no_pipx_home
+    pids = tmp_path / "pids"
+    # Not exec'd: the sleep is a child of the command, not the command
+    _write_stub_command(tmp_path / "bin", "pipx", f"sleep 1000 &\necho $! >> {pids}\nwait\n")
+    monkeypatch.setenv("PATH", str(tmp_path / "bin") + os.pathsep + os.environ["PATH"])
+
+    def children_alive():
+        # SIGKILL is delivered asynchronously; give the children a moment
+        for _ in range(200):
+            alive = []
+            for pid in pids.read_text().split():
+                try:
+                    with open(f"/proc/{pid}/stat") as stat:
+                        alive.append(stat.read().split(") ")[1][0] != "Z")
+                except FileNotFoundError:
+                    alive.append(False)
+            if not any(alive):
+                return False
+            time.sleep(0.01)
+        return True
+
+    # What drawing a row with no status yet does, on the calling thread
+    monkeypatch.setattr(inventory, "COMMAND_TIMEOUT", 0.3)
+    with pytest.raises(inventory.ProbeTimeout):
+        PipxProbe("posting").is_installed()
+    assert not inventory._running
+    assert not children_alive()
+
+    # Quitting stops it too
+    monkeypatch.setattr(inventory, "COMMAND_TIMEOUT", 60)
+    inventory.pipx_inventory.invalidate()
+    inventory.new_round()
+    probe = threading.Thread(target=PipxProbe("posting").is_installed)
+    probe.start()
+    while not inventory._running:
+        time.sleep(0.01)
+    inventory.kill_commands()
+    probe.join(timeout=2.0)
+    assert not probe.is_alive()
+    assert not children_alive()
+    inventory.pipx_inventory.invalidate()
+
+
+def _watched_resources(tmp_path):
+    """Resources of every kind a watcher should notice changes to."""
+    return {
+        "file": ("path", str(tmp_path / "a" / "file")),
+        "dir": ("dir", str(tmp_path / "b")),
+        "command": ("command", "tool"),
+        "missing": ("path", str(tmp_path / "missing" / "deep" / "file")),
+        "volatile": ("volatile",),
+    }
+
+
+def _check_watcher(watcher, tmp_path):
+    resources = _watched_resources(tmp_path)
+    assert watcher.changed() == set()
+
+    (tmp_path / "a" / "other").write_text("")
+    assert watcher.changed() == set()
+    (tmp_path / "a" / "file").write_text("changed")
+    assert watcher.changed() == {resources["file"]}
+
+    (tmp_path / "b" / "new").write_text("")
+    _write_stub_command(tmp_path / "bin", "tool", "true\n")
+    assert watcher.changed() == {resources["dir"], resources["command"]}
+
+    # Directories that appear later are picked up too
+    (tmp_path / "missing" / "deep").mkdir(parents=True)
+    watcher.changed()
+    (tmp_path / "missing" / "deep" / "file").write_text("")
+    assert resources["missing"] in watcher.changed()
+    watcher.close()
+
+
+@pytest.fixture
+def watched_tree(tmp_path, monkeypatch):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "file").write_text("")
+    (tmp_path / "b").mkdir()
+    (tmp_path / "bin").mkdir()
+    monkeypatch.setenv("PATH", str(tmp_path / "bin"))
+    return _watched_resources(tmp_path)
+
+
+def test_inotify_watcher(watched_tree, tmp_path):
+    from expand.watcher import InotifyWatcher
+
+    _check_watcher(InotifyWatcher(watched_tree.values()), tmp_path)
+
+
+def test_polling_watcher(watched_tree, tmp_path, monkeypatch):
+    from expand.watcher import PollingWatcher
+
+    monkeypatch.setattr(PollingWatcher, "INTERVAL", 0)
+    _check_watcher(PollingWatcher(watched_tree.values()), tmp_path)
+
+
+def test_watched_changes_reprobe_only_dirty_rows(tmp_path, monkeypatch):
+    import threading
+    from unittest.mock import patch
+    from expand.curses_cli import curses_cli
+    from expand.evaluator import probe_evaluator
+    from expand.probes import CommandProbe, FileProbe
+    from expand.status_cache import StatusCache
+
+    monkeypatch.setattr(StatusCache, "CACHE_FILE", str(tmp_path / "status_cache.json"))
+    (tmp_path / "bin").mkdir()
+    monkeypatch.setenv("PATH", str(tmp_path / "bin"))
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {
+        "git": '[CommandProbe("git")]',
+        "tmux": '[CommandProbe("tmux")]',
+        "hosts": f'[FileProbe("{tmp_path / "hosts"}")]',
+    })
+    choices = _choices_from(base, tmp_path)
+    categories = [("tools", list(choices.values()))]
+    probe_evaluator.evaluate(list(choices.values()))
+
+    # Not a real TUI: just the state the watcher needs
+    cli = object.__new__(curses_cli)
+    cli.workers = 4
+    cli.revalidation = None
+    cli.watch_installed_statuses(categories)
+
+    # tmux installed from another terminal
+    _write_stub_command(tmp_path / "bin", "tmux", "true\n")
+    with patch.object(CommandProbe, "is_installed", autospec=True, wraps=CommandProbe.is_installed) as commands, \
+         patch.object(FileProbe, "is_installed", autospec=True, wraps=FileProbe.is_installed) as files:
+        cli.check_watched_resources(categories)
+        cli.revalidation.join()
+
+    assert [call.args[0] for call in commands.call_args_list] == [CommandProbe("tmux")]
+    assert files.call_count == 0
+    assert {name: c.installed_status() for name, c in choices.items()} == {
+        "git.yaml": "Not Installed", "hosts.yaml": "Not Installed", "tmux.yaml": "Installed",
+    }
+
+    # While a row is re-probed it keeps its old result instead of probing
+    # on the drawing thread
+    is_installed = FileProbe.is_installed
+    probing, gate = threading.Event(), threading.Event()
+
+    def background_is_installed(probe):
+        assert threading.current_thread() is not threading.main_thread(), "probed while drawing"
+        probing.set()
+        gate.wait(5)
+        return is_installed(probe)
+
+    (tmp_path / "hosts").write_text("")
+    with patch.object(FileProbe, "is_installed", autospec=True, side_effect=background_is_installed):
+        cli.check_watched_resources(categories)
+        assert probing.wait(5)
+        assert choices["hosts.yaml"].installed_status() == "Not Installed"
+        assert choices["hosts.yaml"].stale
+        gate.set()
+        cli.revalidation.join()
+    assert choices["hosts.yaml"].installed_status() == "Installed"
+    assert not choices["hosts.yaml"].stale
+    cli.watcher.close()
+
+
+def test_probe_profile_reports_slowest_probes_and_playbooks(stub_brew, tmp_path, capsys):
+    import json
+    import time
+    from unittest.mock import patch
+    from expand.evaluator import probe_evaluator
+    from expand.probe_profile import ProbeProfile, write_report
+    from expand.probes import CommandProbe
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {
+        "slow": '[CommandProbe("slow")]',
+        **{f"fast{i}": '[CommandProbe("fast"), BrewPackageProbe("wget")]' for i in range(5)},
+    }, probes="[LinuxProbe()]")
+
+    def is_installed(probe):
+        if probe.command == "slow":
+            time.sleep(0.2)
+        return True
+
+    profile = probe_evaluator.profile = ProbeProfile()
+    try:
+        choices = list(_choices_from(base, tmp_path).values())
+        with patch.object(CommandProbe, "is_installed", autospec=True, side_effect=is_installed):
+            probe_evaluator.evaluate(choices)
+    finally:
+        probe_evaluator.profile = None
+
+    report = profile.report()
+    slowest = report["slowest_probes"][0]
+    assert (slowest["kind"], slowest["probe"]) == ("installed", "CommandProbe('slow')")
+    assert slowest["evaluations"] == 1 and slowest["seconds"] >= 0.2
+    assert report["playbooks"][0]["name"] == "slow.yaml"
+    assert len(report["playbooks"]) == 6
+
+    # Six Choices share one LinuxProbe; reading results back are hits too
+    linux = next(row for row in report["slowest_probes"] if row["probe"] == "LinuxProbe()")
+    assert linux["evaluations"] == 1 and linux["hits"] >= 5
+    assert report["probe_cache"]["hit_rate"] > 0.5
+    assert report["commands"] == {"brew": 2}
+    assert report["snapshot_caches"]["BrewInventory"]["misses"] == 1
+
+    write_report(profile, str(tmp_path / "profile.json"))
+    assert json.loads((tmp_path / "profile.json").read_text())["commands"] == {"brew": 2}
+
+    write_report(profile, "-")
+    output = capsys.readouterr().out
+    assert "installed CommandProbe('slow')" in output
+    assert "slow.yaml" in output
+
+
+def test_probe_profile_charges_snapshot_loads(tmp_path, monkeypatch, no_pipx_home, capsys):
+    from expand.evaluator import probe_evaluator
+    from expand.inventory import brew_inventory
+    from expand.probe_profile import ProbeProfile, write_report
+
+    # brew is slow, and loaded before the probes reading it run
+    _write_stub_command(tmp_path / "bin", "brew", "sleep 0.3\n[ \"$2\" = --formula ] && echo wget\nexit 0\n")
+    _write_stub_command(tmp_path / "bin", "git", "true\n")
+    monkeypatch.setenv("PATH", str(tmp_path / "bin") + os.pathsep + os.environ["PATH"])
+    brew_inventory.invalidate()
+
+    base = tmp_path / "ansible"
+    _write_playbooks(base / "tools", {
+        "wget": '[BrewPackageProbe("wget")]',
+        **{f"git{i}": f'[CommandProbe("git"), FileProbe("{tmp_path}/git{i}")]' for i in range(5)},
+    })
+
+    profile = probe_evaluator.profile = ProbeProfile()
+    try:
+        probe_evaluator.evaluate(list(_choices_from(base, tmp_path).values()))
+    finally:
+        probe_evaluator.profile = None
+        brew_inventory.invalidate()
+
+    report = profile.report()
+    assert report["snapshot_loads"]["brew"] >= 0.3
+    assert report["total_seconds"] >= 0.3
+    slowest = report["slowest_probes"][0]
+    assert (slowest["kind"], slowest["probe"]) == ("installed", "BrewPackageProbe('wget')")
+    assert slowest["seconds"] >= 0.3
+    assert report["playbooks"][0]["name"] == "wget.yaml"
+
+    write_report(profile, "-")
+    assert "Snapshot loads:" in capsys.readouterr().out
+
+
 def test_rust_yaml_probe_parsing():
     """Task 4.1: Verify rust.yaml parses correctly after removing AptProbe."""
     import os
@@ -1764,7 +3268,6 @@ def test_tui_visibility_on_macos():
     and cross-platform playbooks don't fail due to platform probes."""
     import os
     import glob
-    from unittest.mock import patch
     from expand.expansion_card import ExpansionCard
     from expand.probes import LinuxProbe, AptProbe, AmdProbe
 
@@ -1782,37 +3285,31 @@ def test_tui_visibility_on_macos():
 
     yaml_files = glob.glob(os.path.join(ansible_dir, "**", "*.yaml"), recursive=True)
 
-    # Mock platform to Darwin/arm64
-    with patch("expand.probes.platform") as mock_platform, \
-         patch("expand.probes.which") as mock_which:
+    # Pretend to be a Darwin/arm64 host with Homebrew
+    _fake_host(system="Darwin", machine="arm64", package_managers=frozenset({"brew"}))
+    for path in yaml_files:
+        basename = os.path.basename(path)
+        if basename == "example.yaml":
+            continue
 
-        mock_platform.system.return_value = "Darwin"
-        mock_platform.machine.return_value = "arm64"
-        mock_which.side_effect = lambda cmd: "/opt/homebrew/bin/brew" if cmd == "brew" else None
-
-        for path in yaml_files:
-            basename = os.path.basename(path)
-            if basename == "example.yaml":
-                continue
-
-            card = ExpansionCard(path)
-            probes = card.get_probes()
-
-            # Check only platform-gating probes
-            platform_failing = [
-                p for p in probes
-                if isinstance(p, platform_probe_types) and not p.is_compatible()
-            ]
-
-            if basename in linux_only:
-                assert len(platform_failing) > 0, (
-                    f"{basename} should be hidden on macOS but has no failing platform probes"
-                )
-            else:
-                failing_names = [type(p).__name__ for p in platform_failing]
-                assert len(platform_failing) == 0, (
-                    f"{basename} should be visible on macOS but has failing platform probes: {failing_names}"
-                )
+        card = ExpansionCard(path)
+        probes = card.get_probes()
+
+        # Check only platform-gating probes
+        platform_failing = [
+            p for p in probes
+            if isinstance(p, platform_probe_types) and not p.is_compatible()
+        ]
+
+        if basename in linux_only:
+            assert len(platform_failing) > 0, (
+                f"{basename} should be hidden on macOS but has no failing platform probes"
+            )
+        else:
+            failing_names = [type(p).__name__ for p in platform_failing]
+            assert len(platform_failing) == 0, (
+                f"{basename} should be visible on macOS but has failing platform probes: {failing_names}"
+            )
 
 
 def test_any_user_no_escalation_on_darwin_is_priviledge_level():
@@ -1825,7 +3322,7 @@ def test_any_user_no_escalation_on_darwin_is_priviledge_level():
 
 def test_should_hide_any_user_no_escalation_on_darwin_linux():
     """On Linux, AnyUserNoEscalationOnDarwin behaves like OnlyRoot — hidden when not root."""
-    from unittest.mock import patch, MagicMock
+    from unittest.mock import MagicMock
     from expand.curses_cli import curses_cli
     from expand.priviledge import AnyUserNoEscalationOnDarwin
 
@@ -1837,21 +3334,17 @@ def test_should_hide_any_user_no_escalation_on_darwin_linux():
     mock_choice.installed_status.return_value = "Not Installed"
 
     # On Linux, non-root → hidden
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=1000):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is True
+    _fake_host(system="Linux", uid=1000)
+    assert cli.should_hide(mock_choice) is True
 
     # On Linux, root → not hidden
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=0):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is False
+    _fake_host(system="Linux", uid=0)
+    assert cli.should_hide(mock_choice) is False
 
 
 def test_should_hide_any_user_no_escalation_on_darwin_macos():
     """On macOS, AnyUserNoEscalationOnDarwin: visible for regular users, hidden from root (brew refuses root)."""
-    from unittest.mock import patch, MagicMock
+    from unittest.mock import MagicMock
     from expand.curses_cli import curses_cli
     from expand.priviledge import AnyUserNoEscalationOnDarwin
 
@@ -1863,16 +3356,12 @@ def test_should_hide_any_user_no_escalation_on_darwin_macos():
     mock_choice.installed_status.return_value = "Not Installed"
 
     # On macOS, non-root → not hidden
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=501):
-        mock_platform.system.return_value = "Darwin"
-        assert cli.should_hide(mock_choice) is False
+    _fake_host(system="Darwin", uid=501)
+    assert cli.should_hide(mock_choice) is False
 
     # On macOS, root → hidden (brew can't run as root)
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=0):
-        mock_platform.system.return_value = "Darwin"
-        assert cli.should_hide(mock_choice) is True
+    _fake_host(system="Darwin", uid=0)
+    assert cli.should_hide(mock_choice) is True
 
 
 def test_playbook_parsing_with_new_privilege(tmp_path):
@@ -1931,6 +3420,57 @@ def test_grep_probe_binary_file(tmp_path):
     assert probe.is_installed() is False
 
 
+def test_grep_probe_invalid_utf8_with_match(tmp_path):
+    from expand.probes import GrepProbe
+
+    f = tmp_path / "latin1.conf"
+    f.write_bytes(b"caf\xe9\nalias ll='ls -l'\n")
+    assert GrepProbe(str(f), "alias ll").is_installed() is False
+
+
+def test_grep_probe_checks_utf8_in_chunks(tmp_path, monkeypatch):
+    from expand.inventory import GrepIndex
+    from expand.probes import GrepProbe
+
+    monkeypatch.setattr(GrepIndex, "CHUNK_SIZE", 4)
+
+    # "é" straddles a chunk boundary and is still valid
+    f = tmp_path / "split.conf"
+    f.write_bytes("caf\u00e9 alias ll='ls -l'\n".encode("UTF-8"))
+    assert GrepProbe(str(f), "alias ll").is_installed() is True
+
+    # A truncated sequence at the very end is not
+    f = tmp_path / "truncated.conf"
+    f.write_bytes(b"alias ll='ls -l'\n\xc3")
+    assert GrepProbe(str(f), "alias ll").is_installed() is False
+
+
+def test_grep_probes_share_one_scan_per_file(tmp_path):
+    from unittest.mock import patch
+    from expand.inventory import GrepIndex, grep_index
+    from expand.probes import GrepProbe
+
+    bashrc = tmp_path / ".bashrc"
+    bashrc.write_text("".join(f"export VAR{i}=1\n" for i in range(1000)))
+    probes = [GrepProbe(str(bashrc), f"export VAR{i}=") for i in range(0, 2000, 10)]
+
+    with patch.object(GrepIndex, "_scan", wraps=grep_index._scan) as mock_scan:
+        results = [probe.is_installed() for probe in probes]
+        assert results == [i < 1000 for i in range(0, 2000, 10)]
+        assert mock_scan.call_count == 1
+
+        # Unchanged file: answered from the cache
+        assert all(probe.is_installed() for probe in probes[:100])
+        assert mock_scan.call_count == 1
+
+        # A changed file is scanned again, once
+        bashrc.write_text("export VAR1990=1\n")
+        os.utime(bashrc, ns=(0, os.stat(bashrc).st_mtime_ns + 10**9))
+        assert probes[-1].is_installed() is True
+        assert probes[0].is_installed() is False
+        assert mock_scan.call_count == 2
+
+
 def test_group_member_probe_nonexistent_group():
     from expand.probes import GroupMemberProbe
 
@@ -2035,6 +3575,53 @@ def test_command_probe():
         assert probe.is_installed() is False
 
 
+def test_which_probe(tmp_path, monkeypatch):
+    from unittest.mock import patch
+    from expand.probes import WhichProbe
+
+    _write_stub_command(tmp_path / "bin", "fish", "true\n")
+    monkeypatch.setenv("PATH", str(tmp_path / "bin"))
+
+    with patch("subprocess.Popen", side_effect=AssertionError("forked")):
+        assert WhichProbe("fish").is_compatible() is True
+        assert WhichProbe("tmux").is_compatible() is False
+
+
+def test_path_index_lists_each_directory_once(tmp_path, monkeypatch):
+    from unittest.mock import patch
+    from expand import inventory
+    from expand.probes import CommandProbe, WhichProbe
+
+    dirs = [tmp_path / f"bin{i}" for i in range(4)]
+    for i, d in enumerate(dirs):
+        for j in range(50):
+            _write_stub_command(d, f"cmd{i}_{j}", "true\n")
+    (dirs[0] / "not_executable").write_text("")
+    (dirs[0] / "a_directory").mkdir()
+    monkeypatch.setenv("PATH", os.pathsep.join(str(d) for d in dirs))
+
+    inventory.new_round()
+    with patch("expand.inventory.os.scandir", wraps=os.scandir) as mock_scandir:
+        for i in range(4):
+            for j in range(50):
+                assert CommandProbe(f"cmd{i}_{j}").is_installed() is True
+                assert WhichProbe(f"cmd{i}_{j}").is_compatible() is True
+        assert CommandProbe("missing").is_installed() is False
+        assert CommandProbe("not_executable").is_installed() is False
+        assert CommandProbe("a_directory").is_installed() is False
+        assert mock_scandir.call_count == len(dirs)
+
+        # A new command only re-lists the directory that changed, next round
+        _write_stub_command(dirs[2], "fresh", "true\n")
+        os.utime(dirs[2], ns=(0, os.stat(dirs[2]).st_mtime_ns + 10**9))
+        inventory.new_round()
+        assert CommandProbe("fresh").is_installed() is True
+        assert mock_scandir.call_count == len(dirs) + 1
+
+    # Paths with a directory component are checked directly
+    assert inventory.path_index.which(str(dirs[0] / "cmd0_0")) == str(dirs[0] / "cmd0_0")
+
+
 def test_file_probe(tmp_path):
     from expand.probes import FileProbe
 
@@ -2047,6 +3634,96 @@ def test_file_probe(tmp_path):
     assert probe.is_installed() is False
 
 
+@pytest.fixture(autouse=True)
+def fresh_probe_round():
+    """
+    Every test is its own probe round on the real host, so memoized probe
+    results and faked host facts don't leak between tests.
+    """
+    from expand import inventory
+
+    inventory.new_round()
+    yield
+    inventory.set_host_facts(None)
+
+
+@pytest.fixture(autouse=True)
+def fresh_url_checker(monkeypatch):
+    """URL results are shared process-wide; give every test its own."""
+    from expand.url_checker import UrlChecker
+
+    checker = UrlChecker()
+    monkeypatch.setattr("expand.gui_elements.url_checker", checker)
+    monkeypatch.setattr("expand.curses_cli.url_checker", checker)
+    return checker
+
+
+@pytest.fixture(autouse=True)
+def isolated_file_hashes(tmp_path, monkeypatch):
+    """Keep FileMatchProbe's persistent hash cache out of the working tree."""
+    from expand.inventory import FileHashes, file_hashes
+
+    monkeypatch.setattr(FileHashes, "CACHE_FILE", str(tmp_path / "file_hashes.json"))
+    file_hashes.clear()
+    yield
+    file_hashes.clear()
+
+
+def test_file_probe_globs_match_glob_module(tmp_path, monkeypatch):
+    import glob
+    from expand import inventory
+
+    (tmp_path / "apps" / "Meld.app").mkdir(parents=True)
+    (tmp_path / "apps" / ".hidden.app").mkdir()
+    (tmp_path / "ssh").mkdir()
+    (tmp_path / "ssh" / "id_ed25519.pub").write_text("")
+    (tmp_path / "ssh" / "config").write_text("")
+    monkeypatch.chdir(tmp_path)
+
+    patterns = [
+        "apps/*.app", "apps/.*.app", "apps/Meld.app", "apps/Meld.app/", "apps/*.App",
+        "ssh/*.pub", "ssh/*.key", "*/id_*.pub", "*/config/", "[as]*/*", "missing/*",
+        str(tmp_path / "s?h" / "config"), "ssh/config",
+    ]
+    inventory.new_round()
+    for pattern in patterns:
+        assert sorted(inventory.dir_listings.iglob(pattern)) == sorted(glob.glob(pattern)), pattern
+
+
+def test_file_probe_lists_each_directory_once(tmp_path):
+    from unittest.mock import patch
+    from expand import inventory
+    from expand.probes import FileProbe
+
+    apps = tmp_path / "Applications"
+    bin_dir = tmp_path / "bin"
+    apps.mkdir()
+    bin_dir.mkdir()
+    for i in range(100):
+        (apps / f"App{i}.app").mkdir()
+        (bin_dir / f"tool{i}").write_text("")
+
+    inventory.new_round()
+    with patch("expand.inventory.os.scandir", wraps=os.scandir) as mock_scandir:
+        for i in range(0, 200, 2):
+            assert FileProbe(str(apps / f"App{i}*")).is_installed() is (i < 100)
+            assert FileProbe(str(bin_dir / f"tool{i}?")).is_installed() is (0 < i < 10)
+        assert mock_scandir.call_count == 2
+
+        # Literal paths are a stat, never a listing
+        assert FileProbe(str(apps / "App1.app")).is_installed() is True
+        assert FileProbe(str(apps / "Missing.app")).is_installed() is False
+        assert mock_scandir.call_count == 2
+
+        # Next round only the directory whose mtime changed is re-listed
+        (apps / "New.app").mkdir()
+        os.utime(apps, ns=(0, os.stat(apps).st_mtime_ns + 10**9))
+        inventory.new_round()
+        assert FileProbe(str(apps / "New*")).is_installed() is True
+        assert FileProbe(str(bin_dir / "tool5*")).is_installed() is True
+        assert mock_scandir.call_count == 3
+
+
 def test_file_match_probe_exact_match(tmp_path):
     from expand.probes import FileMatchProbe
 
@@ -2114,23 +3791,134 @@ def test_file_match_probe_binary_match(tmp_path):
     assert probe.is_installed() is True
 
 
-def test_apt_package_probe():
-    from unittest.mock import patch, MagicMock
-    from expand.probes import AptPackageProbe
+def _file_match_probe(source, dest):
+    from expand.probes import FileMatchProbe
+
+    probe = FileMatchProbe.__new__(FileMatchProbe)
+    probe.source = str(source)
+    probe.dest = str(dest)
+    return probe
 
-    probe = AptPackageProbe("bash")
 
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=0)
+def test_file_match_probe_size_mismatch_never_reads(tmp_path):
+    from unittest.mock import patch
+
+    source = tmp_path / "source.conf"
+    dest = tmp_path / "dest.conf"
+    source.write_text("a" * 100)
+    dest.write_text("a" * 101)
+
+    with patch("expand.inventory.open", side_effect=AssertionError("read")):
+        assert _file_match_probe(source, dest).is_installed() is False
+
+
+def test_file_match_probe_chunked_mismatch(tmp_path, monkeypatch):
+    from expand.inventory import FileHashes
+
+    monkeypatch.setattr(FileHashes, "CHUNK_SIZE", 16)
+    source = tmp_path / "source.conf"
+    dest = tmp_path / "dest.conf"
+    data = bytes(range(256)) * 10
+    source.write_bytes(data)
+    dest.write_bytes(data[:-1] + b"x")
+
+    assert _file_match_probe(source, dest).is_installed() is False
+    dest.write_bytes(data)
+    assert _file_match_probe(source, dest).is_installed() is True
+
+
+def test_file_match_probe_hashes_persist_across_runs(tmp_path):
+    import json
+    from unittest.mock import patch
+    from expand.evaluator import probe_evaluator
+    from expand.inventory import FileHashes, file_hashes
+
+    source = tmp_path / "source.conf"
+    dest = tmp_path / "dest.conf"
+    source.write_text("line\n" * 10000)
+    dest.write_text("line\n" * 10000)
+    probe = _file_match_probe(source, dest)
+
+    # Digests are written once per probe round, not per probe
+    assert probe.is_installed() is True
+    assert not os.path.exists(FileHashes.CACHE_FILE)
+    probe_evaluator.evaluate([])
+    with open(FileHashes.CACHE_FILE, encoding="UTF-8") as file:
+        assert len(json.load(file)) == 2
+
+    # A new run reloads the digests from disk and never opens either file
+    file_hashes.clear()
+    with patch("expand.inventory.open", wraps=open) as mock_open:
         assert probe.is_installed() is True
-        mock_run.assert_called_once_with(
-            ["dpkg", "-s", "bash"],
-            capture_output=True, check=False
+        opened = [call.args[0] for call in mock_open.call_args_list]
+        assert opened == [FileHashes.CACHE_FILE]
+
+    # Editing the deployed file (same size, new mtime) invalidates its digest
+    dest.write_text("LINE\n" + "line\n" * 9999)
+    assert probe.is_installed() is False
+
+
+@pytest.fixture
+def dpkg_status_file(tmp_path, monkeypatch):
+    """A synthetic dpkg status file with 5,000 packages, every 5th one removed."""
+    from expand.inventory import DpkgStatus, dpkg_status
+
+    stanzas = []
+    for i in range(5000):
+        status = "deinstall ok config-files" if i % 5 == 0 else "install ok installed"
+        stanzas.append(
+            f"Package: pkg{i}\n"
+            f"Status: {status}\n"
+            f"Priority: optional\n"
+            f"Description: package number {i}\n"
+            f" with a continuation line\n"
         )
+    path = tmp_path / "status"
+    path.write_text("\n".join(stanzas))
 
-    with patch("expand.probes.subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=1)
-        assert probe.is_installed() is False
+    monkeypatch.setattr(DpkgStatus, "STATUS_FILE", str(path))
+    dpkg_status.invalidate()
+    yield path
+    dpkg_status.invalidate()
+
+
+def test_apt_package_probe(dpkg_status_file):
+    from unittest.mock import patch
+    from expand.probes import AptPackageProbe
+
+    with patch("expand.inventory.subprocess.Popen", side_effect=AssertionError("forked")):
+        assert AptPackageProbe("pkg1").is_installed() is True
+        assert AptPackageProbe("pkg4999").is_installed() is True
+        assert AptPackageProbe("pkg1:amd64").is_installed() is True
+        # Removed but config files left behind → not installed
+        assert AptPackageProbe("pkg0").is_installed() is False
+        assert AptPackageProbe("pkg5000").is_installed() is False
+
+
+def test_dpkg_status_parsed_once_and_invalidated_by_mtime(dpkg_status_file):
+    from unittest.mock import patch
+    from expand.inventory import DpkgStatus, dpkg_status
+
+    with patch.object(DpkgStatus, "load", wraps=dpkg_status.load) as mock_load:
+        for i in range(1, 100):
+            dpkg_status.is_installed(f"pkg{i}")
+        assert mock_load.call_count == 1
+
+        # dpkg touched the database → re-read on next lookup
+        dpkg_status_file.write_text("Package: newpkg\nStatus: install ok installed\n")
+        os.utime(dpkg_status_file, ns=(0, os.stat(dpkg_status_file).st_mtime_ns + 10**9))
+        assert dpkg_status.is_installed("newpkg") is True
+        assert dpkg_status.is_installed("pkg1") is False
+        assert mock_load.call_count == 2
+
+
+def test_dpkg_status_missing_file(tmp_path, monkeypatch):
+    from expand.inventory import DpkgStatus, dpkg_status
+
+    monkeypatch.setattr(DpkgStatus, "STATUS_FILE", str(tmp_path / "nope"))
+    dpkg_status.invalidate()
+    assert dpkg_status.is_installed("bash") is False
+    dpkg_status.invalidate()
 
 
 # =============================================================================
@@ -2140,7 +3928,7 @@ def test_apt_package_probe():
 
 def test_should_hide_only_root():
     """OnlyRoot items are hidden when not root, visible when root."""
-    from unittest.mock import patch, MagicMock
+    from unittest.mock import MagicMock
     from expand.curses_cli import curses_cli
     from expand.priviledge import OnlyRoot
 
@@ -2152,21 +3940,17 @@ def test_should_hide_only_root():
     mock_choice.installed_status.return_value = "Not Installed"
 
     # Non-root → hidden
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=1000):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is True
+    _fake_host(system="Linux", uid=1000)
+    assert cli.should_hide(mock_choice) is True
 
     # Root → not hidden
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=0):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is False
+    _fake_host(system="Linux", uid=0)
+    assert cli.should_hide(mock_choice) is False
 
 
 def test_should_hide_failing_probes():
     """Items with failing probes are always hidden."""
-    from unittest.mock import patch, MagicMock
+    from unittest.mock import MagicMock
     from expand.curses_cli import curses_cli
     from expand.priviledge import AnyUserEscalation
 
@@ -2177,15 +3961,13 @@ def test_should_hide_failing_probes():
     mock_choice.failing_probes.return_value = ["some failing probe"]
     mock_choice.installed_status.return_value = "Not Installed"
 
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=0):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is True
+    _fake_host(system="Linux", uid=0)
+    assert cli.should_hide(mock_choice) is True
 
 
 def test_should_hide_installed():
     """Installed items are hidden."""
-    from unittest.mock import patch, MagicMock
+    from unittest.mock import MagicMock
     from expand.curses_cli import curses_cli
     from expand.priviledge import AnyUserEscalation
 
@@ -2196,15 +3978,13 @@ def test_should_hide_installed():
     mock_choice.failing_probes.return_value = []
     mock_choice.installed_status.return_value = "Installed"
 
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=0):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is True
+    _fake_host(system="Linux", uid=0)
+    assert cli.should_hide(mock_choice) is True
 
 
 def test_should_hide_any_user_escalation_visible():
     """AnyUserEscalation items are visible to both root and non-root (no privilege hiding)."""
-    from unittest.mock import patch, MagicMock
+    from unittest.mock import MagicMock
     from expand.curses_cli import curses_cli
     from expand.priviledge import AnyUserEscalation
 
@@ -2216,16 +3996,12 @@ def test_should_hide_any_user_escalation_visible():
     mock_choice.installed_status.return_value = "Not Installed"
 
     # Non-root → still visible
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=1000):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is False
+    _fake_host(system="Linux", uid=1000)
+    assert cli.should_hide(mock_choice) is False
 
     # Root → visible
-    with patch("expand.curses_cli.platform") as mock_platform, \
-         patch("expand.curses_cli.os.getuid", return_value=0):
-        mock_platform.system.return_value = "Linux"
-        assert cli.should_hide(mock_choice) is False
+    _fake_host(system="Linux", uid=0)
+    assert cli.should_hide(mock_choice) is False
 
 
 def test_list_presets(tmp_path):